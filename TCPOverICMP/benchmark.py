@@ -0,0 +1,300 @@
+"""
+benchmark.py
+
+This module provides microbenchmarks of the per-packet primitives of the tunnel, the code every packet goes through.
+Each benchmark reports the time per operation and the peak memory allocated per operation, and is compared against
+a committed baseline so a change that slows down the hot path is caught before it is merged.
+The peak is the most memory a call held at once (tracemalloc), a temporary freed before the peak is not counted,
+so it catches copies of the packet that live together rather than every allocation.
+
+Times are compared relative to a calibration benchmark (a plain Python loop) run in the same process,
+so a baseline recorded on one machine can be checked on another.
+
+Key Components:
+- Benchmark: A named operation and how to set it up.
+- BenchmarkResult: ns/op and peak allocated bytes/op of a benchmark.
+- BENCHMARKS: The tunnel packet, ICMP packet and frame, checksum and ClientSession.write benchmarks.
+
+Main Methods:
+- run_benchmarks: Measures the benchmarks.
+- compare: Returns the benchmarks that regressed past the thresholds compared to a baseline.
+- load_baseline / save_baseline: Read and write the committed baseline.
+
+Usage:
+- python -m TCPOverICMP.benchmark: the timing and allocation gate, exits with 1 on a regression
+- python -m TCPOverICMP.benchmark --update-baseline
+- test_benchmark.py checks the peak allocations, and the timings too with TCPOVERICMP_BENCHMARK=1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from TCPOverICMP.client_session import ClientSession
+from TCPOverICMP.icmp_packet import ICMPPacket, ICMPType
+from TCPOverICMP.simulator import SinkWriter
+from TCPOverICMP.tunnel_packet import ICMPTunnelPacket, Action, Direction
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+CALIBRATION = 'calibration'
+TIME_THRESHOLD = 1.5 #a benchmark regresses when it is this many times slower than the baseline
+ALLOCATION_THRESHOLD = 1.25 #or when its peak allocation is this many times larger
+ALLOCATION_SLACK = 64 #bytes/op, peak allocation differences smaller than this are noise
+
+
+class Benchmark:
+    def __init__(self, name: str, setup, ops_per_call: int = 1):
+        """
+        @param setup: called once, returns the function to time, called without arguments
+        @param ops_per_call: the number of operations each call of the timed function does
+        """
+        self.name = name
+        self.setup = setup
+        self.ops_per_call = ops_per_call
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, ns_per_op: float, peak_bytes_per_op: float):
+        self.name = name
+        self.ns_per_op = ns_per_op
+        self.peak_bytes_per_op = peak_bytes_per_op
+
+    def to_dict(self):
+        return {'ns_per_op': round(self.ns_per_op, 1), 'peak_bytes_per_op': round(self.peak_bytes_per_op, 1)}
+
+    def __repr__(self):
+        return f'{self.name:<45} {self.ns_per_op:>12.1f} ns/op {self.peak_bytes_per_op:>10.1f} peak B/op'
+
+
+def calibration():
+    """
+    a plain interpreted loop, the work the codecs do per byte
+    """
+    def loop():
+        total = 0
+        for i in range(100):
+            total += i
+        return total
+    return loop
+
+
+def tunnel_packet(payload_size: int):
+    return ICMPTunnelPacket(1, Action.DATA_TRANSFER, Direction.PROXY_SERVER, 1, '', 0, bytes(payload_size))
+
+
+def tunnel_serialize(payload_size: int):
+    def setup():
+        return tunnel_packet(payload_size).serialize
+    return setup
+
+
+def tunnel_deserialize(payload_size: int):
+    def setup():
+        data = tunnel_packet(payload_size).serialize()
+        return lambda: ICMPTunnelPacket.deserialize(data)
+    return setup
+
+
+def icmp_packet(payload_size: int):
+    return ICMPPacket(ICMPType.EchoRequest, 0xbeef, 0, tunnel_packet(payload_size).serialize())
+
+
+def icmp_serialize(payload_size: int):
+    def setup():
+        return icmp_packet(payload_size).serialize
+    return setup
+
+
+def icmp_frame(payload_size: int):
+    def setup():
+        packet = tunnel_packet(payload_size)
+        return lambda: ICMPPacket.frame(ICMPType.EchoRequest, 0xbeef, 0, packet)
+    return setup
+
+
+def icmp_set_identifier(payload_size: int):
+    """
+    moving a frame to another ICMP flow, as a resend does
+    """
+    def setup():
+        frame = ICMPPacket.frame(ICMPType.EchoRequest, 0xbeef, 0, tunnel_packet(payload_size))
+        identifiers = [0xbeef, 0xbef0]
+        flow = [0]
+
+        def set_identifier():
+            flow[0] ^= 1
+            ICMPPacket.set_identifier(frame, identifiers[flow[0]])
+        return set_identifier
+    return setup
+
+
+def icmp_deserialize(payload_size: int):
+    def setup():
+        data = icmp_packet(payload_size).serialize()
+        return lambda: ICMPPacket.deserialize(data, '10.0.0.1')
+    return setup
+
+
+def checksum(size: int):
+    def setup():
+        data = bytes(random.Random(size).getrandbits(8) for _ in range(size))
+        return lambda: ICMPPacket.compute_checksum(data)
+    return setup
+
+
+def session_write(window: int):
+    """
+    writes of window packets arriving in a shuffled order
+    """
+    def setup():
+        session = ClientSession(0, None, SinkWriter(lambda size: None))
+        order = list(range(window))
+        random.Random(window).shuffle(order)
+        data = bytes(ClientSession.DATA_SIZE)
+        base = [session.last_written + 1]
+
+        def write_window():
+            for offset in order:
+                run_to_completion(session.write(base[0] + offset, data))
+            base[0] += window
+        return write_window
+    return setup
+
+
+def run_to_completion(coroutine):
+    """
+    run a coroutine that never suspends without an event loop
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError('benchmarked coroutine suspended')
+
+
+BENCHMARKS = [
+    Benchmark(CALIBRATION, calibration),
+    Benchmark('ICMPTunnelPacket.serialize[1400]', tunnel_serialize(ClientSession.DATA_SIZE)),
+    Benchmark('ICMPTunnelPacket.deserialize[1400]', tunnel_deserialize(ClientSession.DATA_SIZE)),
+    Benchmark('ICMPPacket.serialize[0]', icmp_serialize(0)),
+    Benchmark('ICMPPacket.serialize[1400]', icmp_serialize(ClientSession.DATA_SIZE)),
+    Benchmark('ICMPPacket.frame[1400]', icmp_frame(ClientSession.DATA_SIZE)),
+    Benchmark('ICMPPacket.set_identifier[1400]', icmp_set_identifier(ClientSession.DATA_SIZE)),
+    Benchmark('ICMPPacket.deserialize[0]', icmp_deserialize(0)),
+    Benchmark('ICMPPacket.deserialize[1400]', icmp_deserialize(ClientSession.DATA_SIZE)),
+    Benchmark('ICMPPacket.compute_checksum[64]', checksum(64)),
+    Benchmark('ICMPPacket.compute_checksum[576]', checksum(576)),
+    Benchmark('ICMPPacket.compute_checksum[1500]', checksum(1500)),
+    Benchmark('ClientSession.write[shuffled 64]', session_write(64), ops_per_call=64),
+]
+
+
+def time_calls(function, calls: int):
+    started_at = time.perf_counter_ns()
+    for _ in range(calls):
+        function()
+    return time.perf_counter_ns() - started_at
+
+
+def measure(benchmark: Benchmark, min_time: float = 0.1, repeat: int = 5, allocation_samples: int = 5):
+    """
+    returns the BenchmarkResult of a benchmark.
+    @param min_time: seconds every timing repeat runs for at least
+    @param repeat: the fastest of repeat timings is reported
+    @param allocation_samples: the smallest peak allocation of allocation_samples calls is reported
+    """
+    function = benchmark.setup()
+    calls = 1
+    while time_calls(function, calls) < min_time * 1e9:
+        calls *= 2
+    ns_per_op = min(time_calls(function, calls) for _ in range(repeat)) / calls / benchmark.ops_per_call
+
+    allocations = []
+    for _ in range(allocation_samples):
+        tracemalloc.start()
+        try:
+            function()
+            allocations.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return BenchmarkResult(benchmark.name, ns_per_op, min(allocations) / benchmark.ops_per_call)
+
+
+def run_benchmarks(benchmarks=None, min_time: float = 0.1, repeat: int = 5):
+    """
+    returns: benchmark name: BenchmarkResult
+    """
+    return {
+        benchmark.name: measure(benchmark, min_time, repeat)
+        for benchmark in (benchmarks if benchmarks is not None else BENCHMARKS)
+    }
+
+
+def load_baseline(path: str = BASELINE_PATH):
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(results: dict, path: str = BASELINE_PATH):
+    with open(path, 'w') as baseline_file:
+        json.dump({name: result.to_dict() for name, result in results.items()}, baseline_file, indent=4)
+        baseline_file.write('\n')
+
+
+def compare(results: dict, baseline: dict, time_threshold: float = TIME_THRESHOLD,
+            allocation_threshold: float = ALLOCATION_THRESHOLD):
+    """
+    returns a list of descriptions of the benchmarks that regressed compared to the baseline.
+    times are compared relative to the calibration benchmark of each run.
+    @param time_threshold: the slowdown that is a regression, None to compare the peak allocations only
+    """
+    scale = results[CALIBRATION].ns_per_op / baseline[CALIBRATION]['ns_per_op']
+    regressions = []
+    for name, result in results.items():
+        if name == CALIBRATION or name not in baseline:
+            continue
+        expected = baseline[name]
+        slowdown = result.ns_per_op / (expected['ns_per_op'] * scale)
+        if time_threshold is not None and slowdown > time_threshold:
+            regressions.append(f'{name}: {slowdown:.2f}x slower than the baseline')
+        if result.peak_bytes_per_op > expected['peak_bytes_per_op'] * allocation_threshold + ALLOCATION_SLACK:
+            regressions.append(
+                f"{name}: peak allocation {result.peak_bytes_per_op:.0f} B/op, "
+                f"baseline {expected['peak_bytes_per_op']:.0f} B/op"
+            )
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='microbenchmarks of the per-packet code of the tunnel')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file to compare against')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=TIME_THRESHOLD,
+                        help='slowdown compared to the baseline that fails the run')
+    parser.add_argument('--min-time', type=float, default=0.1, help='seconds every timing runs for at least')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = run_benchmarks(min_time=args.min_time)
+    for result in results.values():
+        print(result)
+
+    if args.update_baseline:
+        save_baseline(results, args.baseline)
+        print(f'baseline written to {args.baseline}')
+        return
+
+    regressions = compare(results, load_baseline(args.baseline), args.threshold)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,116 +2,337 @@
 client_manager.py
 
 This module defines the ClientManager class, responsible for managing multiple client sessions. It handles adding, 
-removing, reading from, and writing to clients asynchronously. Each client session is tracked with a unique session ID.
+removing, reading from, and writing to clients asynchronously. Each client session is tracked with a unique session key,
+(peer ip, session ID), so the sessions of many peers can be managed together.
 
 Key Components:
-- ClientHandler: Represents a client session and its associated reading task.
+- ClientHandler: Represents a client session, its reading task, its writing task and its bounded inbox,
+  and the bytes it buffers.
 - ClientManager: Manages all client sessions and handles communication with each client.
+- buffer budget: The bytes buffered by all sessions are accounted: data received for a client and not written to it
+  yet (its inbox and its reorder buffer), and data read from a client and not acked by the peer yet (at most
+  SEND_BUFFER per session, reading pauses above it). Once the budget is exceeded, the largest sessions are shed
+  and new sessions are refused, so memory stays bounded however many sessions are open.
+- idle timeout: A session nothing was read from or written to for idle_timeout is terminated.
 
 Main Methods:
-- add_client: Adds a new client and starts reading from it asynchronously.
-- remove_client: Removes a client session and cancels its task.
-- write_to_client: Writes data to a specific client session in the correct sequence.
+- add_client: Adds a new client and starts reading from and writing to it asynchronously.
+- remove_client: Removes a client session, flushes its inbox and cancels its tasks.
+- remove_peer_clients: Removes all the client sessions of a peer at once, used when the peer is dead.
+- write_to_client: Hands data to the inbox of a specific client session without blocking.
 - read_from_client: Continuously reads data from a client and places it in the input queue.
+- write_inbox_to_client: Continuously writes the inbox of a client to it in the correct sequence.
+- data_sent: Data read from a client left the tunnel (it was acked or given up on), releasing its buffer.
+- over_budget: Whether new sessions are refused.
+- reap_idle_clients: Terminates the idle sessions.
+- close_client: Queues a session to be terminated, once. Every termination (the client closed, idle, shed, or its
+  data could not be sent) goes through it.
 """
 
 import asyncio
+import collections
 import logging
 from TCPOverICMP import exceptions
 from TCPOverICMP.client_session import ClientSession
+from TCPOverICMP.log_setup import packet_log
 log = logging.getLogger(__name__)
 
 
 class ClientHandler:
     def __init__(self,
                  session: ClientSession,
-                 task: asyncio.Task):
+                 task: asyncio.Task,
+                 writer_task: asyncio.Task,
+                 inbox: asyncio.Queue,
+                 destination: tuple = None):
         self.session = session
+        self.destination = destination #(host, port) the session was opened to, if known
         self.task = task
-        
+        self.writer_task = writer_task
+        self.inbox = inbox
+        self.buffered = 0 #bytes received for the client and not written to it yet
+        self.unacked = 0 #bytes read from the client and not acked by the peer yet
+        self.send_room = asyncio.Event() #set while unacked is below SEND_BUFFER
+        self.send_room.set()
+        self.last_active = asyncio.get_event_loop().time()
+        self.closing = False #queued to be terminated, by the idle timeout or the buffer budget
+        self.removed = False #its bytes are no longer accounted
+
+    def buffered_bytes(self):
+        return self.buffered + self.unacked
 
 
 class ClientManager:
     """
     manages all client sessions.
+    every session has its own bounded inbox and writer task, so a slow client can't block the others.
     """
+    INBOX_SIZE = 64 #packets waiting to be written per session
+    FLUSH_TIMEOUT = 1.0 #time given to a removed session to write its inbox
+    SEND_BUFFER = 256 * 1024 #bytes read from a client and not acked yet, reading pauses above it
+    IDLE_TIMEOUT = 900.0
+    BUFFER_BUDGET = 64 * 1024 * 1024 #bytes buffered by all the sessions
     def __init__(
             self,
             timed_out_connections: asyncio.Queue,
-            tcp_input_packets: asyncio.Queue
+            tcp_input_packets: asyncio.Queue,
+            idle_timeout: float = None,
+            buffer_budget: int = None,
     ):
+        """
+        @param idle_timeout: seconds a session may be idle before it is terminated, IDLE_TIMEOUT by default, 0 never
+        @param buffer_budget: bytes all the sessions may buffer, BUFFER_BUDGET by default
+        """
         self.clients = {}
+        self.peer_sessions = collections.Counter() #peer ip: number of clients
         self.timed_out_connections = timed_out_connections
+        self.timed_out_sessions = set() #sessions in timed_out_connections, queued once however many times they fail
         self.tcp_input_packets = tcp_input_packets
+        self.idle_timeout = idle_timeout if idle_timeout is not None else self.IDLE_TIMEOUT
+        self.buffer_budget = buffer_budget if buffer_budget is not None else self.BUFFER_BUDGET
+        self.buffered_bytes = 0
 
-    def client_exists(self, session_id: int):
+    def client_exists(self, session_key: tuple):
         """
         returns if client exists
         """
-        return session_id in self.clients.keys()
+        return session_key in self.clients.keys()
 
-    def add_client(self, session_id: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    def client_destination(self, session_key: tuple):
         """
-        adds a client, a task is created to read from the flient asychronycally.
-        @param session_id: the client to add, reader ,writer to create a client session
+        returns the (host, port) a client was opened to, None if it was not given
         """
-        if self.client_exists(session_id):
+        return self.clients[session_key].destination
+
+    def peer_session_count(self, peer: str):
+        """
+        returns the number of clients of a peer
+        """
+        return self.peer_sessions[peer]
+
+    def add_client(self, session_key: tuple, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                   destination: tuple = None):
+        """
+        adds a client, tasks are created to read from and write to the client asychronycally.
+        @param session_key: the client to add, reader ,writer to create a client session
+        @param destination: the (host, port) the session was opened to
+        """
+        if self.client_exists(session_key):
             raise exceptions.ClientSessionAlreadyON()
 
-        new_client_session = ClientSession(session_id, reader, writer)
-        new_task = asyncio.create_task(self.read_from_client(session_id))
-        self.clients[session_id] = ClientHandler(new_client_session, new_task)
-        log.debug(f'added client: session_id={session_id}')
+        new_client_session = ClientSession(session_key, reader, writer)
+        new_task = asyncio.create_task(self.read_from_client(session_key))
+        new_writer_task = asyncio.create_task(self.write_inbox_to_client(session_key))
+        inbox = asyncio.Queue(maxsize=self.INBOX_SIZE)
+        self.clients[session_key] = ClientHandler(new_client_session, new_task, new_writer_task, inbox, destination)
+        self.peer_sessions[session_key[0]] += 1
+        log.debug(f'added client: session_key={session_key}')
 
-    async def remove_client(self, session_id: int):
+    async def remove_client(self, session_key: tuple, flush: bool = True):
         """
-        remove a client, doing so by canceling task of cloent 
-        @param session_id: the session_id to remove
+        remove a client, doing so by canceling tasks of client.
+        data already in the inbox is given FLUSH_TIMEOUT to be written before closing.
+        @param session_key: the session_key to remove
+        @param flush: write the inbox before closing, a shed client is closed right away
         """
-        if not self.client_exists(session_id):
-            raise exceptions.RemoveNonExistClient(session_id, self.clients.keys())
-            
+        if not self.client_exists(session_key):
+            raise exceptions.RemoveNonExistClient(session_key, self.clients.keys())
+
+        log.debug(f'removing client session: (session_key={session_key})')
+        client = self.clients.pop(session_key)
+        #the bytes of a removed client are freed once its tasks end, they are no longer accounted
+        client.removed = True
+        self.buffered_bytes -= client.buffered_bytes()
+        self.peer_sessions[session_key[0]] -= 1
+        if not self.peer_sessions[session_key[0]]:
+            del self.peer_sessions[session_key[0]]
+        client.task.cancel()
+        await self.wait_task(session_key, client.task)
+        if flush and not client.writer_task.done():
+            try:
+                await asyncio.wait_for(client.inbox.join(), self.FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                log.debug(f'(session_key={session_key}): dropping {client.inbox.qsize()} unwritten packets')
+        client.writer_task.cancel()
+        await self.wait_task(session_key, client.writer_task)
+        await client.session.stop()
 
-        log.debug(f'removing client session: (session_id={session_id})')
-        self.clients[session_id].task.cancel()
-        await self.clients[session_id].task
-        await self.clients[session_id].session.stop()
-        self.clients.pop(session_id)
+    async def wait_task(self, session_key: tuple, task: asyncio.Task):
+        """
+        wait for a reading or writing task of a removed client to end.
+        an error it failed with is logged, the client is removed either way.
+        """
+        await asyncio.wait((task,))
+        if not task.cancelled() and task.exception() is not None:
+            log.warning(f'(session_key={session_key}): {task.get_coro().__name__} failed: {task.exception()!r}')
 
-    async def write_to_client(self, session_id: int, seq: int, data: bytes):
+    async def remove_peer_clients(self, peer: str):
+        """
+        remove all the clients of a peer, concurrently so their inboxes are flushed together.
+        @param peer: the peer ip
         """
-        function for writing to a managed client , writes to the existing client sesstion
-        from the app client uses (for example browser)
-        @param session_id: thr client id of the client to writye to.
+        async def remove_if_exists(session_key):
+            #a client may be removed on its own before its removal starts
+            if self.client_exists(session_key):
+                await self.remove_client(session_key)
+
+        session_keys = [session_key for session_key in self.clients if session_key[0] == peer]
+        await asyncio.gather(*(remove_if_exists(session_key) for session_key in session_keys))
+
+    def write_to_client(self, session_key: tuple, seq: int, data: bytes):
+        """
+        function for writing to a managed client , puts the data in the inbox of the existing client session
+        without waiting for the app client (for example browser) to read it.
+        @param session_key: thr client key of the client to writye to.
         @param seq: the sequence number of the write. for correct order of the packets.
         @param data: the data to write.
+        returns: True if the data was queued, False if the inbox of the client is full.
         """
-        if not self.client_exists(session_id):
+        if not self.client_exists(session_key):
             raise exceptions.WriteNonExistentClient()
 
+        client = self.clients[session_key]
+        if client.closing:
+            return False
         try:
-            await self.clients[session_id].session.write(seq, data)
-        except exceptions.ClientConnectionClosed:
-            await self.timed_out_connections.put(session_id)
+            client.inbox.put_nowait((seq, data))
+        except asyncio.QueueFull:
+            packet_log.debug('(session_key=%s): inbox full, dropping packet with sequence %s', session_key, seq)
+            return False
+        client.last_active = asyncio.get_event_loop().time()
+        self.account(client, buffered=len(data))
+        return True
+
+    def account(self, client: ClientHandler, buffered: int = 0, unacked: int = 0):
+        """
+        update the bytes a client buffers, shedding the largest clients if the budget is exceeded.
+        """
+        client.buffered += buffered
+        client.unacked += unacked
+        if client.removed:
+            return
+        self.buffered_bytes += buffered + unacked
+        if buffered + unacked > 0 and self.buffered_bytes > self.buffer_budget:
+            self.shed_clients()
+
+    def over_budget(self):
+        """
+        returns whether the sessions buffer the whole budget, new sessions are refused until they are under it.
+        """
+        return self.buffered_bytes >= self.buffer_budget
+
+    def shed_clients(self):
+        """
+        remove the clients buffering the most bytes until the budget is met.
+        they are terminated like a closed client, their buffers are dropped right away.
+        """
+        #the clients already closing free their bytes soon
+        excess = self.buffered_bytes - self.buffer_budget - sum(
+            client.buffered_bytes() for client in self.clients.values() if client.closing
+        )
+        for session_key, client in sorted(self.clients.items(), key=lambda item: item[1].buffered_bytes(), reverse=True):
+            if excess <= 0:
+                break
+            if client.closing:
+                continue
+            log.info(f'(session_key={session_key}): buffer budget exceeded, shedding {client.buffered_bytes()} bytes')
+            excess -= client.buffered_bytes()
+            self.close_client(session_key)
+            asyncio.create_task(self.remove_client(session_key, flush=False))
+
+    def close_client(self, session_key: tuple):
+        """
+        queue a client to be terminated, once however many times it fails. every termination is queued here.
+        """
+        if session_key in self.timed_out_sessions:
+            return
+        self.timed_out_sessions.add(session_key)
+        if self.client_exists(session_key):
+            self.clients[session_key].closing = True
+        self.timed_out_connections.put_nowait(session_key)
+
+    def client_terminated(self, session_key: tuple):
+        """
+        the termination of a client queued by close_client is done, it may be queued again.
+        """
+        self.timed_out_sessions.discard(session_key)
+
+    def data_sent(self, session_key: tuple, size: int):
+        """
+        data read from a client was acked by the peer or given up on, it is no longer buffered.
+        """
+        if not self.client_exists(session_key):
+            return
+        client = self.clients[session_key]
+        self.account(client, unacked=-size)
+        if client.unacked < self.SEND_BUFFER:
+            client.send_room.set()
+
+    async def reap_idle_clients(self):
+        """
+        terminate the clients nothing was read from or written to for idle_timeout.
+        """
+        if not self.idle_timeout:
+            return
+        while True:
+            await asyncio.sleep(self.idle_timeout / 4)
+            now = asyncio.get_event_loop().time()
+            for session_key, client in list(self.clients.items()):
+                if not client.closing and now - client.last_active >= self.idle_timeout:
+                    log.debug(f'(session_key={session_key}): idle for {now - client.last_active:.0f}s, terminating')
+                    self.close_client(session_key)
+
+    async def write_inbox_to_client(self, session_key: tuple):
+        """
+        always write the inbox of a client to it, in sequence.
+        @param session_key: the client to write to.
+        """
+        if not self.client_exists(session_key):
+            raise exceptions.WriteNonExistentClient()
+
+        client = self.clients[session_key]
+
+        try:
+            while True:
+                seq, data = await client.inbox.get()
+                reordered = client.session.buffered
+                try:
+                    await client.session.write(seq, data)
+                except exceptions.ClientConnectionClosed:
+                    self.close_client(session_key)
+                    return
+                finally:
+                    #the data left the inbox, either written, or held by the session until the data before it arrives
+                    self.account(client, buffered=client.session.buffered - reordered - len(data))
+                    client.inbox.task_done()
+        except asyncio.CancelledError:
+            pass
 
-    async def read_from_client(self, session_id: int):
+    async def read_from_client(self, session_key: tuple):
         """
         always read from client, and puts in tcp_input_packets queue.
-        @param session_id: the client to read from.
+        @param session_key: the client to read from.
         """
-        if not self.client_exists(session_id):
+        if not self.client_exists(session_key):
             raise exceptions.ReadNonExistentClient()
 
-        client = self.clients[session_id].session
+        handler = self.clients[session_key]
+        client = handler.session
 
         try:
             while True:
+                #the peer acks the data read so far before more is read
+                await handler.send_room.wait()
                 try:
                     data = await client.read()
                 except exceptions.ClientConnectionClosed:
-                    await self.timed_out_connections.put(session_id)
+                    self.close_client(session_key)
                     return
 
-                await self.tcp_input_packets.put((data, client.session_id, next(client.seq)))
+                handler.last_active = asyncio.get_event_loop().time()
+                self.account(handler, unacked=len(data))
+                if handler.unacked >= self.SEND_BUFFER:
+                    handler.send_room.clear()
+                await self.tcp_input_packets.put((data, session_key, next(client.seq)))
         except asyncio.CancelledError:
             pass
\ No newline at end of file
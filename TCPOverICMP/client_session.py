@@ -9,7 +9,8 @@ Key Components:
 - reader: An asyncio StreamReader for receiving data from the client.
 - writer: An asyncio StreamWriter for sending data to the client.
 - seq: A sequence number generator to track the order of packets.
-- packets: A dictionary to store packets that are queued for writing.
+- packets: A dictionary to store packets that are queued for writing, until the packets before them arrive.
+- buffered: The bytes of the packets.
 
 Main Methods:
 - stop: Closes the client session by shutting down the underlying socket.
@@ -20,6 +21,7 @@ import asyncio
 import logging
 import itertools
 from TCPOverICMP import exceptions
+from TCPOverICMP.log_setup import packet_log
 
 log = logging.getLogger(__name__)
 
@@ -39,6 +41,7 @@ class ClientSession:
         self.seq = itertools.count(self.SEQUENCE_INIT) #handled by ClientManager
         self.last_written = self.SEQUENCE_INIT - 1
         self.packets = {}
+        self.buffered = 0
 
     async def stop(self):
         """
@@ -46,7 +49,10 @@ class ClientSession:
         """
         log.debug(f'(session_id={self.session_id}): CLOSING')
         self.writer.close()
-        await self.writer.wait_closed()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
 
     async def read(self):
         """
@@ -55,7 +61,7 @@ class ClientSession:
         """
         try:
             data = await self.reader.read(self.DATA_SIZE)
-        except ConnectionResetError:
+        except ConnectionError:
             raise exceptions.ClientConnectionClosed()
 
         if not data:
@@ -71,15 +77,20 @@ class ClientSession:
         if self.writer.is_closing():
             raise exceptions.ClientConnectionClosed()
 
-        if seq in self.packets.keys():
-            log.debug(f'ignore repeated packet with sequence :{seq}')
+        #a packet resent after it was written is repeated as well
+        if seq <= self.last_written or seq in self.packets.keys():
+            packet_log.debug('ignore repeated packet with sequence :%s', seq)
             return
         self.packets[seq] = data
+        self.buffered += len(data)
         #write all packts before seq number to the StramWriter
         while (self.last_written + 1) in self.packets.keys():
             self.last_written += 1
 
             self.writer.write(self.packets[self.last_written])
-            await self.writer.drain()
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                raise exceptions.ClientConnectionClosed()
 
-            self.packets.pop(self.last_written)
+            self.buffered -= len(self.packets.pop(self.last_written))
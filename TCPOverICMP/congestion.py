@@ -0,0 +1,206 @@
+"""
+congestion.py
+
+This module defines the congestion controllers of the tunnel. The sender of DATA_TRANSFER packets keeps one controller
+per peer, which bounds the number of packets in flight to the peer (the congestion window) and adapts the window to
+the acks and timeouts of the packets, so the tunnel backs off on a congested link instead of flooding it with resends.
+
+Key Components:
+- CongestionController: The window and the packets in flight, packets wait for room in the window before being sent.
+- NewReno: AIMD. slow start, then one packet more per window acked, halves the window once per window of losses.
+- DelayBased: Vegas style. keeps a few packets queued on the link, grows while the RTT stays near the smallest RTT
+  seen, shrinks as the RTT rises, before the queue overflows. halves the window on loss as well.
+- CONTROLLERS: The controllers by name, for the command line.
+
+Main Methods:
+- acquire: Waits for room in the window for a new packet.
+- release: A packet left the network, it was acked or given up on.
+- on_ack: A packet was acked, with its round trip.
+- on_loss: A packet was not acked in time.
+- retransmit_timeout: How long to wait for an ack before resending, from the measured RTT (RFC 6298) plus the time
+  the peer may delay its acks, so losses are detected in about a round trip rather than after a fixed second.
+"""
+import asyncio
+import collections
+
+
+class CongestionController:
+    """
+    congestion window of the packets sent to a peer, grown and shrunk by subclasses
+    """
+    INITIAL_WINDOW = 10 #packets
+    MIN_WINDOW = 2
+    MAX_WINDOW = 4096
+    MIN_RETRANSMIT_TIMEOUT = 0.2 #seconds, above the delay of acks
+    RTT_ALPHA = 0.125 #weights of a new sample in the smoothed rtt and its variation (RFC 6298)
+    RTT_BETA = 0.25
+
+    def __init__(self):
+        self.window = float(self.INITIAL_WINDOW)
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        #losses of packets sent before the window was last reduced don't reduce it again
+        self.recovery_started_at = float('-inf')
+        self.srtt = None
+        self.rttvar = None
+
+    async def acquire(self):
+        """
+        wait until the window has room for another packet, the packets are sent in the order they asked.
+        """
+        if self.in_flight < self.window and not self.waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            #the room was already handed to this packet
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        """
+        a packet acquired with acquire left the network.
+        """
+        self.in_flight -= 1
+        self.wake_waiters()
+
+    def wake_waiters(self):
+        while self.waiters and self.in_flight < self.window:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def set_window(self, window: float):
+        self.window = min(self.MAX_WINDOW, max(self.MIN_WINDOW, window))
+        self.wake_waiters()
+
+    def on_ack(self, rtt: float = None):
+        """
+        a packet was acked.
+        @param rtt: the round trip of the packet, None if it is ambiguous (the packet was resent).
+        """
+        if rtt is not None:
+            if self.srtt is None:
+                self.srtt, self.rttvar = rtt, rtt / 2
+            else:
+                self.rttvar = (1 - self.RTT_BETA) * self.rttvar + self.RTT_BETA * abs(self.srtt - rtt)
+                self.srtt = (1 - self.RTT_ALPHA) * self.srtt + self.RTT_ALPHA * rtt
+        self.increase_window(rtt)
+
+    def retransmit_timeout(self, attempt: int, max_timeout: float, ack_delay: float = 0.0):
+        """
+        returns how long to wait for the ack of a packet before resending it, doubled on every resend.
+        @param attempt: the number of times the packet was resent
+        @param max_timeout: the timeout used before the rtt is measured, and the longest timeout
+        @param ack_delay: the longest the peer delays an ack. most acks are sent right away, so the rtt
+        variation doesn't cover the delayed ones, the last packets of a window would time out.
+        """
+        if self.srtt is None:
+            return max_timeout
+        timeout = max(self.MIN_RETRANSMIT_TIMEOUT, self.srtt + 4 * self.rttvar + ack_delay)
+        return min(max_timeout, timeout * 2 ** attempt)
+
+    def delivery_rate(self):
+        """
+        returns the packets per second the window delivers, None before the rtt is measured.
+        """
+        return self.window / self.srtt if self.srtt else None
+
+    def increase_window(self, rtt: float = None):
+        """
+        called for every acked packet
+        """
+
+    def on_loss(self, sent_at: float):
+        """
+        a packet was not acked in time.
+        @param sent_at: the loop time the lost packet was sent at
+        """
+        if sent_at <= self.recovery_started_at:
+            return
+        self.recovery_started_at = asyncio.get_event_loop().time()
+        self.reduce_window()
+
+    def reduce_window(self):
+        """
+        called once per window of losses
+        """
+
+
+class NewReno(CongestionController):
+    """
+    additive increase, multiplicative decrease
+    """
+    def __init__(self):
+        super(NewReno, self).__init__()
+        self.slow_start_threshold = float(self.MAX_WINDOW)
+
+    def increase_window(self, rtt: float = None):
+        if self.window < self.slow_start_threshold:
+            self.set_window(self.window + 1)
+        else:
+            self.set_window(self.window + 1 / self.window)
+
+    def reduce_window(self):
+        self.slow_start_threshold = max(self.MIN_WINDOW, self.window / 2)
+        self.set_window(self.slow_start_threshold)
+
+
+class DelayBased(CongestionController):
+    """
+    keeps between ALPHA and BETA packets queued on the path, measured once per round trip by how far
+    the smallest RTT of the round is above the smallest RTT seen. the smallest RTT of a round leaves out
+    the acks delayed by the peer.
+    """
+    ALPHA = 2 #packets
+    BETA = 4
+
+    def __init__(self):
+        super(DelayBased, self).__init__()
+        self.base_rtt = None
+        self.slow_start = True
+        self.round_min_rtt = float('inf')
+        self.round_acks = 0
+        self.round_size = self.window #acks in a round, the window when the round started
+        self.growing_round = True #slow start grows the window every other round, the rounds between measure it
+
+    def increase_window(self, rtt: float = None):
+        if rtt is None:
+            return
+        self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+        self.round_min_rtt = min(self.round_min_rtt, rtt)
+        self.round_acks += 1
+        if self.slow_start and self.growing_round:
+            self.set_window(self.window + 1)
+        if self.round_acks < self.round_size:
+            return
+
+        #the packets of the window that are queued on the path rather than propagating
+        queued = self.window * (self.round_min_rtt - self.base_rtt) / self.round_min_rtt
+        if self.slow_start:
+            if queued > self.ALPHA:
+                self.slow_start = False
+                self.set_window(self.window - queued + self.ALPHA)
+            self.growing_round = not self.growing_round
+        elif queued < self.ALPHA:
+            self.set_window(self.window + 1)
+        elif queued > self.BETA:
+            self.set_window(self.window - 1)
+        self.round_min_rtt = float('inf')
+        self.round_acks = 0
+        self.round_size = self.window
+
+    def reduce_window(self):
+        self.slow_start = False
+        self.set_window(self.window / 2)
+
+
+CONTROLLERS = {
+    'newreno': NewReno,
+    'delay': DelayBased,
+}
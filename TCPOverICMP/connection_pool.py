@@ -0,0 +1,136 @@
+"""
+connection_pool.py
+
+This module defines the ConnectionPool class, used by the ProxyServer to keep pre-established TCP connections
+to hot destinations. A START to a pooled destination claims an already open connection instead of waiting
+for a new TCP handshake.
+
+Key Components:
+- connections: for each destination, the open connections and the time each was opened.
+- size: the number of open connections kept per destination.
+- idle_ttl: the time a connection may wait in the pool before it is replaced.
+
+Main Methods:
+- acquire: Claims a healthy open connection to a destination, if the pool has one.
+- maintain: Continuously evicts closed and expired connections and refills the pool.
+"""
+import asyncio
+import collections
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    pool of open tcp connections per destination
+    """
+    DEFAULT_SIZE = 4
+    DEFAULT_IDLE_TTL = 30.0
+    CHECK_INTERVAL = 1.0 #time between health checks
+    CONNECT_TIMEOUT = 5.0
+
+    def __init__(
+            self,
+            destinations,
+            size: int = DEFAULT_SIZE,
+            idle_ttl: float = DEFAULT_IDLE_TTL,
+            connect=asyncio.open_connection,
+    ):
+        """
+        @param destinations: iterable of (host, port) to keep connections to.
+        @param size: open connections kept per destination.
+        @param idle_ttl: seconds a connection may stay unused in the pool.
+        @param connect: coroutine function (host, port) -> (reader, writer) used to open connections.
+        """
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self.connect = connect
+        self.connections = {(host, port): collections.deque() for host, port in destinations}
+        self.refill_needed = asyncio.Event()
+
+    def pools(self, host: str, port: int):
+        """
+        returns if connections to the destination are pooled
+        """
+        return (host, port) in self.connections
+
+    @staticmethod
+    def is_healthy(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        a pooled connection is healthy if the destination did not close or reset it.
+        """
+        return not writer.is_closing() and not reader.at_eof() and reader.exception() is None
+
+    def acquire(self, host: str, port: int):
+        """
+        claim an open connection to the destination.
+        returns a reader, writer or None if the pool has no healthy connection to the destination.
+        """
+        if not self.pools(host, port):
+            return None
+
+        connections = self.connections[(host, port)]
+        while connections:
+            reader, writer, _ = connections.popleft()
+            self.refill_needed.set()
+            if self.is_healthy(reader, writer):
+                log.debug(f'claimed pooled connection to {host}:{port}')
+                return reader, writer
+            writer.close()
+        return None
+
+    def evict(self):
+        """
+        close connections that are unhealthy or were idle longer than idle_ttl.
+        """
+        now = asyncio.get_event_loop().time()
+        for (host, port), connections in self.connections.items():
+            for connection in list(connections):
+                reader, writer, opened_at = connection
+                if not self.is_healthy(reader, writer) or now - opened_at > self.idle_ttl:
+                    connections.remove(connection)
+                    writer.close()
+
+    async def open_pooled_connection(self, host: str, port: int):
+        """
+        open a connection and add it to the pool of its destination.
+        """
+        try:
+            reader, writer = await asyncio.wait_for(self.connect(host, port), self.CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.debug(f'failed to open pooled connection to {host}:{port} {e!r}')
+            return
+        self.connections[(host, port)].append((reader, writer, asyncio.get_event_loop().time()))
+
+    async def fill(self):
+        """
+        open connections until every destination has size connections.
+        """
+        await asyncio.gather(*(
+            self.open_pooled_connection(host, port)
+            for (host, port), connections in self.connections.items()
+            for _ in range(self.size - len(connections))
+        ))
+
+    async def maintain(self):
+        """
+        keep the pool healthy and full, checks every CHECK_INTERVAL or when a connection was claimed.
+        """
+        while True:
+            self.refill_needed.clear()
+            self.evict()
+            await self.fill()
+            try:
+                await asyncio.wait_for(self.refill_needed.wait(), self.CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self):
+        """
+        close all pooled connections
+        """
+        for connections in self.connections.values():
+            while connections:
+                _, writer, _ = connections.popleft()
+                writer.close()
@@ -28,3 +28,7 @@ class ClientSessionAlreadyON(Exception):
 
 class RemoveNonExistClient(Exception):
     pass
+
+
+class Socks5Error(Exception):
+    pass
@@ -0,0 +1,86 @@
+"""
+heartbeat.py
+
+This module defines the liveness measurements the tunnel keeps of its peers. The proxy client sends a HEARTBEAT to
+every proxy server every interval, idle or not, and the proxy server answers it with a HEARTBEAT_REPLY. The round
+trips and the losses of the heartbeats give a live RTT and loss estimate of every peer, and a peer nothing was
+heard from for the dead peer timeout is declared dead, failing all its sessions at once instead of every packet
+timing out on its own.
+
+Key Components:
+- PeerHealth: When a peer was last heard from, the heartbeats waiting for a reply, and the RTT and loss estimates.
+
+Main Methods:
+- heard: Anything arrived from the peer, it is alive.
+- probe_sent / probe_answered: A heartbeat was sent to the peer, and its reply arrived.
+- expire_probes: The heartbeats not answered in time, counted as lost.
+"""
+import itertools
+
+
+class PeerHealth:
+    """
+    liveness, RTT and loss estimates of a peer
+    """
+    ALPHA = 0.125 #weight of a new sample in the smoothed estimates
+    RTT_BETA = 0.25 #weight of a new sample in the rtt variation (RFC 6298)
+
+    def __init__(self, now: float):
+        """
+        @param now: the loop time the peer is first known at, it counts as heard from
+        """
+        self.last_heard = now
+        self.dead = False
+        self.heartbeats_received = 0 #the peer sends heartbeats itself, so its silence means it is gone
+        self.probes = {} #seq: (sent at, ICMP identifier) of the heartbeats waiting for a reply
+        self.sequence = itertools.count()
+        self.srtt = None
+        self.rttvar = None
+        self.loss = 0.0
+
+    def heard(self, now: float):
+        self.last_heard = now
+        self.dead = False
+
+    def silent_for(self, now: float):
+        """
+        returns the seconds since the peer was last heard from
+        """
+        return now - self.last_heard
+
+    def probe_sent(self, now: float, identifier: int):
+        """
+        returns the sequence number of a new heartbeat sent to the peer
+        """
+        seq = next(self.sequence)
+        self.probes[seq] = (now, identifier)
+        return seq
+
+    def probe_answered(self, seq: int, now: float):
+        """
+        a heartbeat reply arrived.
+        returns (rtt, identifier) of the heartbeat, None if it was not waiting for a reply (a duplicate, or too late).
+        """
+        if seq not in self.probes:
+            return None
+        sent_at, identifier = self.probes.pop(seq)
+        rtt = now - sent_at
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = (1 - self.RTT_BETA) * self.rttvar + self.RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.loss = (1 - self.ALPHA) * self.loss
+        return rtt, identifier
+
+    def expire_probes(self, sent_before: float):
+        """
+        count the heartbeats sent before sent_before and still not answered as lost.
+        returns the ICMP identifiers they were sent with.
+        """
+        expired = [seq for seq, (sent_at, _) in self.probes.items() if sent_at < sent_before]
+        identifiers = []
+        for seq in expired:
+            identifiers.append(self.probes.pop(seq)[1])
+            self.loss = (1 - self.ALPHA) * self.loss + self.ALPHA
+        return identifiers
@@ -14,6 +14,8 @@ Classes:
 
 Usage:
 - Serialize an ICMP packet for transmission using `ICMPPacket.serialize`.
+- Build the frame of a tunnel packet in one pass using `ICMPPacket.frame`, and move it to
+  another ICMP flow using `ICMPPacket.set_identifier` when it is resent.
 - Deserialize and validate an incoming packet with `ICMPPacket.deserialize`.
 
 This module is critical for the implementation of the ICMP-based communication
@@ -36,18 +38,23 @@ class ICMPPacket:
 
     CODE = 0
     ICMP_STRUCT = struct.Struct('>BBHHH')  # Type, Code, Checksum, Identifier, Sequence Number
+    CHECKSUM_STRUCT = struct.Struct('>H')  # a single header field
+    CHECKSUM_OFFSET = 2
+    IDENTIFIER_OFFSET = 4
 
-    def __init__(self, packet_type, identifier, sequence_number, payload):
+    def __init__(self, packet_type, identifier, sequence_number, payload, source=None):
         self.type = packet_type  
         self.identifier = identifier  
         self.sequence_number = sequence_number  
         self.payload = payload  
+        self.source = source  # ip the packet was received from, None for packets to send
 
     @classmethod
-    def deserialize(cls, packet: bytes):
+    def deserialize(cls, packet: bytes, source: str = None):
         """
         Build ICMPPacket based on a stream of bytes using ICMP_STRUCT.
         params packet: packet to deserialize into an ICMPPacket
+        params source: the ip the packet was received from
         returns: an instance of ICMPPacket
         """
         # Unpack the ICMP header
@@ -65,33 +72,57 @@ class ICMPPacket:
         if checksum != computed_checksum:
             raise exceptions.InvalidChecksum()
 
-        return cls(packet_type, identifier, sequence_number, packet[cls.ICMP_STRUCT.size:])  # Payload is after the header
+        return cls(packet_type, identifier, sequence_number, packet[cls.ICMP_STRUCT.size:], source)  # Payload is after the header
 
     def serialize(self):
         """
-        Serialize the ICMPPacket into raw bytes using ICMP_STRUCT.
-        :returns: the serialized ICMP packet as bytes
+        Serialize the ICMPPacket into raw bytes using ICMP_STRUCT, the checksum is patched in place.
+        :returns: the serialized ICMP packet as a bytearray
         """
-        # Create a packet without a checksum
-        packet_without_checksum = self.ICMP_STRUCT.pack(
-            self.type,
-            self.CODE,
-            0,  # Placeholder for checksum
-            self.identifier,
-            self.sequence_number
-        ) + self.payload
-
-        # Compute the checksum
-        checksum = self.compute_checksum(packet_without_checksum)
-
-        # Pack the final packet with the checksum
-        return self.ICMP_STRUCT.pack(
-            self.type,
-            self.CODE,
-            checksum,
-            self.identifier,
-            self.sequence_number
-        ) + self.payload
+        packet = bytearray(self.ICMP_STRUCT.size)
+        packet += self.payload
+        self.pack_header(packet, self.type, self.identifier, self.sequence_number)
+        return packet
+
+    @classmethod
+    def frame(cls, packet_type, identifier, sequence_number, tunnel_packet):
+        """
+        Build the raw bytes of an ICMP packet carrying a tunnel packet in a single preallocated buffer.
+        the tunnel packet is serialized straight into the buffer and the checksum is patched in place,
+        so the payload is copied once.
+        @param tunnel_packet: the packet to carry, with serialized_size and pack_into (ICMPTunnelPacket)
+        returns: the frame as a bytearray, its identifier can be changed with set_identifier
+        """
+        frame = bytearray(cls.ICMP_STRUCT.size + tunnel_packet.serialized_size())
+        tunnel_packet.pack_into(frame, cls.ICMP_STRUCT.size)
+        cls.pack_header(frame, packet_type, identifier, sequence_number)
+        return frame
+
+    @classmethod
+    def pack_header(cls, packet: bytearray, packet_type, identifier, sequence_number):
+        """
+        pack the header into a packet whose payload is already in place, and patch its checksum.
+        """
+        cls.ICMP_STRUCT.pack_into(packet, 0, packet_type, cls.CODE, 0, identifier, sequence_number)
+        cls.CHECKSUM_STRUCT.pack_into(packet, cls.CHECKSUM_OFFSET, cls.compute_checksum(packet))
+
+    @classmethod
+    def set_identifier(cls, frame: bytearray, identifier):
+        """
+        Change the identifier of a built frame, the checksum is updated incrementally (RFC 1624)
+        instead of being computed again over the payload.
+        @param frame: a frame built by frame
+        """
+        old_identifier, = cls.CHECKSUM_STRUCT.unpack_from(frame, cls.IDENTIFIER_OFFSET)
+        if old_identifier == identifier:
+            return
+        checksum, = cls.CHECKSUM_STRUCT.unpack_from(frame, cls.CHECKSUM_OFFSET)
+        #HC' = ~(~HC + ~m + m') in one's complement arithmetic
+        total = (~checksum & 0xFFFF) + (~old_identifier & 0xFFFF) + identifier
+        total = (total >> 16) + (total & 0xFFFF)
+        total += total >> 16
+        cls.CHECKSUM_STRUCT.pack_into(frame, cls.CHECKSUM_OFFSET, ~total & 0xFFFF)
+        cls.CHECKSUM_STRUCT.pack_into(frame, cls.IDENTIFIER_OFFSET, identifier)
 
     @staticmethod
     def compute_checksum(data: bytes):
@@ -7,11 +7,12 @@ It facilitates sending and receiving ICMP packets asynchronously, making it suit
 Key Components:
 - _icmp_socket: A raw socket for ICMP communication.
 - packet_queue: An asyncio.Queue to store received ICMP packets.
+- packet_trace: Every frame sent and received is recorded in the packet trace, for a pcap dump.
 
 Main Methods:
-- recv: Asynchronously receives ICMP packets and deserializes them.
+- recv: Asynchronously receives ICMP packets and deserializes them, along with the ip they came from.
 - wait_for_incoming_packet: Continuously listens for incoming ICMP packets and adds them to the packet queue.
-- sendto: Sends an ICMP packet to a specified destination.
+- sendto: Sends a raw ICMP packet to a specified destination.
 """
 
 
@@ -22,9 +23,10 @@ import logging
 from TCPOverICMP.icmp_packet import ICMPPacket  
 import struct
 from TCPOverICMP import exceptions
+from TCPOverICMP.log_setup import packet_log
+from TCPOverICMP.packet_trace import packet_trace
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
 #zzzzz
 
 class ICMPSocket:
@@ -46,51 +48,48 @@ class ICMPSocket:
         #to intialize a raw socket
         self._icmp_socket.sendto(self.ICMP_INIT_PACKET, self.DEFAULT_ICMP_TARGET)  
 
-    async def recv(self, remote_endpoint: dict, buffersize: int = SOCKET_BUFFER_SIZE):
+    async def recv(self, buffersize: int = SOCKET_BUFFER_SIZE):
         """
         recives an icmp packet
         @param buffersize: the max data to recive (bytes)
-        returns  an ICMP packet that was sniffed.
+        returns  an ICMP packet that was sniffed, with the ip it was sent from as its source.
         """
         data = await asyncio.get_event_loop().sock_recv(self._icmp_socket, buffersize)
         if not data:
             raise exceptions.RecivedEmptyData()
+        packet_trace.record_received(data)
         # Deserialize the ICMP packet
         try:
             raw_packet = data[self.IPv4_HEADER_SIZE:]  # Remove IP header
-            #when handling start from the proxy_server
-            if remote_endpoint["ip"]==None:
-                # IP header is the first 20 bytes for IPv4 without options
-                ip_header = data[:20]
-                # Unpack the IP header (source IP is at byte offset 12-15)
-                iph = struct.unpack('!BBHHHBBH4s4s', ip_header)
-                source_ip = socket.inet_ntoa(iph[8]) 
-                log.info(f"remote endpoint: {source_ip}")
-                remote_endpoint["ip"] = source_ip
-            return ICMPPacket.deserialize(raw_packet)
+            # IP header is the first 20 bytes for IPv4 without options
+            ip_header = data[:20]
+            # Unpack the IP header (source IP is at byte offset 12-15)
+            iph = struct.unpack('!BBHHHBBH4s4s', ip_header)
+            source_ip = socket.inet_ntoa(iph[8]) 
+            return ICMPPacket.deserialize(raw_packet, source_ip)
         except exceptions.InvalidICMPCode:
-            log.debug("Invalid ICMP code detected, skipping packet.")
+            packet_log.debug('Invalid ICMP code detected, skipping packet.')
             return None
 
-    async def wait_for_incoming_packet(self, remote_endpoint:dict = None):
+    async def wait_for_incoming_packet(self):
         """
         listen on socket for incoming ICMP packets and put them into the queue(sniff).
-        @param remote_endpoint - initialize the ip of the repmote endpoint if needed
         """
         while True:
             try:
-                packet = await self.recv(remote_endpoint)
+                packet = await self.recv()
                 if packet is not None:
                     await self.packet_queue.put(packet)
             except exceptions.InvalidICMPCode:
                 # Ignore invalid packets
                 pass
 
-    def sendto(self, packet: ICMPPacket, destination: str):
+    def sendto(self, frame: bytes, destination: str):
         """
         Send an ICMP packet to the specified destination.
-        @param packet An instance of ICMPPacket to send.
+        @param frame The raw ICMP packet, as built by ICMPPacket.frame or ICMPPacket.serialize.
         @param destination The IP address of the destination.
         """
-        log.debug(f'Sending packet: \n{packet.payload} to {destination}')
-        self._icmp_socket.sendto(packet.serialize(), (destination, 0))
\ No newline at end of file
+        packet_log.debug('Sending packet: \n%s to %s', frame, destination)
+        packet_trace.record_sent(frame, destination)
+        self._icmp_socket.sendto(frame, (destination, 0))
\ No newline at end of file
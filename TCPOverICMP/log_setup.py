@@ -0,0 +1,92 @@
+"""
+log_setup.py
+
+This module configures the logging of the proxy client and server. Logging a packet is far more expensive than
+tunneling it (the tunnel packet repr spans several lines, frames are formatted byte by byte), so the logs of single
+packets go to their own logger and are sampled, and the hot paths log with lazy %-style arguments that are only
+formatted when a record is emitted.
+
+Key Components:
+- PACKET_LOGGER: The logger of single packets (sent, received, resent, dropped), at DEBUG.
+- PacketLog: Logs to the packet logger, one packet in every sample_every, and skips the packets
+  without creating a record when the packet logger is not enabled for DEBUG.
+- packet_log: The PacketLog used by the tunnel modules.
+
+Main Methods:
+- configure_logging: Sets the log level, the packet sampling, and optionally moves the log handlers off the event
+  loop, behind a QueueHandler, so writing a record never blocks the loop.
+- add_arguments: Adds the logging options to the command line of the proxy client and server.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+
+
+PACKET_LOGGER = 'TCPOverICMP.packets'
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+
+class PacketLog:
+    """
+    sampled DEBUG logging of single packets
+    """
+    def __init__(self, name: str = PACKET_LOGGER, sample_every: int = 1):
+        """
+        @param name: the logger name
+        @param sample_every: log one packet in every sample_every, 0 logs none
+        """
+        self.logger = logging.getLogger(name)
+        self.sample_every = sample_every
+        self.skipped = 0
+
+    def debug(self, msg: str, *args):
+        """
+        log a packet if it is sampled. args are formatted only if the record is emitted.
+        """
+        if not self.sample_every or not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.skipped += 1
+        if self.skipped < self.sample_every:
+            return
+        self.skipped = 0
+        self.logger.debug(msg, *args)
+
+
+packet_log = PacketLog()
+
+
+def configure_logging(level: str = 'INFO', use_queue: bool = False, packet_sample: int = 1):
+    """
+    configure the root logger.
+    @param level: the name of the log level
+    @param use_queue: write the records from a separate thread, the loop only puts them in a queue
+    @param packet_sample: log one packet in every packet_sample at DEBUG, 0 logs none
+    returns: the QueueListener writing the records, None without use_queue
+    """
+    logging.basicConfig()
+    root = logging.getLogger()
+    root.setLevel(level)
+    packet_log.sample_every = packet_sample
+    if not use_queue:
+        return None
+
+    handlers = root.handlers[:]
+    records = queue.SimpleQueue()
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    #write the records left in the queue on exit
+    atexit.register(listener.stop)
+    return listener
+
+
+def add_arguments(parser):
+    parser.add_argument('--log-level', choices=LEVELS, default='INFO', type=str.upper,
+                        help='the lowest level of the records logged')
+    parser.add_argument('--log-queue', action='store_true',
+                        help='write the logs from a separate thread rather than the event loop')
+    parser.add_argument('--packet-log-sample', type=int, default=1, metavar='N',
+                        help='at DEBUG, log one packet in every N, 0 logs none')
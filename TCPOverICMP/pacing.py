@@ -0,0 +1,218 @@
+"""
+pacing.py
+
+This module defines the Pacer, which spaces out the ICMP packets sent by a tunnel. Routers and hypervisors police
+ICMP by rate, so bursts are tail dropped long before the average rate reaches the budget. Packets within the budget
+are sent right away, the rest wait in a queue that is flushed as the budget refills.
+
+Key Components:
+- TokenBucket: A rate and a burst of tokens, packets or bytes.
+- Pacer: Sends packets within a packets/s and a bytes/s budget. The packets/s budget can be fixed, adaptive
+  (following the delivery rate the congestion controllers of the peers measure), or both (the lowest applies).
+  The adaptive budget is measured on data packets and only paces them, control packets (acks, heartbeats and
+  their replies) are only paced by the fixed budgets, and go ahead of the data waiting for the adaptive budget.
+
+Main Methods:
+- sendto: Sends a packet now if the budget allows it, queues it otherwise.
+- flush: Sends the queued packets the budget allows, in one batch, and schedules the next flush.
+  there is a single timer for the whole queue, not one per packet, and the budget is checked again when it fires.
+- is_queued: Whether a frame still waits for budget, the tunnel doesn't resend those (they are not lost).
+- backlogged: Whether packets wait for budget, the tunnel doesn't piggyback acks on a packet that would wait.
+- set_peer_rate / forget_peer: Updates the delivery rate of a peer for the adaptive budget, or removes it when
+  the peer is dead or forgotten.
+"""
+import asyncio
+import collections
+from TCPOverICMP.log_setup import packet_log
+
+
+class TokenBucket:
+    """
+    tokens refill at rate per second, up to burst
+    """
+    def __init__(self, rate: float = None, burst: float = None):
+        """
+        @param rate: tokens per second, None for no limit
+        @param burst: the most tokens the bucket holds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = None
+
+    def refill(self, now: float):
+        if self.rate is None:
+            return
+        if self.updated_at is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, amount: float):
+        """
+        returns the seconds until amount tokens are available, 0 if they are (after refill).
+        a request larger than the burst waits for a full bucket.
+        """
+        if self.rate is None:
+            return 0.0
+        missing = min(amount, self.burst) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        if self.rate is not None:
+            self.tokens -= amount
+
+    def set_rate(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        if rate is None or self.tokens is None:
+            self.tokens = burst
+        else:
+            self.tokens = min(self.tokens, burst)
+
+
+class Pacer:
+    """
+    token bucket pacing of the packets sent on an ICMP socket
+    """
+    BURST_TIME = 0.005 #seconds of budget that may be sent back to back
+    MIN_BURST_BYTES = 1500 #a full sized packet
+    ADAPTIVE_GAIN = 1.25 #the adaptive budget leaves room above the measured rate for it to grow
+    MAX_QUEUE = 1024 #packets waiting for budget, more are dropped
+    TIMER_SLACK = 1e-6 #seconds a packet may be early when the flush timer fires, the rounding of the timer
+
+    def __init__(self, packets_per_second: float = None, bytes_per_second: float = None, adaptive: bool = False):
+        """
+        @param packets_per_second: fixed packets budget, None for no fixed limit
+        @param bytes_per_second: fixed bytes budget, None for no limit
+        @param adaptive: also limit the packets to ADAPTIVE_GAIN times the delivery rate of the peers
+        """
+        self.icmp_socket = None #set by the tunnel with bind
+        self.packets_per_second = packets_per_second
+        self.adaptive = adaptive
+        self.peer_rates = {}
+        self.total_peer_rate = 0.0
+        self.packets = TokenBucket()
+        self.data_packets = TokenBucket() #the adaptive budget
+        self.bytes = TokenBucket()
+        self.set_packets_rate(self.packets, packets_per_second)
+        if bytes_per_second is not None:
+            self.bytes.set_rate(bytes_per_second, max(self.MIN_BURST_BYTES, bytes_per_second * self.BURST_TIME))
+        self.queue = collections.deque()
+        self.queued = {} #id of a queued frame: (the frame, the times it is queued)
+        self.timer = None
+        self.dropped = 0
+
+    def bind(self, icmp_socket):
+        """
+        @param icmp_socket: the socket the paced packets are sent on
+        """
+        self.icmp_socket = icmp_socket
+
+    def set_packets_rate(self, bucket: TokenBucket, rate: float = None):
+        #the tokens so far refill at the previous rate
+        if bucket.rate is not None:
+            bucket.refill(asyncio.get_event_loop().time())
+        if rate is None:
+            bucket.set_rate(None, None)
+        else:
+            bucket.set_rate(rate, max(1.0, rate * self.BURST_TIME))
+
+    def set_peer_rate(self, peer: str, packets_per_second: float):
+        """
+        update the delivery rate of a peer, the adaptive budget is the sum of the rates of all peers.
+        """
+        if not self.adaptive:
+            return
+        self.total_peer_rate += packets_per_second - self.peer_rates.get(peer, 0.0)
+        self.peer_rates[peer] = packets_per_second
+        self.set_packets_rate(self.data_packets, self.ADAPTIVE_GAIN * self.total_peer_rate)
+
+    def forget_peer(self, peer: str):
+        """
+        remove the delivery rate of a dead or forgotten peer from the adaptive budget.
+        """
+        if peer not in self.peer_rates:
+            return
+        self.total_peer_rate -= self.peer_rates.pop(peer)
+        if not self.peer_rates:
+            #no rate measured, no adaptive limit (and no float residue of the removed rates)
+            self.total_peer_rate = 0.0
+            self.set_packets_rate(self.data_packets, None)
+        else:
+            self.set_packets_rate(self.data_packets, self.ADAPTIVE_GAIN * self.total_peer_rate)
+
+    def delay(self, size: int, control: bool = False):
+        now = asyncio.get_event_loop().time()
+        self.packets.refill(now)
+        self.bytes.refill(now)
+        if control:
+            return max(self.packets.delay(1), self.bytes.delay(size))
+        self.data_packets.refill(now)
+        return max(self.packets.delay(1), self.data_packets.delay(1), self.bytes.delay(size))
+
+    def sendto(self, frame: bytes, destination: str, control: bool = False):
+        """
+        Send a packet if the budget allows it and no packets wait before it, queue it otherwise.
+        @param control: a control packet, not paced by the adaptive budget. it goes ahead of the queued packets
+        if the fixed budgets allow it.
+        """
+        if (control or not self.queue) and self.delay(len(frame), control) == 0:
+            self.send(frame, destination, control)
+            return
+        if len(self.queue) >= self.MAX_QUEUE:
+            self.dropped += 1
+            packet_log.debug('pacing queue is full, dropping packet to %s', destination)
+            return
+        #the frame is not copied, it must not change until it is sent
+        self.queue.append((frame, destination, control))
+        #the frame is kept with its id, the id of a frame that was sent and freed may be reused by another one
+        _, times = self.queued.get(id(frame), (frame, 0))
+        self.queued[id(frame)] = (frame, times + 1)
+        self.schedule_flush()
+
+    def backlogged(self):
+        """
+        returns whether packets wait for budget, a packet sent now is queued behind them.
+        """
+        return bool(self.queue)
+
+    def is_queued(self, frame):
+        """
+        returns whether the frame still waits for budget.
+        """
+        queued = self.queued.get(id(frame))
+        return queued is not None and queued[0] is frame
+
+    def send(self, frame: bytes, destination: str, control: bool = False):
+        self.packets.take(1)
+        if not control:
+            self.data_packets.take(1)
+        self.bytes.take(len(frame))
+        self.icmp_socket.sendto(frame, destination)
+
+    def flush(self):
+        """
+        send the queued packets the budget allows.
+        """
+        self.timer = None
+        #the budget is checked again, the rate may have dropped or control packets used the budget since the timer
+        #was set, then the timer is set again for when the first packet is due
+        while self.queue and self.head_delay() <= self.TIMER_SLACK:
+            self.send_queued()
+        self.schedule_flush()
+
+    def head_delay(self):
+        frame, _, control = self.queue[0]
+        return self.delay(len(frame), control)
+
+    def send_queued(self):
+        frame, destination, control = self.queue.popleft()
+        _, times = self.queued.pop(id(frame))
+        if times > 1:
+            self.queued[id(frame)] = (frame, times - 1)
+        self.send(frame, destination, control)
+
+    def schedule_flush(self):
+        if self.timer is not None or not self.queue:
+            return
+        self.timer = asyncio.get_event_loop().call_later(self.head_delay(), self.flush)
@@ -0,0 +1,188 @@
+"""
+packet_trace.py
+
+This module keeps an always-on trace of the recent ICMP frames of the tunnel, for post-mortem analysis of
+retransmits and round trips when the throughput collapses and no capture was running. Every frame sent and
+received by the ICMP socket is recorded in a fixed-size ring: its time, its source and destination, its length, and
+its first snaplen bytes (the ICMP header, the tunnel header and the start of the data). The ring is preallocated in
+two flat buffers, the fixed fields packed in one and the bytes kept in the other, so recording a frame is two copies
+into them, the trace never grows and the oldest frames are overwritten.
+
+The ring is written to a pcap file on demand (SIGUSR1 on the proxy client and server), with an IPv4 header built for
+every frame, so it opens in Wireshark and tcpdump like a capture.
+
+Key Components:
+- PacketTrace: The ring of the recent frames and its pcap export.
+- packet_trace: The PacketTrace the ICMP socket records to.
+
+Main Methods:
+- record_sent / record_received: Record a frame, sent to a peer or received with its IPv4 header.
+- frames: The recorded frames, oldest first.
+- dump: Writes the ring to a pcap file.
+- configure_trace: Sizes the ring and dumps it to a new pcap file on SIGUSR1.
+- add_arguments: Adds the trace options to the command line of the proxy client and server.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import struct
+import time
+from TCPOverICMP.icmp_packet import ICMPPacket
+
+log = logging.getLogger(__name__)
+
+
+PCAP_HEADER = struct.Struct('<IHHiIII') #magic, version, timezone, timestamp accuracy, snaplen, link type
+PCAP_RECORD = struct.Struct('<IIII') #seconds, microseconds, captured length, original length
+TRACE_RECORD = struct.Struct('<dI4s4s') #time, length, source ip, destination ip of a traced frame
+IPV4_HEADER = struct.Struct('>BBHHHBBH4s4s')
+PCAP_MAGIC = 0xa1b2c3d4
+LINKTYPE_RAW = 101 #frames start with an IP header
+IPV4_HEADER_SIZE = IPV4_HEADER.size
+IP_TTL = 64
+
+
+class PacketTrace:
+    """
+    fixed-size ring of the recent ICMP frames
+    """
+    CAPACITY = 4096 #frames kept
+    SNAPLEN = 96 #bytes kept of every frame
+    ADDRESS_CACHE_SIZE = 1024 #destination ips kept in their packed form
+
+    def __init__(self, capacity: int = CAPACITY, snaplen: int = SNAPLEN):
+        """
+        @param capacity: the number of frames kept, 0 records none
+        @param snaplen: the bytes kept of every frame
+        """
+        self.resize(capacity, snaplen)
+
+    def resize(self, capacity: int, snaplen: int):
+        """
+        allocate the ring for capacity frames of snaplen bytes, the frames recorded so far are dropped.
+        """
+        self.capacity = capacity
+        self.snaplen = snaplen
+        self.recorded = 0 #frames recorded since the trace was created, the next one goes to recorded % capacity
+        self.local_address = bytes(4) #learned from the received frames, the source of the sent ones
+        self.addresses = {} #ip: packed ip
+        self.records = bytearray(TRACE_RECORD.size * capacity)
+        self.data = bytearray(snaplen * capacity)
+
+    def record(self, frame, source: bytes, destination: bytes):
+        """
+        record a frame in the ring, overwriting the oldest one once the ring is full.
+        @param frame: the ICMP frame
+        @param source, destination: the packed ips
+        """
+        index = self.recorded % self.capacity
+        self.recorded += 1
+        TRACE_RECORD.pack_into(self.records, TRACE_RECORD.size * index, time.time(), len(frame), source, destination)
+        offset = self.snaplen * index
+        kept = min(len(frame), self.snaplen)
+        self.data[offset:offset + kept] = memoryview(frame)[:kept]
+
+    def record_sent(self, frame, destination: str):
+        """
+        record a frame sent to a peer.
+        """
+        if not self.capacity:
+            return
+        packed = self.addresses.get(destination)
+        if packed is None:
+            if len(self.addresses) >= self.ADDRESS_CACHE_SIZE:
+                self.addresses.clear()
+            packed = self.addresses[destination] = socket.inet_aton(destination)
+        self.record(frame, self.local_address, packed)
+
+    def record_received(self, data: bytes):
+        """
+        record a frame received from a peer.
+        @param data: the frame with the IPv4 header it was received with
+        """
+        if not self.capacity:
+            return
+        self.local_address = data[16:20]
+        self.record(memoryview(data)[(data[0] & 0x0f) * 4:], data[12:16], self.local_address)
+
+    def frames(self):
+        """
+        returns the recorded frames, oldest first, as (time, source ip, destination ip, length, kept bytes).
+        """
+        kept = min(self.recorded, self.capacity)
+        frames = []
+        for index in range(self.recorded - kept, self.recorded):
+            index %= self.capacity
+            timestamp, length, source, destination = TRACE_RECORD.unpack_from(self.records, TRACE_RECORD.size * index)
+            offset = self.snaplen * index
+            frames.append((
+                timestamp,
+                socket.inet_ntoa(source),
+                socket.inet_ntoa(destination),
+                length,
+                bytes(self.data[offset:offset + min(length, self.snaplen)]),
+            ))
+        return frames
+
+    def dump(self, path: str):
+        """
+        write the recorded frames to a pcap file, every frame behind an IPv4 header built from its ips.
+        @param path: the pcap file to write
+        returns: the number of frames written
+        """
+        frames = self.frames()
+        with open(path, 'wb') as pcap:
+            pcap.write(PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, IPV4_HEADER_SIZE + self.snaplen, LINKTYPE_RAW))
+            for timestamp, source, destination, length, data in frames:
+                header = bytearray(IPV4_HEADER.pack(
+                    0x45, 0, IPV4_HEADER_SIZE + length, 0, 0, IP_TTL, socket.IPPROTO_ICMP, 0,
+                    socket.inet_aton(source), socket.inet_aton(destination)
+                ))
+                ICMPPacket.CHECKSUM_STRUCT.pack_into(header, 10, ICMPPacket.compute_checksum(header))
+                seconds = int(timestamp)
+                pcap.write(PCAP_RECORD.pack(
+                    seconds, int((timestamp - seconds) * 1_000_000), IPV4_HEADER_SIZE + len(data),
+                    IPV4_HEADER_SIZE + length
+                ))
+                pcap.write(header)
+                pcap.write(data)
+        return len(frames)
+
+
+packet_trace = PacketTrace()
+
+
+def dump_to_directory(directory: str):
+    """
+    write the trace to a new pcap file in directory, named after the process and the time.
+    """
+    path = os.path.join(directory, f'tcpovericmp-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}.pcap')
+    try:
+        written = packet_trace.dump(path)
+    except OSError as e:
+        log.error(f'could not write the packet trace to {path}: {e}')
+        return
+    log.info(f'wrote {written} traced packets to {path}')
+
+
+def configure_trace(capacity: int = PacketTrace.CAPACITY, snaplen: int = PacketTrace.SNAPLEN, directory: str = '.'):
+    """
+    size the trace the ICMP socket records to, and dump it to directory on SIGUSR1.
+    must be called from the running event loop.
+    @param capacity: the number of frames kept, 0 records none
+    @param snaplen: the bytes kept of every frame
+    @param directory: where the pcap files are written
+    """
+    packet_trace.resize(capacity, snaplen)
+    if capacity and hasattr(signal, 'SIGUSR1'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, dump_to_directory, directory)
+
+
+def add_arguments(parser):
+    parser.add_argument('--trace-size', type=int, default=PacketTrace.CAPACITY, metavar='FRAMES',
+                        help='recent ICMP frames kept for a pcap dump on SIGUSR1, 0 keeps none')
+    parser.add_argument('--trace-snaplen', type=int, default=PacketTrace.SNAPLEN, metavar='BYTES',
+                        help='bytes kept of every traced frame')
+    parser.add_argument('--trace-dir', default='.', help='directory the pcap dumps are written to')
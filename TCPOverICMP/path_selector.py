@@ -0,0 +1,108 @@
+"""
+path_selector.py
+
+This module defines the PathSelector class, used by the ProxyClient to spread its traffic over several proxy servers
+and several ICMP flows (ICMP identifiers) to each of them. A path is a (proxy server ip, ICMP identifier) pair.
+
+Key Components:
+- PathStats: The smoothed RTT and loss rate measured on a path from the ACKs of its packets.
+- PathSelector: Chooses a proxy server for each new session, and a path to it for each packet,
+  weighted by the delivery rate each path is measured to have.
+
+Main Methods:
+- choose_endpoint: Chooses the proxy server a new session is opened on, among the live ones.
+- choose_identifier: Chooses the ICMP flow the next packet to a proxy server is sent on.
+- on_ack / on_timeout: Update the measurements of a path.
+"""
+import random
+
+
+class PathStats:
+    """
+    RTT and loss estimates of a path
+    """
+    ALPHA = 0.125 #weight of a new sample in the smoothed estimates
+    MAX_LOSS = 0.95 #a lossy path keeps being probed so it can recover
+
+    def __init__(self):
+        self.srtt = None
+        self.loss = 0.0
+
+    def on_ack(self, rtt: float = None):
+        """
+        a packet on the path was acked
+        @param rtt: the round trip of the packet, None if it is ambiguous (the packet was resent).
+        """
+        if rtt is not None:
+            self.srtt = rtt if self.srtt is None else (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.loss = (1 - self.ALPHA) * self.loss
+
+    def on_timeout(self):
+        """
+        a packet on the path was not acked in time
+        """
+        self.loss = min(self.MAX_LOSS, (1 - self.ALPHA) * self.loss + self.ALPHA)
+
+    def weight(self, default_rtt: float):
+        """
+        returns the expected delivery rate of the path
+        @param default_rtt: the rtt assumed for a path without samples
+        """
+        return (1 - self.loss) / (self.srtt if self.srtt is not None else default_rtt)
+
+
+class PathSelector:
+    """
+    weighted choice of proxy servers and ICMP flows
+    """
+    INITIAL_RTT = 0.5
+
+    def __init__(self, endpoints, identifiers, rng: random.Random = None):
+        """
+        @param endpoints: the ips of the proxy servers
+        @param identifiers: the ICMP identifiers used to every proxy server
+        @param rng: random generator, seeded for reproducible choices
+        """
+        self.endpoints = list(endpoints)
+        self.identifiers = list(identifiers)
+        self.paths = {(endpoint, identifier): PathStats() for endpoint in self.endpoints for identifier in self.identifiers}
+        self.rng = rng if rng is not None else random.Random()
+
+    def default_rtt(self):
+        """
+        returns the mean smoothed rtt of the measured paths, so new paths are neither favored nor avoided
+        """
+        samples = [stats.srtt for stats in self.paths.values() if stats.srtt is not None]
+        return sum(samples) / len(samples) if samples else self.INITIAL_RTT
+
+    def path_weight(self, endpoint: str, identifier: int, default_rtt: float):
+        return self.paths[(endpoint, identifier)].weight(default_rtt)
+
+    def choose_endpoint(self, excluded=()):
+        """
+        returns the proxy server to open a new session on
+        @param excluded: proxy servers not to choose (dead), unless all of them are
+        """
+        endpoints = [endpoint for endpoint in self.endpoints if endpoint not in excluded] or self.endpoints
+        default_rtt = self.default_rtt()
+        weights = [
+            sum(self.path_weight(endpoint, identifier, default_rtt) for identifier in self.identifiers)
+            for endpoint in endpoints
+        ]
+        return self.rng.choices(endpoints, weights)[0]
+
+    def choose_identifier(self, endpoint: str):
+        """
+        returns the ICMP identifier of the flow to send the next packet to a proxy server on
+        """
+        default_rtt = self.default_rtt()
+        weights = [self.path_weight(endpoint, identifier, default_rtt) for identifier in self.identifiers]
+        return self.rng.choices(self.identifiers, weights)[0]
+
+    def on_ack(self, endpoint: str, identifier: int, rtt: float = None):
+        if (endpoint, identifier) in self.paths:
+            self.paths[(endpoint, identifier)].on_ack(rtt)
+
+    def on_timeout(self, endpoint: str, identifier: int):
+        if (endpoint, identifier) in self.paths:
+            self.paths[(endpoint, identifier)].on_timeout()
@@ -7,34 +7,64 @@ via ICMP, and handles the forwarding of TCP data over ICMP.
 
 Key Components:
 - `ProxyClient`: Inherits from `TCPoverICMPTunnel` and manages TCP connections.
-- Listens on localhost for TCP connections.
-- Sends a START packet to the Proxy TCPServer to initiate a tunnel session.
+- Listens on localhost for TCP connections, on forwarded ports with a fixed destination each, and optionally
+  on a SOCKS5 port where every connection chooses its destination. All of them share one ICMP socket.
+- Sends a START packet to the Proxy TCPServer to initiate a tunnel session, carrying the first data of the connection.
 - Manages incoming TCP connections and forwards data using ICMP.
+- Spreads sessions over one or more proxy servers, and the packets of every session over one or more ICMP flows,
+  weighted by the RTT and loss measured on each of them (see `PathSelector`).
 
 Main Methods:
-- `wait_for_new_connection`: Waits for new TCP connections and sends a START request to the Proxy TCPServer.
+- `wait_for_new_connection`: Waits for new TCP connections and opens a tunnel session for each of them.
+- `open_session`: Sends a START request to the Proxy TCPServer and pipelines the next data right behind it.
+- `open_socks_session`: Sends a START request for a SOCKS5 connection and answers its CONNECT request.
+- `read_initial_data`: Reads the data the connection sends right away, to be carried by the START.
 - `start_session`: Logs ignored packets since START actions are only relevant for the Proxy TCPServer.
+- `choose_endpoint`: Chooses the proxy server of a new session, leaving out the dead ones.
+- `choose_identifier`: Chooses the ICMP flow of every packet from the measured paths.
 """
 import asyncio
 import logging
-from TCPOverICMP import tcp_server
+import socket
+from TCPOverICMP import tcp_server, socks5
 from TCPOverICMP import tcp_over_icmp_tunnel
 from TCPOverICMP.tunnel_packet import ICMPTunnelPacket, Action, Direction
+from TCPOverICMP.client_session import ClientSession
+from TCPOverICMP.path_selector import PathSelector
 
 log = logging.getLogger(__name__)
 
 
 class ProxyClient(tcp_over_icmp_tunnel.TCPoverICMPTunnel):
     LOCALHOST = '127.0.0.1'
+    INITIAL_DATA_WAIT = 0.01 #time to wait for data to carry in the START, for protocols the client speaks first
 
-    def __init__(self, remote_endpoint, port, destination_host, destination_port):
-        super(ProxyClient, self).__init__(Direction.PROXY_SERVER, remote_endpoint)
-        log.info(f'proxy-server: {remote_endpoint}')
-        log.info(f'transmiting to {destination_host}:{destination_port}')
-        self.destination_host = destination_host
-        self.destination_port = destination_port
+    def __init__(self, remote_endpoints, forwards, identifiers=None, socks_port=None, congestion_control=None,
+                 pacer=None, heartbeat_interval=None, dead_peer_timeout=None, idle_timeout=None, buffer_budget=None):
+        """
+        @param remote_endpoints: the proxy server, or a list of proxy servers to spread sessions over
+        @param forwards: listening port: (destination host, destination port)
+        @param identifiers: the ICMP identifiers to spread packets over, ICMP_PACKET_IDENTIFIER by default
+        @param socks_port: port to listen for SOCKS5 connections on, None to disable SOCKS5
+        @param congestion_control: the congestion controller class, NewReno by default
+        @param pacer: the Pacer spacing out the packets, no pacing by default
+        @param heartbeat_interval: seconds between the heartbeats sent to every proxy server
+        @param dead_peer_timeout: seconds a silent proxy server is declared dead after, failing its sessions
+        @param idle_timeout: seconds a session may be idle before it is terminated, 0 never
+        @param buffer_budget: bytes all the sessions may buffer, new connections are refused above it
+        """
+        if isinstance(remote_endpoints, str):
+            remote_endpoints = [remote_endpoints]
+        #packets from the proxy servers are recognized by their ip
+        remote_endpoints = tuple(socket.gethostbyname(remote_endpoint) for remote_endpoint in remote_endpoints)
+        super(ProxyClient, self).__init__(
+            Direction.PROXY_SERVER, remote_endpoints, identifiers, congestion_control, pacer,
+            heartbeat_interval, dead_peer_timeout, idle_timeout, buffer_budget
+        )
+        log.info(f'proxy-servers: {remote_endpoints}')
+        self.path_selector = PathSelector(self.remote_endpoints, self.identifiers)
         self.incoming_tcp_connections = asyncio.Queue()
-        self.tcp_server = tcp_server.TCPServer(self.LOCALHOST, port, self.incoming_tcp_connections)
+        self.tcp_server = tcp_server.TCPServer(self.LOCALHOST, forwards, self.incoming_tcp_connections, socks_port)
         #proxy client corutines to run 
         self.main_coroutines.append(self.tcp_server.server_loop())
         self.main_coroutines.append(self.wait_for_new_connection())
@@ -42,27 +72,105 @@ class ProxyClient(tcp_over_icmp_tunnel.TCPoverICMPTunnel):
     async def wait_for_new_connection(self):
         """
         receive new connections from the server through incoming_tcp_connections queue.
+        sessions are opened concurrently, so a slow START doesn't delay the next connections.
+        connections are refused while the sessions buffer the whole buffer budget.
         """
         while True:
-            session_id, reader, writer = await self.incoming_tcp_connections.get()
-            new_tunnel_packet = ICMPTunnelPacket(
-                session_id=session_id,
-                action=Action.START,
-                direction=self.direction,
-                destination_host=self.destination_host,
-                port=self.destination_port,
-            )
+            connection = await self.incoming_tcp_connections.get()
+            if self.client_manager.over_budget():
+                log.info(f'buffer budget exceeded, refusing connection to {connection.destination_host}')
+                if connection.socks:
+                    socks5.send_reply(connection.writer, socks5.GENERAL_FAILURE)
+                connection.writer.close()
+                continue
+            if connection.socks:
+                asyncio.create_task(self.open_socks_session(connection))
+            else:
+                asyncio.create_task(self.open_session(connection))
+
+    async def open_session(self, connection: tcp_server.NewConnection):
+        """
+        send a START carrying the first data of a new connection, and add it as a client right away
+        so its next data is sent behind the START. the proxy server buffers it until it is connected.
+        """
+        initial_data = await self.read_initial_data(connection.reader, connection.destination_host)
+        new_tunnel_packet = ICMPTunnelPacket(
+            session_id=connection.session_id,
+            action=Action.START,
+            direction=self.direction,
+            destination_host=connection.destination_host,
+            port=connection.destination_port,
+            payload=initial_data,
+        )
+
+        remote_endpoint = self.choose_endpoint()
+        session_key = (remote_endpoint, connection.session_id)
+        start_acked = asyncio.create_task(self.send_icmp_packet_wait_ack(new_tunnel_packet, remote_endpoint))
+        self.client_manager.add_client(session_key, connection.reader, connection.writer)
+        # if the other endpoint rejected the START request, didnt receive it or is dead, close the local client.
+        if await start_acked is not True and self.client_manager.client_exists(session_key):
+            await self.client_manager.remove_client(session_key)
+
+    async def open_socks_session(self, connection: tcp_server.NewConnection):
+        """
+        send a START for a new SOCKS5 connection, and answer its CONNECT request once the START is acked
+        or rejected. the application only sends data after the answer, so nothing is pipelined.
+        """
+        new_tunnel_packet = ICMPTunnelPacket(
+            session_id=connection.session_id,
+            action=Action.START,
+            direction=self.direction,
+            destination_host=connection.destination_host,
+            port=connection.destination_port,
+        )
+
+        remote_endpoint = self.choose_endpoint()
+        start_acked = await self.send_icmp_packet_wait_ack(new_tunnel_packet, remote_endpoint)
+        if start_acked:
+            socks5.send_reply(connection.writer, socks5.SUCCEEDED)
+            self.client_manager.add_client((remote_endpoint, connection.session_id), connection.reader, connection.writer)
+            return
 
+        # the proxy server rejected the START, or didnt receive it
+        socks5.send_reply(connection.writer, socks5.CONNECTION_REFUSED if start_acked is False else socks5.HOST_UNREACHABLE)
+        connection.writer.close()
 
-            # only add client if other endpoint acked.
-            if await self.send_icmp_packet_wait_ack(new_tunnel_packet):
-                self.client_manager.add_client(session_id, reader, writer)
-            else:  # if the other endpoint didnt receive the START request, close the local client.
-                writer.close()
-                await writer.wait_closed()
+    async def read_initial_data(self, reader: asyncio.StreamReader, destination_host: str):
+        """
+        read the data a new connection sends within INITIAL_DATA_WAIT.
+        the data is limited so the START stays as large as a data packet.
+        returns: the data read, empty if the connection sent nothing yet.
+        """
+        try:
+            return await asyncio.wait_for(
+                reader.read(ClientSession.DATA_SIZE - len(destination_host.encode('utf-8'))),
+                self.INITIAL_DATA_WAIT
+            )
+        except (asyncio.TimeoutError, ConnectionResetError):
+            return b''
 
-    async def start_session(self, icmp_tunnel_packet: ICMPTunnelPacket):
+    async def start_session(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
         """
         start action is only sent to the proxy server therfore the packet is ignored
         """
-        log.info(f'ignore packet eith invalod command{icmp_tunnel_packet}')
+        log.info('ignore packet eith invalod command%s', icmp_tunnel_packet)
+
+    def choose_endpoint(self):
+        """
+        returns the proxy server to open a new session on, a dead one only if all of them are dead
+        """
+        return self.path_selector.choose_endpoint(
+            excluded=[endpoint for endpoint in self.remote_endpoints if self.peer_is_dead(endpoint)]
+        )
+
+    def choose_identifier(self, destination: str):
+        """
+        returns the ICMP identifier of the path to send the next packet to a proxy server on
+        """
+        return self.path_selector.choose_identifier(destination)
+
+    def on_packet_acked(self, destination: str, identifier: int, rtt: float = None):
+        self.path_selector.on_ack(destination, identifier, rtt)
+
+    def on_packet_timed_out(self, destination: str, identifier: int):
+        self.path_selector.on_timeout(destination, identifier)
@@ -1,25 +1,82 @@
 import asyncio
 import logging
 import argparse
-from TCPOverICMP import proxy_client
+from TCPOverICMP import proxy_client, congestion, log_setup, packet_trace
+from TCPOverICMP.pacing import Pacer
+from TCPOverICMP.tcp_over_icmp_tunnel import TCPoverICMPTunnel
+from TCPOverICMP.client_manager import ClientManager
 
 
-logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
+def identifiers(value):
+    return [int(identifier, 0) for identifier in value.split(',')]
+
+
+def forward(value):
+    listening_port, _, destination = value.partition(':')
+    destination_host, _, destination_port = destination.rpartition(':')
+    return int(listening_port), (destination_host, int(destination_port))
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('proxy_ip', help='IP address of the proxy server')
-    parser.add_argument('listening_port', type=int, help='Port on which the ProxyClient will listen')
-    parser.add_argument('destination_ip', help='IP address to transmit to')
-    parser.add_argument('destination_port', type=int, help='port to transmit to')
-    return parser.parse_args()
+    parser.add_argument('proxy_ip', type=lambda value: value.split(','),
+                        help='IP address of the proxy server, or comma separated proxy servers to spread sessions over')
+    parser.add_argument('listening_port', type=int, nargs='?', help='Port on which the ProxyClient will listen')
+    parser.add_argument('destination_ip', nargs='?', help='IP address to transmit to')
+    parser.add_argument('destination_port', type=int, nargs='?', help='port to transmit to')
+    parser.add_argument('--forward', type=forward, action='append', default=[], metavar='PORT:HOST:PORT',
+                        help='listening port and the destination to transmit to, can be repeated')
+    parser.add_argument('--socks', type=int, default=None, metavar='PORT',
+                        help='port on which the ProxyClient will listen for SOCKS5 connections')
+    parser.add_argument('--identifiers', type=identifiers, default=None, metavar='ID[,ID...]',
+                        help='ICMP identifiers to spread packets over, every one is a separate ICMP flow')
+    parser.add_argument('--congestion-control', choices=congestion.CONTROLLERS, default='newreno',
+                        help='congestion controller of the data sent to the proxy servers')
+    parser.add_argument('--pacing-rate', type=float, default=None, metavar='PACKETS/S',
+                        help='most ICMP packets sent per second')
+    parser.add_argument('--pacing-bytes-rate', type=float, default=None, metavar='BYTES/S',
+                        help='most ICMP bytes sent per second')
+    parser.add_argument('--adaptive-pacing', action='store_true',
+                        help='space out ICMP packets at the rate the congestion controllers measure')
+    parser.add_argument('--heartbeat-interval', type=float, default=TCPoverICMPTunnel.HEARTBEAT_INTERVAL,
+                        help='seconds between the heartbeats sent to every proxy server')
+    parser.add_argument('--dead-peer-timeout', type=float, default=TCPoverICMPTunnel.DEAD_PEER_TIMEOUT,
+                        help='seconds without a packet from a proxy server before its sessions are failed')
+    parser.add_argument('--idle-timeout', type=float, default=ClientManager.IDLE_TIMEOUT,
+                        help='seconds a session may be idle before it is terminated, 0 never')
+    parser.add_argument('--buffer-budget', type=int, default=ClientManager.BUFFER_BUDGET, metavar='BYTES',
+                        help='bytes all the sessions may buffer, the largest sessions are shed above it')
+    log_setup.add_arguments(parser)
+    packet_trace.add_arguments(parser)
+    args = parser.parse_args()
+    if args.destination_port is not None:
+        args.forward.append((args.listening_port, (args.destination_ip, args.destination_port)))
+    elif args.listening_port is not None:
+        parser.error('listening_port requires destination_ip and destination_port')
+    if not args.forward and args.socks is None:
+        parser.error('nothing to listen on, give a listening port, --forward or --socks')
+    return args
 
 
 async def main():
     args = parse_args()
-    await proxy_client.ProxyClient(args.proxy_ip, args.listening_port, args.destination_ip, args.destination_port).run()
+    log_setup.configure_logging(args.log_level, args.log_queue, args.packet_log_sample)
+    packet_trace.configure_trace(args.trace_size, args.trace_snaplen, args.trace_dir)
+    await proxy_client.ProxyClient(
+        args.proxy_ip,
+        dict(args.forward),
+        args.identifiers,
+        args.socks,
+        congestion.CONTROLLERS[args.congestion_control],
+        Pacer(args.pacing_rate, args.pacing_bytes_rate, args.adaptive_pacing),
+        args.heartbeat_interval,
+        args.dead_peer_timeout,
+        args.idle_timeout,
+        args.buffer_budget,
+    ).run()
 
 
 def run_async_loop():
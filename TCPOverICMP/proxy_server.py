@@ -3,44 +3,79 @@ proxy_server.py
 
 This module implements the ProxyServer class, which handles the server-side operations of the TCP-over-ICMP tunnel.
 It listens for ICMP requests to establish TCP connections and forwards the data between the client and destination.
+It serves many proxy clients at once, their sessions are kept apart by the ip of the proxy client (the peer).
 
 Key Components:
 - `ProxyServer`: Inherits from `TCPoverICMPTunnel` and manages TCP connections to destination servers.
-- Establishes TCP connections upon receiving START requests.
-- Forwards data received over ICMP to the appropriate TCP connection.
+- Establishes TCP connections upon receiving START requests, a bounded number at a time and with a connect timeout.
+- Limits the number of sessions each peer can open.
+- Optionally claims pre-established connections to hot destinations from a `ConnectionPool`.
+- Resolves destination hostnames through a `ResolverCache`.
+- Forwards data received over ICMP to the appropriate TCP connection, buffering data that arrives
+  while the connection is still being opened.
 
 Main Methods:
 - `open_tcp_connection`: Opens a TCP connection to the specified destination host and port, setting the MSS (Maximum Segment Size).
-- `start_session`: Initiates a TCP session and registers the client in the `ClientManager`.
+- `start_session`: Marks a TCP session as pending and starts connecting it, or rejects the START.
+  a START to another destination than the session of its id replaces that session (a restarted peer reuses ids).
+- `connect_session`: Connects a pending session, writes the data carried by the START and registers the client in the
+  `ClientManager`, or rejects the START.
+- `handle_data`: Buffers data for sessions being opened, forwards data of open sessions.
+- `terminate_session`: Terminates open sessions, and cancels the sessions being opened.
 """
 import asyncio
+import collections
 import logging
 from TCPOverICMP.tunnel_packet import ICMPTunnelPacket,Direction
 import socket
 
 from TCPOverICMP import tcp_over_icmp_tunnel
+from TCPOverICMP.connection_pool import ConnectionPool
+from TCPOverICMP.client_manager import ClientManager
+from TCPOverICMP.resolver import ResolverCache
 
 
 log = logging.getLogger(__name__)
 
 
 class ProxyServer(tcp_over_icmp_tunnel.TCPoverICMPTunnel):
-    
-    def __init__(self):
+    MAX_PENDING_CONNECTIONS = 32 #concurrent connects to destinations
+    #must be shorter than the time the proxy client retries a START
+    CONNECT_TIMEOUT = 2.0
+    MAX_EARLY_PACKETS = ClientManager.INBOX_SIZE #data packets buffered per session while connecting
+    MAX_SESSIONS_PER_PEER = 1024 #open and opening sessions
+
+    def __init__(self, connection_pool: ConnectionPool = None, resolver: ResolverCache = None, identifiers=None,
+                 congestion_control=None, pacer=None, dead_peer_timeout=None, idle_timeout=None, buffer_budget=None):
         # super(ProxyServer, self).__init__(ICMPTunnelPacket.Direction.PROXY_CLIENT)
-        super(ProxyServer, self).__init__(Direction.PROXY_CLIENT)
+        super(ProxyServer, self).__init__(
+            Direction.PROXY_CLIENT, identifiers=identifiers, congestion_control=congestion_control, pacer=pacer,
+            dead_peer_timeout=dead_peer_timeout, idle_timeout=idle_timeout, buffer_budget=buffer_budget
+        )
+        self.connection_semaphore = asyncio.Semaphore(self.MAX_PENDING_CONNECTIONS)
+        self.pending_sessions = {} #session_key: data that arrived while connecting, by sequence
+        self.pending_destinations = {} #session_key: (host, port) of the pending session
+        self.cancelled_sessions = set() #pending sessions terminated by the peer while connecting
+        self.peer_pending_sessions = collections.Counter() #peer: number of pending sessions
+        self.connection_pool = connection_pool
+        self.resolver = resolver if resolver is not None else ResolverCache()
+        if self.connection_pool is not None:
+            self.main_coroutines.append(self.connection_pool.maintain())
+
     async def open_tcp_connection(self,destination_host, port, mss=1400):
         """
         used to start a tcp connection bu proxy server when sent a start request
         @param destination_hst: ip adress of destination 
         @param: port port of destination 
         returns a reader write
+        raises OSError if the connection failed
         """
-        try:
-            reader, writer = await asyncio.open_connection(destination_host, port)
-        except ConnectionRefusedError:
-            log.debug(f'connection.connect not started: {destination_host}:{port} refused connection.')
-            return
+        if self.connection_pool is not None:
+            pooled_connection = self.connection_pool.acquire(destination_host, port)
+            if pooled_connection is not None:
+                return pooled_connection
+
+        reader, writer = await self.resolver.open_connection(destination_host, port)
     
         # # Get the underlying socket
         # socket_obj = writer.get_extra_info('socket')
@@ -49,14 +84,143 @@ class ProxyServer(tcp_over_icmp_tunnel.TCPoverICMPTunnel):
         #     socket_obj.setsockopt(socket.IPPROTO_TCP, socket.TCP_MAXSEG, mss)
     
         return reader, writer
-    async def start_session(self, icmp_tunnel_packet: ICMPTunnelPacket):
+
+    async def open_tcp_connection_limited(self, destination_host, port):
         """
-        operates a start action, 
+        open a tcp connection once one of MAX_PENDING_CONNECTIONS is free
         """
-        reader,writer = await self.open_tcp_connection(icmp_tunnel_packet.destination_host, icmp_tunnel_packet.port)
+        async with self.connection_semaphore:
+            return await self.open_tcp_connection(destination_host, port)
+
+    def peer_session_count(self, peer: str):
+        """
+        returns the number of open and pending sessions of a peer
+        """
+        return self.client_manager.peer_session_count(peer) + self.peer_pending_sessions[peer]
+
+    async def start_session(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        operates a start action of a peer, the session is pending right away so data sent behind the START is
+        buffered, and the connection is opened in its own task.
+        a repeated START is acked if the session is open, and ignored while it is being opened.
+        a START to another destination than its session is a new session reusing the session id (the peer was
+        restarted), the old session is dropped without a TERMINATE and the new one is opened.
+        the START is rejected if the peer has MAX_SESSIONS_PER_PEER sessions, or the sessions buffer
+        the whole buffer budget.
+        """
+        session_key = (peer, icmp_tunnel_packet.session_id)
+        destination = (icmp_tunnel_packet.destination_host, icmp_tunnel_packet.port)
+        if self.client_manager.client_exists(session_key):
+            if self.client_manager.client_destination(session_key) == destination:
+                self.send_ack(icmp_tunnel_packet, peer)
+                return
+            log.info(f'(session_key={session_key}): START to {destination} reuses the session id, '
+                     f'dropping the open session')
+            #the old session's data is for a connection the peer no longer has, it is not flushed
+            await self.client_manager.remove_client(session_key, flush=False)
+        elif session_key in self.pending_sessions:
+            if self.pending_destinations[session_key] == destination:
+                return
+            log.info(f'(session_key={session_key}): START to {destination} reuses the session id, '
+                     f'dropping the session being opened')
+            #the old connect finds its pending session replaced, and closes its connection once open
+            self.cancelled_sessions.discard(session_key)
+            del self.pending_sessions[session_key]
+        if self.peer_session_count(peer) >= self.MAX_SESSIONS_PER_PEER:
+            log.info(f'{peer} reached {self.MAX_SESSIONS_PER_PEER} sessions, rejecting START')
+            self.send_reject(icmp_tunnel_packet, peer)
+            return
+        if self.client_manager.over_budget():
+            log.info(f'buffer budget exceeded, rejecting START of {peer}')
+            self.send_reject(icmp_tunnel_packet, peer)
+            return
+
+        early_data = self.pending_sessions[session_key] = {}
+        self.pending_destinations[session_key] = destination
+        self.peer_pending_sessions[peer] += 1
+        asyncio.create_task(self.connect_session(icmp_tunnel_packet, peer, early_data))
+
+    async def connect_session(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str, early_data: dict):
+        """
+        open the connection of a pending session, acks the START once the connection is open, or rejects it
+        if the destination can't be reached within CONNECT_TIMEOUT.
+        the data carried by the START is written first, then the data that arrived while connecting.
+        a session the peer terminated while connecting is closed once connected instead of being added,
+        and so is a session replaced by a START to another destination, whose START is neither acked nor rejected.
+        @param early_data: the buffer of the pending session, by sequence
+        """
+        session_key = (peer, icmp_tunnel_packet.session_id)
+        try:
+            reader, writer = await asyncio.wait_for(
+                self.open_tcp_connection_limited(icmp_tunnel_packet.destination_host, icmp_tunnel_packet.port),
+                self.CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            log.debug(f'connection.connect not started: '
+                      f'{icmp_tunnel_packet.destination_host}:{icmp_tunnel_packet.port} {e!r}')
+            if self.pending_sessions.get(session_key) is early_data and session_key not in self.cancelled_sessions:
+                self.send_reject(icmp_tunnel_packet, peer)
+            return
+        finally:
+            replaced = self.pending_sessions.get(session_key) is not early_data
+            cancelled = not replaced and session_key in self.cancelled_sessions
+            if not replaced:
+                del self.pending_sessions[session_key]
+                del self.pending_destinations[session_key]
+                self.cancelled_sessions.discard(session_key)
+            self.peer_pending_sessions[peer] -= 1
+            if not self.peer_pending_sessions[peer]:
+                del self.peer_pending_sessions[peer]
+
+        if replaced:
+            log.debug(f'(session_key={session_key}): replaced by a new session while connecting, closing')
+            writer.close()
+            return
+        if cancelled:
+            #the START is acked all the same, or the peer would repeat it and open the session again
+            log.debug(f'(session_key={session_key}): terminated while connecting, closing')
+            writer.close()
+            self.send_ack(icmp_tunnel_packet, peer)
+            return
+        if icmp_tunnel_packet.payload:
+            writer.write(icmp_tunnel_packet.payload)
         self.client_manager.add_client(
-            session_id=icmp_tunnel_packet.session_id,
+            session_key=session_key,
             reader=reader,
             writer=writer,
+            destination=(icmp_tunnel_packet.destination_host, icmp_tunnel_packet.port),
         )
-        self.send_ack(icmp_tunnel_packet)
\ No newline at end of file
+        #the early data is already acked. the inbox holds MAX_EARLY_PACKETS, so a write is only refused if the
+        #session was shed by the buffer budget meanwhile, which terminates it. the START is acked anyway, or the
+        #peer would repeat it and open the session again
+        for seq, data in early_data.items():
+            if not self.client_manager.write_to_client(session_key, seq, data):
+                log.info(f'(session_key={session_key}): shed while writing the data sent during its connect')
+                break
+        self.send_ack(icmp_tunnel_packet, peer)
+
+    async def terminate_session(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        operates the TERMINATE action. a session still connecting is marked cancelled, it is closed once
+        connected instead of being added.
+        """
+        session_key = (peer, icmp_tunnel_packet.session_id)
+        if session_key in self.pending_sessions:
+            self.cancelled_sessions.add(session_key)
+        await super(ProxyServer, self).terminate_session(icmp_tunnel_packet, peer)
+
+    async def handle_data(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        operate data action. data of a session that is being opened is buffered and acked,
+        up to MAX_EARLY_PACKETS packets.
+        @param icmp_tunnel_packet: used to foward to client the data
+        @param peer: the ip the packet came from
+        """
+        early_data = self.pending_sessions.get((peer, icmp_tunnel_packet.session_id))
+        if early_data is None:
+            await super(ProxyServer, self).handle_data(icmp_tunnel_packet, peer)
+            return
+
+        if len(early_data) < self.MAX_EARLY_PACKETS or icmp_tunnel_packet.seq in early_data:
+            early_data[icmp_tunnel_packet.seq] = icmp_tunnel_packet.payload
+            self.ack_data(icmp_tunnel_packet, peer)
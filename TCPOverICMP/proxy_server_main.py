@@ -1,12 +1,71 @@
 import asyncio
 import logging
-from TCPOverICMP import  proxy_server
+import argparse
+from TCPOverICMP import  proxy_server, congestion, log_setup, packet_trace
+from TCPOverICMP.pacing import Pacer
+from TCPOverICMP.tcp_over_icmp_tunnel import TCPoverICMPTunnel
+from TCPOverICMP.client_manager import ClientManager
+from TCPOverICMP.connection_pool import ConnectionPool
+from TCPOverICMP.resolver import ResolverCache
 
-logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
+def destination(value):
+    host, _, port = value.rpartition(':')
+    return host, int(port)
+
+
+def identifiers(value):
+    return [int(identifier, 0) for identifier in value.split(',')]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--identifiers', type=identifiers, default=None, metavar='ID[,ID...]',
+                        help='ICMP identifiers accepted from proxy clients')
+    parser.add_argument('--pool', type=destination, action='append', default=[], metavar='HOST:PORT',
+                        help='destination to keep warm connections to, can be repeated')
+    parser.add_argument('--pool-size', type=int, default=ConnectionPool.DEFAULT_SIZE,
+                        help='open connections kept per pooled destination')
+    parser.add_argument('--pool-ttl', type=float, default=ConnectionPool.DEFAULT_IDLE_TTL,
+                        help='seconds a pooled connection may stay unused')
+    parser.add_argument('--dns-ttl', type=float, default=ResolverCache.TTL,
+                        help='seconds a resolved destination hostname is cached')
+    parser.add_argument('--dns-negative-ttl', type=float, default=ResolverCache.NEGATIVE_TTL,
+                        help='seconds a failed destination hostname lookup is cached')
+    parser.add_argument('--congestion-control', choices=congestion.CONTROLLERS, default='newreno',
+                        help='congestion controller of the data sent to proxy clients')
+    parser.add_argument('--pacing-rate', type=float, default=None, metavar='PACKETS/S',
+                        help='most ICMP packets sent per second')
+    parser.add_argument('--pacing-bytes-rate', type=float, default=None, metavar='BYTES/S',
+                        help='most ICMP bytes sent per second')
+    parser.add_argument('--adaptive-pacing', action='store_true',
+                        help='space out ICMP packets at the rate the congestion controllers measure')
+    parser.add_argument('--dead-peer-timeout', type=float, default=TCPoverICMPTunnel.DEAD_PEER_TIMEOUT,
+                        help='seconds without a packet from a proxy client sending heartbeats '
+                             'before its sessions are failed')
+    parser.add_argument('--idle-timeout', type=float, default=ClientManager.IDLE_TIMEOUT,
+                        help='seconds a session may be idle before it is terminated, 0 never')
+    parser.add_argument('--buffer-budget', type=int, default=ClientManager.BUFFER_BUDGET, metavar='BYTES',
+                        help='bytes all the sessions may buffer, the largest sessions are shed above it')
+    log_setup.add_arguments(parser)
+    packet_trace.add_arguments(parser)
+    return parser.parse_args()
+
+
 async def main():
-    await proxy_server.ProxyServer().run()
+    args = parse_args()
+    log_setup.configure_logging(args.log_level, args.log_queue, args.packet_log_sample)
+    packet_trace.configure_trace(args.trace_size, args.trace_snaplen, args.trace_dir)
+    resolver = ResolverCache(ttl=args.dns_ttl, negative_ttl=args.dns_negative_ttl)
+    connection_pool = None
+    if args.pool:
+        connection_pool = ConnectionPool(args.pool, args.pool_size, args.pool_ttl, connect=resolver.open_connection)
+    pacer = Pacer(args.pacing_rate, args.pacing_bytes_rate, args.adaptive_pacing)
+    await proxy_server.ProxyServer(
+        connection_pool, resolver, args.identifiers, congestion.CONTROLLERS[args.congestion_control], pacer,
+        args.dead_peer_timeout, args.idle_timeout, args.buffer_budget
+    ).run()
 
 def run_async_loop():
     asyncio.run(main())
@@ -0,0 +1,140 @@
+"""
+resolver.py
+
+This module defines the ResolverCache class, used by the ProxyServer to resolve destination hostnames once
+for a burst of sessions instead of once per session.
+
+Key Components:
+- resolver: the coroutine function resolving a hostname to an address, getaddrinfo by default.
+- cache: resolved addresses and failed lookups, each kept until it expires.
+- lookups: lookups in progress, shared by everyone resolving the same hostname.
+
+Main Methods:
+- resolve: Returns the addresses of a hostname, from the cache or from a single shared lookup.
+- open_connection: Resolves a hostname and opens a TCP connection to it, trying its addresses in turn.
+"""
+import asyncio
+import ipaddress
+import logging
+import socket
+
+log = logging.getLogger(__name__)
+
+
+async def getaddrinfo_resolver(host: str):
+    """
+    resolve a hostname with the event loop's getaddrinfo
+    returns: the addresses of the host, in the order getaddrinfo prefers them
+    """
+    address_info = await asyncio.get_event_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in address_info))
+
+
+class ResolverCache:
+    """
+    async hostname resolver with positive and negative caching
+    """
+    TTL = 60.0 #seconds a resolved address is kept
+    NEGATIVE_TTL = 5.0 #seconds a failed lookup is kept
+    MAX_ENTRIES = 1024
+    #seconds an address is given to connect before the next address of the host is tried
+    ATTEMPT_TIMEOUT = 1.0
+
+    def __init__(self, resolver=getaddrinfo_resolver, ttl: float = TTL, negative_ttl: float = NEGATIVE_TTL):
+        """
+        @param resolver: coroutine function host -> list of addresses, raising OSError when the host can't be
+        resolved, or UnicodeError when the hostname is invalid.
+        @param ttl: seconds a resolved address is kept.
+        @param negative_ttl: seconds a failed lookup is kept.
+        """
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = {} #host: (expires_at, addresses or the OSError of the lookup)
+        self.lookups = {}
+
+    @staticmethod
+    def is_address(host: str):
+        """
+        returns if host is already an ip address
+        """
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return True
+
+    async def resolve(self, host: str):
+        """
+        resolve a hostname, concurrent calls for the same hostname share one lookup.
+        @param host: the hostname to resolve
+        returns: the addresses of the host, a tuple
+        raises OSError if the host can't be resolved
+        """
+        if self.is_address(host):
+            return (host,)
+
+        entry = self.cache.get(host)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > asyncio.get_event_loop().time():
+                if isinstance(result, OSError):
+                    #a new exception every time, raising the cached one would grow its traceback on every hit
+                    raise type(result)(*result.args)
+                return result
+            self.cache.pop(host)
+
+        if host not in self.lookups:
+            lookup = asyncio.ensure_future(self.lookup(host))
+            # the result is retrieved even if every caller was cancelled
+            lookup.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self.lookups[host] = lookup
+        # one caller timing out doesn't cancel the lookup of the others
+        return await asyncio.shield(self.lookups[host])
+
+    async def lookup(self, host: str):
+        """
+        resolve a hostname with the resolver and cache the result.
+        the hostname comes from a peer: one that can't be encoded (an empty or too long label), or that resolves to
+        no address, fails the lookup with an OSError like an unknown hostname.
+        """
+        try:
+            try:
+                addresses = tuple(await self.resolver(host))
+            except UnicodeError as e:
+                raise socket.gaierror(socket.EAI_NONAME, f'invalid hostname: {e}') from None
+            if not addresses:
+                raise socket.gaierror(socket.EAI_NONAME, 'no address')
+        except OSError as e:
+            log.debug(f'failed to resolve {host}: {e!r}')
+            self.store(host, self.negative_ttl, e)
+            raise
+        else:
+            log.debug(f'resolved {host}: {addresses}')
+            self.store(host, self.ttl, addresses)
+            return addresses
+        finally:
+            self.lookups.pop(host)
+
+    def store(self, host: str, ttl: float, result):
+        """
+        cache the result of a lookup, dropping the oldest entry if the cache is full.
+        """
+        if len(self.cache) >= self.MAX_ENTRIES:
+            self.cache.pop(next(iter(self.cache)))
+        self.cache[host] = (asyncio.get_event_loop().time() + ttl, result)
+
+    async def open_connection(self, host: str, port: int):
+        """
+        resolve the host and open a tcp connection to it. its addresses are tried in turn, every one but the last
+        for up to ATTEMPT_TIMEOUT, so an unreachable address (IPv6 without a route) doesn't fail the host.
+        returns a reader, writer
+        raises OSError if the host can't be resolved or the connection to every address failed
+        """
+        addresses = await self.resolve(host)
+        for address in addresses[:-1]:
+            try:
+                return await asyncio.wait_for(asyncio.open_connection(address, port), self.ATTEMPT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                log.debug(f'failed to connect {host} at {address}: {e!r}')
+        return await asyncio.open_connection(addresses[-1], port)
@@ -0,0 +1,395 @@
+"""
+simulator.py
+
+This module provides a deterministic discrete-event simulation of the TCP-over-ICMP tunnel, for comparing
+protocol changes (retransmit timers, windows, batching...) quantitatively instead of on real links.
+The real TCPoverICMPTunnel, ClientManager and ClientSession run on an event loop with a virtual clock,
+and their ICMP packets cross a modeled link instead of a raw socket. Time only advances when every task waits,
+so thousands of simulated seconds run per wall second, and a seed reproduces the same run.
+
+Key Components:
+- VirtualClockEventLoop: An asyncio event loop whose clock jumps to the next scheduled timer instead of sleeping.
+- LinkModel: One direction of the link: bandwidth, delay, loss, reordering, duplication and queue size.
+- SimulatedICMPSocket: Sends the serialized ICMP packets of a tunnel over the modeled links.
+- SimulatedTunnel: A TCPoverICMPTunnel using a SimulatedICMPSocket.
+- Simulation: Runs a bulk transfer from a proxy client to a proxy server and measures it.
+- SimulationResult: Throughput, latency and retransmit numbers of a run.
+
+Usage:
+- python -m TCPOverICMP.simulator --seed 1 --loss 0.01 --delay 0.05
+"""
+import argparse
+import asyncio
+import collections
+import copy
+import random
+import selectors
+from TCPOverICMP import congestion, icmp_packet
+from TCPOverICMP.client_session import ClientSession
+from TCPOverICMP.pacing import Pacer
+from TCPOverICMP.tcp_over_icmp_tunnel import TCPoverICMPTunnel
+from TCPOverICMP.tunnel_packet import ICMPTunnelPacket, Action, Direction
+
+
+class VirtualClock(selectors.DefaultSelector):
+    """
+    selector that never blocks, waiting advances the virtual time instead
+    """
+    def __init__(self):
+        super(VirtualClock, self).__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        events = super(VirtualClock, self).select(0)
+        if not events:
+            if timeout is None:
+                raise RuntimeError('simulation is idle, nothing is scheduled')
+            self.now += timeout
+        return events
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        self.clock = VirtualClock()
+        super(VirtualClockEventLoop, self).__init__(self.clock)
+
+    def time(self):
+        return self.clock.now
+
+
+class LinkModel:
+    """
+    one direction of a link between the simulated endpoints
+    """
+    def __init__(
+            self,
+            bandwidth: float = 1_000_000,
+            delay: float = 0.025,
+            loss: float = 0.0,
+            reorder: float = 0.0,
+            reorder_delay: float = 0.01,
+            duplicate: float = 0.0,
+            queue_size: int = 64 * 1024,
+    ):
+        """
+        @param bandwidth: bytes per second
+        @param delay: one way propagation delay in seconds
+        @param loss: probability a packet is lost
+        @param reorder: probability a packet is held back by up to reorder_delay seconds
+        @param duplicate: probability a packet is delivered twice
+        @param queue_size: bytes queued for transmission before new packets are tail dropped
+        """
+        self.bandwidth = bandwidth
+        self.delay = delay
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.duplicate = duplicate
+        self.queue_size = queue_size
+        self.busy_until = 0.0
+        self.sent = 0
+        self.dropped = 0
+
+    def transmit(self, loop: asyncio.AbstractEventLoop, rng: random.Random, data: bytes, deliver):
+        """
+        schedule the delivery of a packet.
+        @param deliver: called with the packet when it arrives
+        """
+        now = loop.time()
+        start = max(now, self.busy_until)
+        if (start - now) * self.bandwidth + len(data) > self.queue_size:
+            self.dropped += 1
+            return
+        self.busy_until = start + len(data) / self.bandwidth
+        self.sent += 1
+
+        arrival = self.busy_until + self.delay
+        if rng.random() < self.loss:
+            self.dropped += 1
+            return
+        if rng.random() < self.reorder:
+            arrival += rng.uniform(0, self.reorder_delay)
+        loop.call_at(arrival, deliver, data)
+        if rng.random() < self.duplicate:
+            loop.call_at(arrival, deliver, data)
+
+
+class SimulatedICMPSocket:
+    """
+    ICMP socket of a simulated endpoint, sending over the link to the other endpoint
+    """
+    def __init__(self, packet_queue: asyncio.Queue, simulation: 'Simulation', address: str):
+        self.packet_queue = packet_queue
+        self.simulation = simulation
+        self.address = address
+
+    async def wait_for_incoming_packet(self):
+        """
+        packets are put in the queue by deliver
+        """
+        await asyncio.Event().wait()
+
+    def deliver(self, source: str, data: bytes):
+        self.packet_queue.put_nowait(icmp_packet.ICMPPacket.deserialize(data, source))
+
+    def sendto(self, frame: bytes, destination: str):
+        #the tunnel reuses the frame when resending, copy it as the socket would
+        self.simulation.transmit(self.address, destination, bytes(frame))
+
+
+class SimulatedTunnel(TCPoverICMPTunnel):
+    """
+    tunnel endpoint sending its ICMP packets over the simulated link
+    """
+    def __init__(self, simulation: 'Simulation', address: str, direction: Direction, remote_endpoints=None,
+                 congestion_control=None, pacer=None):
+        self.simulation = simulation
+        self.address = address
+        super(SimulatedTunnel, self).__init__(
+            direction, remote_endpoints, congestion_control=congestion_control, pacer=pacer
+        )
+
+    def create_icmp_socket(self, packet_queue: asyncio.Queue):
+        return SimulatedICMPSocket(packet_queue, self.simulation, self.address)
+
+
+class SinkWriter:
+    """
+    StreamWriter of a simulated application, records when every byte is written
+    """
+    def __init__(self, on_write):
+        self.on_write = on_write
+        self.closing = False
+
+    def write(self, data: bytes):
+        self.on_write(len(data))
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+    async def wait_closed(self):
+        pass
+
+
+class SimulationResult:
+    def __init__(self, duration, delivered, latencies, data_packets, retransmits, ack_packets, link_drops):
+        self.duration = duration
+        self.delivered = delivered
+        self.throughput = delivered / duration if duration else 0.0
+        self.latencies = sorted(latencies)
+        self.data_packets = data_packets
+        self.retransmits = retransmits
+        self.ack_packets = ack_packets
+        self.link_drops = link_drops
+
+    def latency_percentile(self, percentile: float):
+        if not self.latencies:
+            return None
+        return self.latencies[min(len(self.latencies) - 1, int(len(self.latencies) * percentile / 100))]
+
+    def __repr__(self):
+        return (
+            f"SimulationResult(\n"
+            f"    duration={self.duration:.3f}s,\n"
+            f"    delivered={self.delivered} bytes,\n"
+            f"    throughput={self.throughput:.0f} bytes/s,\n"
+            f"    latency_p50={self.latency_percentile(50)},\n"
+            f"    latency_p99={self.latency_percentile(99)},\n"
+            f"    data_packets={self.data_packets},\n"
+            f"    retransmits={self.retransmits},\n"
+            f"    ack_packets={self.ack_packets},\n"
+            f"    link_drops={self.link_drops}\n"
+            f")"
+        )
+
+
+class Simulation:
+    """
+    bulk transfer from the applications of a proxy client to the destinations of a proxy server,
+    optionally echoed back by the destinations
+    """
+    CLIENT_ADDRESS = '10.0.0.1'
+    SERVER_ADDRESS = '10.0.0.2'
+
+    def __init__(self, seed: int = 0, forward_link: LinkModel = None, reverse_link: LinkModel = None,
+                 congestion_control=None, pacing: dict = None):
+        """
+        @param forward_link: the link from the proxy client to the proxy server
+        @param reverse_link: the link from the proxy server to the proxy client, as forward_link by default
+        @param congestion_control: the congestion controller class of both endpoints
+        @param pacing: the arguments of the Pacer of each endpoint, None for no pacing
+        """
+        self.congestion_control = congestion_control
+        self.pacing = pacing
+        self.rng = random.Random(seed)
+        self.forward_link = forward_link if forward_link is not None else LinkModel()
+        self.reverse_link = reverse_link if reverse_link is not None else copy.copy(self.forward_link)
+        self.links = {
+            (self.CLIENT_ADDRESS, self.SERVER_ADDRESS): self.forward_link,
+            (self.SERVER_ADDRESS, self.CLIENT_ADDRESS): self.reverse_link,
+        }
+        self.sockets = {}
+        self.sent_data = set()
+        self.data_packets = 0
+        self.retransmits = 0
+        self.ack_packets = 0
+
+    def transmit(self, source: str, destination: str, data: bytes):
+        """
+        send a serialized ICMP packet over the link from source to destination
+        """
+        tunnel_packet = ICMPTunnelPacket.deserialize(data[icmp_packet.ICMPPacket.ICMP_STRUCT.size:])
+        if tunnel_packet.action == Action.DATA_TRANSFER:
+            packet_id = (source, tunnel_packet.session_id, tunnel_packet.seq)
+            self.data_packets += 1
+            if packet_id in self.sent_data:
+                self.retransmits += 1
+            self.sent_data.add(packet_id)
+        elif tunnel_packet.action == Action.ACK:
+            self.ack_packets += 1
+
+        socket = self.sockets[destination]
+        self.links[(source, destination)].transmit(
+            asyncio.get_event_loop(), self.rng, data, lambda packet: socket.deliver(source, packet)
+        )
+
+    def run(self, transfer_size: int = 1_000_000, sessions: int = 1, time_limit: float = 600.0, echo: bool = False):
+        """
+        run a transfer of transfer_size bytes on each of sessions sessions.
+        @param time_limit: simulated seconds after which the transfer is stopped
+        @param echo: the destinations send back all they receive, the transfer ends once the echo arrived
+        returns: SimulationResult
+        """
+        loop = VirtualClockEventLoop()
+        try:
+            return loop.run_until_complete(self.transfer(transfer_size, sessions, time_limit, echo))
+        finally:
+            #the tunnels leave tasks waiting for acks behind
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+    async def transfer(self, transfer_size: int, sessions: int, time_limit: float, echo: bool):
+        loop = asyncio.get_event_loop()
+        client = SimulatedTunnel(
+            self, self.CLIENT_ADDRESS, Direction.PROXY_SERVER, (self.SERVER_ADDRESS,), self.congestion_control,
+            Pacer(**self.pacing) if self.pacing is not None else None
+        )
+        server = SimulatedTunnel(
+            self, self.SERVER_ADDRESS, Direction.PROXY_CLIENT, None, self.congestion_control,
+            Pacer(**self.pacing) if self.pacing is not None else None
+        )
+        self.sockets = {self.CLIENT_ADDRESS: client.icmp_socket, self.SERVER_ADDRESS: server.icmp_socket}
+        tasks = [asyncio.create_task(client.run()), asyncio.create_task(server.run())]
+
+        done = asyncio.Event()
+        written = [0] * sessions
+        echoed = [0] * sessions
+        latencies = []
+        #session_id: (end offset, time fed) of every chunk not fully written yet
+        pending_chunks = [collections.deque() for _ in range(sessions)]
+        started_at = loop.time()
+
+        def on_write(session_id, size):
+            written[session_id] += size
+            chunks = pending_chunks[session_id]
+            while chunks and chunks[0][0] <= written[session_id]:
+                latencies.append(loop.time() - chunks.popleft()[1])
+            if sum(echoed if echo else written) >= transfer_size * sessions:
+                done.set()
+
+        def on_echo(session_id, size):
+            echoed[session_id] += size
+            if sum(echoed) >= transfer_size * sessions:
+                done.set()
+
+        for session_id in range(sessions):
+            source = asyncio.StreamReader()
+            destination = asyncio.StreamReader()
+
+            def on_destination_write(size, session_id=session_id, destination=destination):
+                if echo:
+                    destination.feed_data(bytes(size))
+                on_write(session_id, size)
+
+            client.client_manager.add_client(
+                (self.SERVER_ADDRESS, session_id),
+                source,
+                SinkWriter(lambda size, session_id=session_id: on_echo(session_id, size)),
+            )
+            server.client_manager.add_client(
+                (self.CLIENT_ADDRESS, session_id),
+                destination,
+                SinkWriter(on_destination_write),
+            )
+            for offset in range(0, transfer_size, ClientSession.DATA_SIZE):
+                chunk = min(ClientSession.DATA_SIZE, transfer_size - offset)
+                pending_chunks[session_id].append((offset + chunk, loop.time()))
+                source.feed_data(bytes(chunk))
+
+        try:
+            await asyncio.wait_for(done.wait(), time_limit)
+        except asyncio.TimeoutError:
+            pass
+        duration = loop.time() - started_at
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return SimulationResult(
+            duration,
+            sum(written),
+            latencies,
+            self.data_packets,
+            self.retransmits,
+            self.ack_packets,
+            self.forward_link.dropped + self.reverse_link.dropped,
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='simulate a transfer through the tunnel over a modeled link')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bandwidth', type=float, default=1_000_000, help='bytes per second')
+    parser.add_argument('--delay', type=float, default=0.025, help='one way delay in seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='packet loss probability')
+    parser.add_argument('--reorder', type=float, default=0.0, help='packet reordering probability')
+    parser.add_argument('--duplicate', type=float, default=0.0, help='packet duplication probability')
+    parser.add_argument('--queue-size', type=int, default=64 * 1024, help='link queue size in bytes')
+    parser.add_argument('--transfer-size', type=int, default=1_000_000, help='bytes sent on every session')
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--time-limit', type=float, default=600.0, help='simulated seconds')
+    parser.add_argument('--echo', action='store_true', help='the destinations send back all they receive')
+    parser.add_argument('--congestion-control', choices=congestion.CONTROLLERS, default='newreno')
+    parser.add_argument('--pacing-rate', type=float, default=None, help='packets per second')
+    parser.add_argument('--pacing-bytes-rate', type=float, default=None, help='bytes per second')
+    parser.add_argument('--adaptive-pacing', action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    link = LinkModel(args.bandwidth, args.delay, args.loss, args.reorder, duplicate=args.duplicate,
+                     queue_size=args.queue_size)
+    pacing = {
+        'packets_per_second': args.pacing_rate,
+        'bytes_per_second': args.pacing_bytes_rate,
+        'adaptive': args.adaptive_pacing,
+    }
+    simulation = Simulation(
+        args.seed, link, congestion_control=congestion.CONTROLLERS[args.congestion_control], pacing=pacing
+    )
+    print(simulation.run(args.transfer_size, args.sessions, args.time_limit, args.echo))
+
+
+if __name__ == '__main__':
+    main()
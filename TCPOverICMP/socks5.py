@@ -0,0 +1,95 @@
+"""
+socks5.py
+
+This module implements the server side of the SOCKS5 protocol (RFC 1928) used by the TCPServer of the ProxyClient,
+so every application connection can choose its own destination. Only the CONNECT command without authentication
+is supported.
+
+Main Methods:
+- handshake: Negotiates the method and reads the CONNECT request of a new connection.
+- send_reply: Answers the CONNECT request once the tunnel session is started or failed.
+"""
+import asyncio
+import ipaddress
+import struct
+from TCPOverICMP import exceptions
+
+VERSION = 5
+NO_AUTHENTICATION = 0x00
+NO_ACCEPTABLE_METHODS = 0xFF
+CONNECT = 0x01
+
+#address types
+IPV4 = 0x01
+DOMAIN_NAME = 0x03
+IPV6 = 0x04
+
+#reply codes
+SUCCEEDED = 0x00
+GENERAL_FAILURE = 0x01
+HOST_UNREACHABLE = 0x04
+CONNECTION_REFUSED = 0x05
+COMMAND_NOT_SUPPORTED = 0x07
+ADDRESS_TYPE_NOT_SUPPORTED = 0x08
+
+REQUEST_STRUCT = struct.Struct('>BBBB')  # Version, Command, Reserved, Address type
+PORT_STRUCT = struct.Struct('>H')
+REPLY_STRUCT = struct.Struct('>BBBB4sH')  # Version, Reply, Reserved, Address type, Bound address, Bound port
+
+
+async def read_destination(reader: asyncio.StreamReader, address_type: int):
+    """
+    read the destination address and port of a request
+    returns: the destination host as a string and the port
+    """
+    if address_type == IPV4:
+        host = str(ipaddress.IPv4Address(await reader.readexactly(4)))
+    elif address_type == IPV6:
+        host = str(ipaddress.IPv6Address(await reader.readexactly(16)))
+    elif address_type == DOMAIN_NAME:
+        length = (await reader.readexactly(1))[0]
+        host = (await reader.readexactly(length)).decode('utf-8')
+    else:
+        return None, None
+    port, = PORT_STRUCT.unpack(await reader.readexactly(PORT_STRUCT.size))
+    return host, port
+
+
+async def handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    negotiate with a new SOCKS5 connection and read its CONNECT request.
+    requests that can't be served are answered with an error reply.
+    returns: the destination host and port of the request
+    raises Socks5Error if the connection can't be served
+    """
+    try:
+        version, methods_count = await reader.readexactly(2)
+        methods = await reader.readexactly(methods_count)
+        if version != VERSION:
+            raise exceptions.Socks5Error(f'unsupported version {version}')
+        if NO_AUTHENTICATION not in methods:
+            writer.write(bytes((VERSION, NO_ACCEPTABLE_METHODS)))
+            raise exceptions.Socks5Error('no acceptable authentication method')
+        writer.write(bytes((VERSION, NO_AUTHENTICATION)))
+
+        version, command, _, address_type = REQUEST_STRUCT.unpack(await reader.readexactly(REQUEST_STRUCT.size))
+        host, port = await read_destination(reader, address_type)
+    except (asyncio.IncompleteReadError, ConnectionResetError, UnicodeDecodeError) as e:
+        raise exceptions.Socks5Error(f'invalid request {e!r}')
+
+    if host is None:
+        send_reply(writer, ADDRESS_TYPE_NOT_SUPPORTED)
+        raise exceptions.Socks5Error(f'unsupported address type {address_type}')
+    if command != CONNECT:
+        send_reply(writer, COMMAND_NOT_SUPPORTED)
+        raise exceptions.Socks5Error(f'unsupported command {command}')
+    return host, port
+
+
+def send_reply(writer: asyncio.StreamWriter, reply: int):
+    """
+    answer the CONNECT request of a connection.
+    the bound address is not known on this side of the tunnel, so it is sent empty.
+    @param reply: one of the reply codes
+    """
+    writer.write(REPLY_STRUCT.pack(VERSION, reply, 0, IPV4, bytes(4), 0))
@@ -7,20 +7,34 @@ communication by handling acknowledgments and retransmissions. Both ProxyClient
 this base class and customize it for client-side and server-side operations, respectively.
 
 Key Components:
-- ICMP_PACKET_IDENTIFIER: Used to validate incoming ICMP packets.
+- ICMP_PACKET_IDENTIFIER: Used to validate incoming ICMP packets, the default of the accepted identifiers.
+  every identifier is a separate ICMP flow to middleboxes, replies go on the flow the peer used last.
 - PACKET_SEQUENCE_MARKER: Helps track the sequence of packets.
+- TERMINATE_SEQ: The sequence of TERMINATE packets, so their acks are never taken for the ack of the START.
 - RESPONSE_WAIT_TIME: Defines the time to wait for an acknowledgment.
+- session keys: sessions are identified by (peer ip, session_id), so sessions of different peers never collide.
+- HEARTBEAT_INTERVAL / DEAD_PEER_TIMEOUT: How often the peers known in advance (the proxy servers of a proxy client)
+  are sent a heartbeat, and how long a peer may stay silent before it is declared dead (see `heartbeat`).
 
 Main Methods:
 - run: Starts all tasks related to the tunnel.
 - handle_packets_from_tcp_channel: Sends TCP data as ICMP packets.
-- handle_packets_from_icmp_channel: Processes incoming ICMP packets and executes corresponding actions.
-- send_icmp_packet_wait_ack: Sends an ICMP packet and waits for an acknowledgment.
+- handle_packets_from_icmp_channel: Processes incoming ICMP packets and executes corresponding actions without blocking.
+- send_icmp_packet_wait_ack: Sends an ICMP packet and waits for an acknowledgment, measuring its round trip.
+  DATA_TRANSFER packets are sent within the congestion window of their peer (see `congestion`).
+- send_icmp_packet: Builds an ICMP packet and sends it through the pacer (see `pacing`).
+- choose_identifier: Chooses the ICMP flow a packet to a peer is sent on.
+- ack_data: Delays the ack of received data, so it rides on data going back or is sent with other acks.
+- monitor_peers: Sends the heartbeats, measures the RTT and loss of every peer from their replies,
+  and fails all the sessions of a dead peer at once.
 """
 import asyncio
+import itertools
 import logging
-from TCPOverICMP import client_manager, icmp_socket, icmp_packet
+from TCPOverICMP import client_manager, congestion, icmp_socket, icmp_packet, exceptions, pacing
+from TCPOverICMP.heartbeat import PeerHealth
 from TCPOverICMP.tunnel_packet import ICMPTunnelPacket, Action, Direction
+from TCPOverICMP.log_setup import packet_log
 
 
 log = logging.getLogger(__name__)
@@ -30,37 +44,90 @@ class TCPoverICMPTunnel:
     ICMP_PACKET_IDENTIFIER = 0xbeef
     PACKET_SEQUENCE_MARKER = 0xdead
     RESPONSE_WAIT_TIME = 1.0 #waiting time for ack
+    SEND_ATTEMPTS = 3 #a packet is given up on after SEND_ATTEMPTS * RESPONSE_WAIT_TIME without an ack
+    #data is acked ACK_DELAY after it arrived, or once ACK_EVERY packets of its session wait for an ack,
+    #unless data of the session going back carries the acks first
+    ACK_DELAY = 0.02
+    ACK_EVERY = 4
+    #sequence of the TERMINATE of a session, apart from its START (0) and its data, so their acks never mix up.
+    #the START of a pipelined session may still wait for its ack when the session closes
+    TERMINATE_SEQ = 0xffffffff
+    HEARTBEAT_INTERVAL = 1.0
+    DEAD_PEER_TIMEOUT = 3.0 #a peer nothing arrived from for this long is dead
+    #actions that never wait on a client, executed inline by the ICMP dispatch loop
+    INLINE_ACTIONS = (
+        Action.ACK, Action.REJECT, Action.DATA_TRANSFER, Action.START, Action.HEARTBEAT, Action.HEARTBEAT_REPLY
+    )
 
     def __init__(self,
                  direction: Direction,
-                  remote_endpoint=None):
-        self.remote_endpoint = {"ip": remote_endpoint}
+                  remote_endpoints=None,
+                  identifiers=None,
+                  congestion_control=None,
+                  pacer=None,
+                  heartbeat_interval=None,
+                  dead_peer_timeout=None,
+                  idle_timeout=None,
+                  buffer_budget=None):
+        #the only peers accepted, None to accept every peer
+        self.remote_endpoints = remote_endpoints
+        #the accepted ICMP identifiers, and the one each peer used last
+        self.identifiers = tuple(identifiers) if identifiers else (self.ICMP_PACKET_IDENTIFIER,)
+        self.peer_identifiers = {}
+        #the congestion controller class, and the controller of every peer
+        self.congestion_control = congestion_control if congestion_control is not None else congestion.NewReno
+        self.congestion_controllers = {}
         self.direction = direction 
         self.incoming_from_icmp_channel = asyncio.Queue()
-        self.icmp_socket = icmp_socket.ICMPSocket(self.incoming_from_icmp_channel)
+        self.icmp_socket = self.create_icmp_socket(self.incoming_from_icmp_channel)
+        #every packet is sent through the pacer, which sends right away unless it is given a budget
+        self.pacer = pacer if pacer is not None else pacing.Pacer()
+        self.pacer.bind(self.icmp_socket)
+        self.heartbeat_interval = heartbeat_interval if heartbeat_interval is not None else self.HEARTBEAT_INTERVAL
+        self.dead_peer_timeout = dead_peer_timeout if dead_peer_timeout is not None else self.DEAD_PEER_TIMEOUT
+        self.peers = {} #peer ip: PeerHealth
+        self.dying_peers = set() #peers whose sessions peer_died is removing
 
         self.packets_from_tcp_channel = asyncio.Queue()
-        self.timed_out_tcp_connections = asyncio.Queue()
-        self.client_manager = client_manager.ClientManager(self.timed_out_tcp_connections, self.packets_from_tcp_channel)
+        self.timed_out_tcp_connections = asyncio.Queue() #filled by client_manager.close_client
+        self.client_manager = client_manager.ClientManager(
+            self.timed_out_tcp_connections, self.packets_from_tcp_channel, idle_timeout, buffer_budget
+        )
 
 
         self.main_coroutines = [
             self.handle_packets_from_tcp_channel(),
             self.handle_packets_from_icmp_channel(),
             self.wait_timed_out_connections(),
-            self.icmp_socket.wait_for_incoming_packet(self.remote_endpoint),
+            self.icmp_socket.wait_for_incoming_packet(),
+            self.monitor_peers(),
+            self.client_manager.reap_idle_clients(),
         ]
         #handles packets from ICMP channel
         self.packets_waiting_ack = {}
+        self.rejected_packets = set()
+        self.abandoned_packets = set() #packets to a dead peer, released without an ack
+        #session key: (sequences of received data waiting to be acked, timer sending them)
+        self.pending_acks = {}
         self.operations = {
             Action.TERMINATE: self.terminate_session,
             Action.DATA_TRANSFER: self.handle_data,
             Action.ACK: self.handle_ack,
+            Action.HEARTBEAT: self.handle_heartbeat,
+            Action.HEARTBEAT_REPLY: self.handle_heartbeat_reply,
         }
         if self.direction == Direction.PROXY_CLIENT:
             self.operations[Action.START] = self.start_session
+        else:
+            self.operations[Action.REJECT] = self.handle_reject
         
 
+    def create_icmp_socket(self, packet_queue: asyncio.Queue):
+        """
+        returns the socket the tunnel sends and receives ICMP packets with, a raw ICMP socket.
+        """
+        return icmp_socket.ICMPSocket(packet_queue)
+
     async def run(self):
         """
         runs the classe's coroutines - run all tasks of class
@@ -75,7 +142,7 @@ class TCPoverICMPTunnel:
         await for  the new data packets on the incoming TCP channel queue to send on the ICMP channel.
         """
         while True:
-            data, session_id, seq = await self.packets_from_tcp_channel.get()
+            data, (peer, session_id), seq = await self.packets_from_tcp_channel.get()
 
             new_tunnel_packet = ICMPTunnelPacket(
                 session_id=session_id,
@@ -86,7 +153,16 @@ class TCPoverICMPTunnel:
             )
             # log.debug(f'packet size to session:{session_id} with sequnce {seq} is: {len(data)}')
             #scheduale the packet sending action
-            asyncio.create_task(self.send_icmp_packet_wait_ack(new_tunnel_packet))
+            asyncio.create_task(self.send_data(new_tunnel_packet, peer))
+
+    async def send_data(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        send the data of a session until it is acked, then release its buffer in the client manager.
+        """
+        try:
+            await self.send_icmp_packet_wait_ack(icmp_tunnel_packet, peer)
+        finally:
+            self.client_manager.data_sent((peer, icmp_tunnel_packet.session_id), len(icmp_tunnel_packet.payload))
     
     
     async def handle_packets_from_icmp_channel(self):
@@ -95,22 +171,36 @@ class TCPoverICMPTunnel:
         """
         while True:
             new_icmp_packet = await self.incoming_from_icmp_channel.get()
-            if new_icmp_packet.identifier != self.ICMP_PACKET_IDENTIFIER:
-                log.debug(f'Invalid ICMP project identifiers')
+            if new_icmp_packet.identifier not in self.identifiers:
+                packet_log.debug('Invalid ICMP project identifiers')
+                continue
+            if self.remote_endpoints is not None and new_icmp_packet.source not in self.remote_endpoints:
+                packet_log.debug('ignore packet from unknown peer: %s', new_icmp_packet.source)
                 continue
+            self.peer_identifiers[new_icmp_packet.source] = new_icmp_packet.identifier
 
             icmp_tunnel_packet = ICMPTunnelPacket.deserialize(new_icmp_packet.payload)
 
             
-            log.debug(f'Received: \n{icmp_tunnel_packet}')
+            packet_log.debug('Received: \n%s', icmp_tunnel_packet)
 
             if icmp_tunnel_packet.direction == self.direction:
-                log.debug('ignore packet to same direction')
+                packet_log.debug('ignore packet to same direction')
                 continue
+            #the kernel of a peer echoes requests back even if the tunnel is gone, those are the same direction
+            self.peer_health(new_icmp_packet.source).heard(asyncio.get_event_loop().time())
             # if new_icmp_packet != self.operations_handler.PACKET_SEQUENCE_MARKER:
+            #acks riding on data going the other way
+            if icmp_tunnel_packet.action == Action.DATA_TRANSFER and icmp_tunnel_packet.acks:
+                self.acknowledge(icmp_tunnel_packet, peer=new_icmp_packet.source)
 
-            #execute the packet action 
-            await self.execute_operation(icmp_tunnel_packet=icmp_tunnel_packet) 
+            #execute the packet action, actions that may wait on a client are scheduled so they don't stall the channel
+            if icmp_tunnel_packet.action in self.INLINE_ACTIONS:
+                await self.execute_operation(icmp_tunnel_packet=icmp_tunnel_packet, peer=new_icmp_packet.source)
+            else:
+                asyncio.create_task(
+                    self.execute_operation(icmp_tunnel_packet=icmp_tunnel_packet, peer=new_icmp_packet.source)
+                )
 
     async def wait_timed_out_connections(self):
         """
@@ -118,61 +208,227 @@ class TCPoverICMPTunnel:
         terminate session and delete client 
         """
         while True:
-            session_id = await self.timed_out_tcp_connections.get()
+            session_key = await self.timed_out_tcp_connections.get()
+            peer, session_id = session_key
             new_tunnel_packet = ICMPTunnelPacket(session_id=session_id,
+                                        seq=self.TERMINATE_SEQ,
                                         action=Action.TERMINATE,
                                           direction=self.direction)
             
-            #The subsequent code depends on the successful completion of 
-            await self.send_icmp_packet_wait_ack(new_tunnel_packet)
-            await self.client_manager.remove_client(session_id)
+            #a failed TERMINATE is not retried, the peer drops the session once its own packets fail
+            await self.send_icmp_packet_wait_ack(new_tunnel_packet, peer)
+            #the session may have been removed while its TERMINATE was sent
+            if self.client_manager.client_exists(session_key):
+                await self.client_manager.remove_client(session_key)
+            self.client_manager.client_terminated(session_key)
+
+    def peer_health(self, peer: str):
+        """
+        returns the liveness measurements of a peer.
+        """
+        if peer not in self.peers:
+            self.peers[peer] = PeerHealth(asyncio.get_event_loop().time())
+        return self.peers[peer]
+
+    def peer_is_dead(self, peer: str):
+        return peer in self.peers and self.peers[peer].dead
+
+    def heartbeat_peers(self):
+        """
+        returns the peers sent heartbeats, the proxy servers of a proxy client.
+        the proxy server only answers heartbeats, its peers may not be reachable before they send.
+        """
+        return self.remote_endpoints or ()
+
+    async def monitor_peers(self):
+        """
+        every heartbeat interval, send a heartbeat to the heartbeat peers and declare the peers
+        silent for the dead peer timeout dead. a peer that never sent a heartbeat is only forgotten,
+        its silence may be an idle session.
+        """
+        while True:
+            now = asyncio.get_event_loop().time()
+            for peer in self.heartbeat_peers():
+                self.send_heartbeat(peer)
+            dead_peers = []
+            forgotten_peers = []
+            for peer, health in self.peers.items():
+                for identifier in health.expire_probes(now - self.RESPONSE_WAIT_TIME):
+                    self.on_packet_timed_out(peer, identifier)
+                if health.dead or health.silent_for(now) < self.dead_peer_timeout:
+                    continue
+                if peer in self.heartbeat_peers() or health.heartbeats_received:
+                    dead_peers.append(peer)
+                if peer not in self.heartbeat_peers():
+                    forgotten_peers.append(peer)
+            for peer in dead_peers:
+                self.peers[peer].dead = True
+                #the sessions are flushed in their own task, the heartbeats of the other peers go on meanwhile
+                if peer not in self.dying_peers:
+                    self.dying_peers.add(peer)
+                    asyncio.create_task(self.peer_died(peer))
+            for peer in forgotten_peers:
+                self.peers.pop(peer, None)
+                self.pacer.forget_peer(peer)
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def send_heartbeat(self, peer: str):
+        identifier = self.choose_identifier(peer)
+        seq = self.peer_health(peer).probe_sent(asyncio.get_event_loop().time(), identifier)
+        heartbeat_tunnel_packet = ICMPTunnelPacket(
+            session_id=0,
+            seq=seq,
+            action=Action.HEARTBEAT,
+            direction=self.direction,
+        )
+        self.send_icmp_packet(icmp_packet.ICMPType.EchoRequest, heartbeat_tunnel_packet, peer, identifier)
+
+    async def peer_died(self, peer: str):
+        """
+        fail everything of a peer marked dead in one go: the packets waiting for its acks are released,
+        and all its sessions are removed, without a TERMINATE it would not receive.
+        runs in its own task started by monitor_peers, once at a time for a peer (see dying_peers).
+        """
+        log.warning(
+            f'{peer} was silent for {self.dead_peer_timeout}s, '
+            f'removing its {self.client_manager.peer_session_count(peer)} sessions'
+        )
+        for packet_id, acked in self.packets_waiting_ack.items():
+            if packet_id[0] == peer:
+                self.abandoned_packets.add(packet_id)
+                acked.set()
+        for session_key in [session_key for session_key in self.pending_acks if session_key[0] == peer]:
+            self.take_pending_acks(session_key)
+        #a peer that comes back starts with a new congestion window
+        self.congestion_controllers.pop(peer, None)
+        self.pacer.forget_peer(peer)
+        try:
+            await self.client_manager.remove_peer_clients(peer)
+        finally:
+            self.dying_peers.discard(peer)
     
     #class methods handles ICMP packets
 
-    async def execute_operation(self, icmp_tunnel_packet: ICMPTunnelPacket):
-        """executes the the packets request"""
-        await self.operations[icmp_tunnel_packet.action](icmp_tunnel_packet)
+    async def execute_operation(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """executes the the packets request of a peer"""
+        await self.operations[icmp_tunnel_packet.action](icmp_tunnel_packet, peer)
 
-    async def start_session(self, icmp_tunnel_packet: ICMPTunnelPacket):
+    async def start_session(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
         """implemented by proxy server"""
         return NotImplementedError()
     async def open_tcp_connection(self,destination_host, port, mss=1400):
         """implemented by proxy server"""
         return NotImplementedError()
-    async def terminate_session(self, icmp_tunnel_packet: ICMPTunnelPacket):
+    async def terminate_session(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
         """
         operates the TERMINATE action. removes the client and send ack for terminate.
+        a repeated TERMINATE (its ack was lost) is only acked.
         """
-        await self.client_manager.remove_client(icmp_tunnel_packet.session_id)
-        self.send_ack(icmp_tunnel_packet)
+        session_key = (peer, icmp_tunnel_packet.session_id)
+        if self.client_manager.client_exists(session_key):
+            await self.client_manager.remove_client(session_key)
+        self.send_ack(icmp_tunnel_packet, peer)
     
-    async def handle_data(self, icmp_tunnel_packet: ICMPTunnelPacket):
+    async def handle_data(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
         """
-        operate  data action. fowards to client and sends ack 
+        operate  data action. hands the data to the client's inbox and sends ack.
+        if the inbox is full no ack is sent, so the other endpoint resends the packet later.
         @param icmp_tunnel_packet: used to foward to client the data
+        @param peer: the ip the packet came from
         """
-        await self.client_manager.write_to_client(
-            icmp_tunnel_packet.session_id,
-            icmp_tunnel_packet.seq,
-            icmp_tunnel_packet.payload
-        )
-        self.send_ack(icmp_tunnel_packet)
+        try:
+            queued = self.client_manager.write_to_client(
+                (peer, icmp_tunnel_packet.session_id),
+                icmp_tunnel_packet.seq,
+                icmp_tunnel_packet.payload
+            )
+        except exceptions.WriteNonExistentClient:
+            packet_log.debug('ignore data to removed session: %s', icmp_tunnel_packet.session_id)
+            return
+        if queued:
+            self.ack_data(icmp_tunnel_packet, peer)
 
 
-    async def handle_ack(self, icmp_tunnel_packet: ICMPTunnelPacket):
+    async def handle_ack(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
         """
         operate an ACK action.
-        the packet is recognized by the session_id and the sequence of packet 
+        the packet is recognized by the peer, the session_id and the sequence of packet 
         @param tunnel packet 
         """
-        packet_id = (icmp_tunnel_packet.session_id, icmp_tunnel_packet.seq)
+        self.acknowledge(icmp_tunnel_packet, peer)
+
+    def acknowledge(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        release the packets acked by an ACK, or by the acks carried by a DATA_TRANSFER.
+        """
+        for seq in icmp_tunnel_packet.acked_seqs():
+            packet_id = (peer, icmp_tunnel_packet.session_id, seq)
+            if packet_id in self.packets_waiting_ack:
+                self.packets_waiting_ack[packet_id].set()
+
+    async def handle_heartbeat(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        operate a HEARTBEAT action, answered right away with a HEARTBEAT_REPLY using EchoReply.
+        """
+        self.peer_health(peer).heartbeats_received += 1
+        reply_tunnel_packet = ICMPTunnelPacket(
+            session_id=icmp_tunnel_packet.session_id,
+            seq=icmp_tunnel_packet.seq,
+            action=Action.HEARTBEAT_REPLY,
+            direction=self.direction,
+        )
+        self.send_icmp_packet(icmp_packet.ICMPType.EchoReply, reply_tunnel_packet, peer)
+
+    async def handle_heartbeat_reply(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        operate a HEARTBEAT_REPLY action, measures the round trip of the heartbeat.
+        """
+        answered = self.peer_health(peer).probe_answered(icmp_tunnel_packet.seq, asyncio.get_event_loop().time())
+        if answered is not None:
+            rtt, identifier = answered
+            self.on_packet_acked(peer, identifier, rtt)
+
+    async def handle_reject(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        operate a REJECT action, the other endpoint failed to start the session.
+        releases the START waiting for an ack and marks it as rejected.
+        @param tunnel packet 
+        """
+        packet_id = (peer, icmp_tunnel_packet.session_id, icmp_tunnel_packet.seq)
         if packet_id in self.packets_waiting_ack:
+            self.rejected_packets.add(packet_id)
             self.packets_waiting_ack[packet_id].set()
 
-    def send_ack(self, icmp_tunnel_packet: ICMPTunnelPacket):
+    def choose_identifier(self, destination: str):
+        """
+        returns the ICMP identifier to send the next packet to a peer with, the one the peer used last.
+        """
+        return self.peer_identifiers.get(destination, self.identifiers[0])
+
+    def congestion_controller(self, destination: str):
+        """
+        returns the congestion controller of the DATA_TRANSFER packets sent to a peer.
+        """
+        if destination not in self.congestion_controllers:
+            self.congestion_controllers[destination] = self.congestion_control()
+        return self.congestion_controllers[destination]
+
+    def on_packet_acked(self, destination: str, identifier: int, rtt: float = None):
+        """
+        called when a packet sent with identifier was acked.
+        @param rtt the round trip of the packet, None if the packet was resent
+        """
+
+    def on_packet_timed_out(self, destination: str, identifier: int):
+        """
+        called when a packet sent with identifier was not acked in RESPONSE_WAIT_TIME.
+        """
+
+    def send_ack(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
         """
         Send an ACK for a packet using EchoReply.
         used by proxy-server
+        @param peer the ip the packet came from
         """
         ack_tunnel_packet = ICMPTunnelPacket(
             session_id=icmp_tunnel_packet.session_id,
@@ -182,47 +438,205 @@ class TCPoverICMPTunnel:
         )
         self.send_icmp_packet(
             icmp_packet.ICMPType.EchoReply,
-            ack_tunnel_packet.serialize(),
+            ack_tunnel_packet,
+            peer,
+        )
+
+    def ack_data(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        Ack a DATA_TRANSFER packet. the ack is delayed, so it can ride on the next data of the session
+        going back to the peer, or share an ACK packet with the acks of the next data packets.
+        @param peer the ip the packet came from
+        """
+        session_key = (peer, icmp_tunnel_packet.session_id)
+        if session_key not in self.pending_acks:
+            timer = asyncio.get_event_loop().call_later(self.ACK_DELAY, self.flush_acks, session_key)
+            self.pending_acks[session_key] = ([], timer)
+        seqs, _ = self.pending_acks[session_key]
+        seqs.append(icmp_tunnel_packet.seq)
+        if len(seqs) >= self.ACK_EVERY:
+            self.flush_acks(session_key)
+
+    def take_pending_acks(self, session_key: tuple):
+        """
+        returns the sequences of a session waiting to be acked, the caller sends their acks.
+        """
+        if session_key not in self.pending_acks:
+            return ()
+        seqs, timer = self.pending_acks.pop(session_key)
+        timer.cancel()
+        return seqs
+
+    def flush_acks(self, session_key: tuple):
+        """
+        Send the delayed acks of a session in a single ACK using EchoReply.
+        """
+        seqs = self.take_pending_acks(session_key)
+        if not seqs:
+            return
+        peer, session_id = session_key
+        ack_tunnel_packet = ICMPTunnelPacket(
+            session_id=session_id,
+            seq=seqs[0],
+            action=Action.ACK,
+            direction=self.direction,
+            acks=seqs[1:],
+        )
+        self.send_icmp_packet(
+            icmp_packet.ICMPType.EchoReply,
+            ack_tunnel_packet,
+            peer,
+        )
+
+    def send_reject(self, icmp_tunnel_packet: ICMPTunnelPacket, peer: str):
+        """
+        Send a REJECT for a START packet using EchoReply.
+        used by proxy-server
+        @param peer the ip the packet came from
+        """
+        reject_tunnel_packet = ICMPTunnelPacket(
+            session_id=icmp_tunnel_packet.session_id,
+            seq=icmp_tunnel_packet.seq,
+            action=Action.REJECT,
+            direction=self.direction,
         )
+        self.send_icmp_packet(
+            icmp_packet.ICMPType.EchoReply,
+            reject_tunnel_packet,
+            peer,
+        )
+
     def send_icmp_packet(
             self,
             packet_type: int,
-            payload: bytes
+            icmp_tunnel_packet: ICMPTunnelPacket,
+            destination: str,
+            identifier: int = None
     ):
         """
         Build and send an ICMP packet on the ICMP socket.
         @param packet_type echo reply or request
-        @param payload the icmp_tunnel_packet serlized 
+        @param icmp_tunnel_packet the packet to carry, serialized straight into the ICMP frame
+        @param destination the ip of the peer
+        @param identifier the ICMP identifier, chosen by choose_identifier if not given
+        returns the frame that was sent, so it can be resent without building it again
         """
-        new_icmp_packet = icmp_packet.ICMPPacket(
-            packet_type=packet_type,
-            identifier=self.ICMP_PACKET_IDENTIFIER,
-            sequence_number=self.PACKET_SEQUENCE_MARKER,
-            payload=payload
+        if identifier is None:
+            identifier = self.choose_identifier(destination)
+        frame = icmp_packet.ICMPPacket.frame(
+            packet_type,
+            identifier,
+            self.PACKET_SEQUENCE_MARKER,
+            icmp_tunnel_packet
         )
-        self.icmp_socket.sendto(new_icmp_packet, self.remote_endpoint["ip"])
+        self.pacer.sendto(frame, destination, control=icmp_tunnel_packet.action != Action.DATA_TRANSFER)
+        return frame
 
-    async def send_icmp_packet_wait_ack(self, icmp_tunnel_packet: ICMPTunnelPacket):
+    async def send_icmp_packet_wait_ack(self, icmp_tunnel_packet: ICMPTunnelPacket, destination: str):
             """
             Send an ICMP packet and ensure it is acknowledged. Retry up to 3 times if necessary.
             @param icmp_tunnel_packet the packet sent it the icmp socket
+            @param destination the ip of the peer
+            returns True if acked, False if rejected by the other endpoint,
+            None if it was not acked in time or the peer is dead.
+            DATA_TRANSFER packets wait for room in the congestion window of the peer first.
             """
-            self.packets_waiting_ack[(icmp_tunnel_packet.session_id, icmp_tunnel_packet.seq)] = asyncio.Event()
+            if icmp_tunnel_packet.action != Action.DATA_TRANSFER:
+                return await self.send_until_acked(icmp_tunnel_packet, destination)
+            controller = self.congestion_controller(destination)
+            await controller.acquire()
+            #the acks ride on the data only if it is sent right away, acks held behind a full window or a pacing
+            #queue would stall the window of the peer
+            if not self.pacer.backlogged():
+                icmp_tunnel_packet.acks = self.take_pending_acks((destination, icmp_tunnel_packet.session_id))
+            try:
+                return await self.send_until_acked(icmp_tunnel_packet, destination, controller)
+            finally:
+                controller.release()
 
-            for _ in range(3):
-                self.send_icmp_packet(
-                    icmp_packet.ICMPType.EchoRequest,
-                    icmp_tunnel_packet.serialize(),
-                )
+    async def send_until_acked(
+            self,
+            icmp_tunnel_packet: ICMPTunnelPacket,
+            destination: str,
+            controller: congestion.CongestionController = None
+    ):
+            """
+            Send an ICMP packet, resending it until it is acked, for up to SEND_ATTEMPTS * RESPONSE_WAIT_TIME.
+            @param controller the congestion controller told about the ack or the losses of the packet,
+            and the retransmit timeout of the packet. RESPONSE_WAIT_TIME without a controller (SEND_ATTEMPTS sends).
+            """
+            #checked after the congestion window, the peer may die while the packet waits for room
+            if self.peer_is_dead(destination):
+                return None
+            packet_id = (destination, icmp_tunnel_packet.session_id, icmp_tunnel_packet.seq)
+            if packet_id in self.packets_waiting_ack:
+                #the ack would release the packet already waiting, not this one
+                log.warning(f'packet {packet_id} already waits for an ack, not sending:\n{icmp_tunnel_packet}')
+                return None
+            self.packets_waiting_ack[packet_id] = asyncio.Event()
+
+            frame = None
+            give_up_at = asyncio.get_event_loop().time() + self.SEND_ATTEMPTS * self.RESPONSE_WAIT_TIME
+            for attempt in itertools.count():
+                if attempt and asyncio.get_event_loop().time() >= give_up_at:
+                    break
+                identifier = self.choose_identifier(destination)
+                sent_at = asyncio.get_event_loop().time()
+                if frame is None:
+                    frame = self.send_icmp_packet(
+                        icmp_packet.ICMPType.EchoRequest,
+                        icmp_tunnel_packet,
+                        destination,
+                        identifier,
+                    )
+                elif not self.pacer.is_queued(frame):
+                    #resend the frame built on the first attempt, on the flow chosen now
+                    icmp_packet.ICMPPacket.set_identifier(frame, identifier)
+                    self.pacer.sendto(frame, destination, control=icmp_tunnel_packet.action != Action.DATA_TRANSFER)
+                if controller is not None:
+                    timeout = controller.retransmit_timeout(attempt, self.RESPONSE_WAIT_TIME, self.ACK_DELAY)
+                else:
+                    timeout = self.RESPONSE_WAIT_TIME
+                timeout = min(timeout, give_up_at - sent_at)
                 try:
                     await asyncio.wait_for(
-                        self.packets_waiting_ack[(icmp_tunnel_packet.session_id, icmp_tunnel_packet.seq)].wait(),
-                        self.RESPONSE_WAIT_TIME
+                        self.packets_waiting_ack[packet_id].wait(),
+                        timeout
                     )
-                    self.packets_waiting_ack.pop((icmp_tunnel_packet.session_id, icmp_tunnel_packet.seq))
+                    if packet_id in self.abandoned_packets:
+                        #the peer died while the packet waited
+                        self.abandoned_packets.remove(packet_id)
+                        self.packets_waiting_ack.pop(packet_id)
+                        return None
+                    #the round trip of a resent packet is ambiguous
+                    rtt = asyncio.get_event_loop().time() - sent_at if attempt == 0 else None
+                    self.on_packet_acked(destination, identifier, rtt)
+                    if controller is not None:
+                        controller.on_ack(rtt)
+                        if controller.delivery_rate() is not None:
+                            self.pacer.set_peer_rate(destination, controller.delivery_rate())
+                    self.packets_waiting_ack.pop(packet_id)
+                    if packet_id in self.rejected_packets:
+                        self.rejected_packets.remove(packet_id)
+                        return False
                     return True
                 except asyncio.TimeoutError:
-                    log.debug(f'failed recive or send ,resending:\n{icmp_tunnel_packet}')
+                    if self.pacer.is_queued(frame):
+                        #it was not sent yet, so it was not lost
+                        continue
+                    self.on_packet_timed_out(destination, identifier)
+                    if controller is not None:
+                        controller.on_loss(sent_at)
+                    packet_log.debug('failed recive or send ,resending:\n%s', icmp_tunnel_packet)
                 # await asyncio.sleep(1)
-            log.info(f'packet failed to send:\n{icmp_tunnel_packet}\nRemoving client.')
-            await self.timed_out_tcp_connections.put(icmp_tunnel_packet.session_id)
+            log.info('packet failed to send:\n%s\nRemoving client.', icmp_tunnel_packet)
+            self.packets_waiting_ack.pop(packet_id)
+            session_key = (destination, icmp_tunnel_packet.session_id)
+            #only failed data terminates its session: a failed START is handled by its caller, a failed TERMINATE
+            #is not retried, and the sessions of a dead peer are removed together
+            if (
+                icmp_tunnel_packet.action == Action.DATA_TRANSFER
+                and not self.peer_is_dead(destination)
+                and self.client_manager.client_exists(session_key)
+            ):
+                self.client_manager.close_client(session_key)
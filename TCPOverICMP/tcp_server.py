@@ -5,41 +5,97 @@ This module implements the TCPServer class, responsible for handling incoming TC
 It is used by the ProxyClient to listen for local TCP connections and forward them over ICMP.
 
 Key Components:
-- `TCPServer`: Creates a TCP server that listens for incoming connections and passes them to the ProxyClient.
+- `NewConnection`: An accepted connection and the destination it is forwarded to.
+- `TCPServer`: Creates TCP servers that listen for incoming connections and passes them to the ProxyClient.
+  Every forwarded port has a fixed destination, and connections to the SOCKS5 port choose their own.
 - `server_loop`: Asynchronous loop to handle incoming connections indefinitely.
 - `operate_new_tcp_connection`: Processes each new TCP connection and queues it for further handling.
+- `operate_new_socks_connection`: Reads the destination of each new SOCKS5 connection and queues it.
 
 The ProxyClient uses this server to accept connections from applications that need to tunnel TCP traffic over ICMP.
 """
 import asyncio
+import functools
 import itertools
 import socket
 import logging
+from TCPOverICMP import exceptions, socks5
 
 
 log = logging.getLogger(__name__)
 
+
+class NewConnection:
+    def __init__(self,
+                 session_id: int,
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter,
+                 destination_host: str,
+                 destination_port: int,
+                 socks: bool = False):
+        self.session_id = session_id
+        self.reader = reader
+        self.writer = writer
+        self.destination_host = destination_host
+        self.destination_port = destination_port
+        self.socks = socks #waits for a SOCKS5 reply before sending data
+
+
 class TCPServer:
     """
     handles tcp connections
     """
-    def __init__(self, host: str, port: int, incoming_tcp_connections: asyncio.Queue):
+    def __init__(self, host: str, forwards: dict, incoming_tcp_connections: asyncio.Queue, socks_port: int = None):
+        """
+        @param host: the address to listen on
+        @param forwards: listening port: (destination host, destination port)
+        @param socks_port: port to listen for SOCKS5 connections on, None to disable SOCKS5
+        """
         self.host = host
-        self.port = port
+        self.forwards = forwards
+        self.socks_port = socks_port
         self.incoming_tcp_connections = incoming_tcp_connections
         self.new_session_id = itertools.count()
 
     async def server_loop(self):
-        server = await asyncio.start_server(
-            self.operate_new_tcp_connection,
-            host=self.host,
-            port=self.port,
-            family=socket.AF_INET
-        )
-        log.info(f'listening on {self.host}:{self.port}')
-        await server.serve_forever()
-    async def operate_new_tcp_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        servers = []
+        for port, (destination_host, destination_port) in self.forwards.items():
+            servers.append(await asyncio.start_server(
+                functools.partial(self.operate_new_tcp_connection, destination_host, destination_port),
+                host=self.host,
+                port=port,
+                family=socket.AF_INET
+            ))
+            log.info(f'listening on {self.host}:{port}, forwarding to {destination_host}:{destination_port}')
+        if self.socks_port is not None:
+            servers.append(await asyncio.start_server(
+                self.operate_new_socks_connection,
+                host=self.host,
+                port=self.socks_port,
+                family=socket.AF_INET
+            ))
+            log.info(f'listening for SOCKS5 on {self.host}:{self.socks_port}')
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    async def operate_new_tcp_connection(self, destination_host: str, destination_port: int,
+                                         reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """
         operates new tcp connectio from app for example from browser or wget request...
         """
-        await self.incoming_tcp_connections.put((next(self.new_session_id), reader, writer))
+        await self.incoming_tcp_connections.put(
+            NewConnection(next(self.new_session_id), reader, writer, destination_host, destination_port)
+        )
+
+    async def operate_new_socks_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        operates new SOCKS5 connection from app, the destination is read from its CONNECT request.
+        """
+        try:
+            destination_host, destination_port = await socks5.handshake(reader, writer)
+        except exceptions.Socks5Error as e:
+            log.debug(f'closing SOCKS5 connection: {e}')
+            writer.close()
+            return
+        await self.incoming_tcp_connections.put(
+            NewConnection(next(self.new_session_id), reader, writer, destination_host, destination_port, socks=True)
+        )
@@ -5,7 +5,7 @@ This file defines the ICMPTunnelPacket class, which is responsible for handling
 and deserialization of tunnel packets sent over ICMP. It includes enums for Action and Direction to specify 
 the type of operation and communication direction.
 
-- Action: Enum representing operations like START, TERMINATE, DATA_TRANSFER, and ACK.
+- Action: Enum representing operations like START, TERMINATE, DATA_TRANSFER, ACK, REJECT and HEARTBEAT.
 - Direction: Enum indicating whether the packet is for the PROXY_SERVER or PROXY_CLIENT.
 
 The ICMPTunnelPacket class uses struct to pack and unpack packet fields, including:
@@ -16,9 +16,12 @@ The ICMPTunnelPacket class uses struct to pack and unpack packet fields, includi
 - destination_host: Optional destination host.
 - port: Optional destination port.
 - payload: Optional payload data.
+- acks: Optional sequence numbers acknowledged by DATA_TRANSFER and ACK packets, so ACKs can ride on data
+  going the other way and several ACKs can share a packet.
 
 Key Methods:
 - serialize(): Converts the packet into bytes for transmission.
+- pack_into(): Serializes the packet into a preallocated buffer, used to build ICMP frames in one pass.
 - deserialize(): Reconstructs a packet object from a byte stream.
 - __repr__(): Provides a formatted string representation for easy debugging.
 """
@@ -33,6 +36,9 @@ class Action(Enum):
     TERMINATE = 1
     DATA_TRANSFER = 2
     ACK = 3
+    REJECT = 4 #negative reply to START
+    HEARTBEAT = 5 #liveness probe of a peer, carries no session
+    HEARTBEAT_REPLY = 6
 
 
 class Direction(Enum):
@@ -48,9 +54,13 @@ class ICMPTunnelPacket:
     Handles optional fields gracefully.
     """
     TUNNEL_STRUCT = struct.Struct('>IIIHHI')  # client_id, seq, action, direction, port,destination_host
+    ACK_SIZE = 4  # every acknowledged sequence number is packed as '>I'
+    #actions that carry no port, their port field holds the number of acknowledged sequences
+    #which follow the destination host
+    ACK_CARRYING_ACTIONS = (Action.DATA_TRANSFER, Action.ACK)
 
 
-    def __init__(self, session_id, action, direction, seq=0, destination_host='', port=0, payload=b''):
+    def __init__(self, session_id, action, direction, seq=0, destination_host='', port=0, payload=b'', acks=()):
         """
         Initialize a ICMPTunnelPacket.
         @param session_id: Mandatory. ID of the session.
@@ -60,6 +70,7 @@ class ICMPTunnelPacket:
         @param destination_host: Optional. Destination host as a string.
         @param port: Optional. Destination port as an integer.
         @param payload: Optional. Payload as bytes.
+        @param acks: Optional. Sequence numbers of the session acknowledged by a DATA_TRANSFER or ACK packet.
         """
         self.session_id = session_id
         self.action = action  
@@ -68,6 +79,19 @@ class ICMPTunnelPacket:
         self.destination_host = destination_host 
         self.port = port  
         self.payload = payload  
+        self.acks = tuple(acks)
+
+    def acked_seqs(self):
+        """
+        the sequence numbers of the session this packet acknowledges.
+        an ACK acknowledges its own sequence number as well as its acks.
+        """
+        if self.action == Action.ACK:
+            return (self.seq,) + self.acks
+        return self.acks
+
+    def port_field(self):
+        return len(self.acks) if self.action in self.ACK_CARRYING_ACTIONS else self.port
 
     def serialize(self):
         """
@@ -81,9 +105,49 @@ class ICMPTunnelPacket:
             ip_length,
             self.action.value,
             self.direction.value,
-            self.port
+            self.port_field()
+        )
+        acks = struct.pack(f'>{len(self.acks)}I', *self.acks)
+        return header + ip_bytes + acks + self.payload
+
+    def serialized_size(self):
+        """
+        the size of the serialized packet in bytes.
+        """
+        return (
+            self.TUNNEL_STRUCT.size
+            + len(self.destination_host.encode('utf-8'))
+            + len(self.acks) * self.ACK_SIZE
+            + len(self.payload)
         )
-        return header + ip_bytes + self.payload
+
+    def pack_into(self, buffer, offset: int = 0):
+        """
+        Serialize the TunnelPacket into a preallocated buffer, the payload is copied once straight into it.
+        @param buffer: a writable buffer of at least offset + serialized_size() bytes
+        @param offset: where in the buffer the packet starts
+        returns: the offset right after the packet
+        """
+        ip_bytes = self.destination_host.encode('utf-8')
+        self.TUNNEL_STRUCT.pack_into(
+            buffer,
+            offset,
+            self.session_id,
+            self.seq,
+            len(ip_bytes),
+            self.action.value,
+            self.direction.value,
+            self.port_field()
+        )
+        offset += self.TUNNEL_STRUCT.size
+        #assigning bytes to a bytearray slice copies them twice, a memoryview copies them once
+        with memoryview(buffer) as view:
+            view[offset:offset + len(ip_bytes)] = ip_bytes
+            offset += len(ip_bytes)
+            struct.pack_into(f'>{len(self.acks)}I', view, offset, *self.acks)
+            offset += len(self.acks) * self.ACK_SIZE
+            view[offset:offset + len(self.payload)] = self.payload
+        return offset + len(self.payload)
     
     @classmethod
     def deserialize(cls, packet):
@@ -98,10 +162,17 @@ class ICMPTunnelPacket:
 
         ip_bytes = packet[header_size:header_size + ip_length]
         destination_host = ip_bytes.decode('utf-8')
+        offset = header_size + ip_length
 
-        payload = packet[header_size + ip_length:]  # Remaining bytes are the payload
+        acks = ()
+        if action in cls.ACK_CARRYING_ACTIONS:
+            acks = struct.unpack_from(f'>{port}I', packet, offset)
+            offset += port * cls.ACK_SIZE
+            port = 0
 
-        return cls(session_id, action, direction, seq, destination_host, port, payload)
+        payload = packet[offset:]  # Remaining bytes are the payload
+
+        return cls(session_id, action, direction, seq, destination_host, port, payload, acks)
     
 
     def __repr__(self):
@@ -113,6 +184,9 @@ class ICMPTunnelPacket:
         f"    direction={self.direction.name},\n"
      )
 
+     if self.acks:
+        base_repr += f"    acks={self.acks},\n"
+
      if self.action == Action.DATA_TRANSFER:
         return (
             base_repr +
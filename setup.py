@@ -9,6 +9,7 @@ setup(
     license='',
     description='A Tunnel Implementation for TCP over ICMP',
     packages=['TCPOverICMP'],
+    package_data={'TCPOverICMP': ['benchmark_baseline.json']},
     entry_points={
         'console_scripts': [
             'proxy_client = TCPOverICMP.proxy_client_main:run_async_loop',
@@ -0,0 +1,157 @@
+# python -m unittest test_client_manager.py
+import asyncio
+import unittest
+from TCPOverICMP.client_manager import ClientManager
+
+
+SLOW = ('10.0.0.1', 0)
+FAST = ('10.0.0.2', 0)
+
+
+class FakeReader:
+    async def read(self, n):
+        await asyncio.Event().wait()
+
+
+class FakeWriter:
+    def __init__(self, blocked=False, reset=False):
+        self.reset = reset
+        self.written = []
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+        self.closing = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        if self.reset:
+            raise ConnectionResetError()
+        await self.unblocked.wait()
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+    async def wait_closed(self):
+        pass
+
+
+#test per session inboxes
+class TestClientManager(unittest.IsolatedAsyncioTestCase):
+
+    async def test_slow_client_does_not_block_others(self):
+        manager = ClientManager(asyncio.Queue(), asyncio.Queue())
+        slow_writer, fast_writer = FakeWriter(blocked=True), FakeWriter()
+        manager.add_client(SLOW, FakeReader(), slow_writer)
+        manager.add_client(FAST, FakeReader(), fast_writer)
+
+        for seq in range(1, 4):
+            self.assertTrue(manager.write_to_client(SLOW, seq, b'slow'))
+            self.assertTrue(manager.write_to_client(FAST, seq, b'fast'))
+        await asyncio.sleep(0)
+
+        self.assertEqual(fast_writer.written, [b'fast'] * 3)
+        self.assertEqual(slow_writer.written, [b'slow'])
+
+        slow_writer.unblocked.set()
+        await manager.remove_client(SLOW)
+        await manager.remove_client(FAST)
+        self.assertEqual(slow_writer.written, [b'slow'] * 3)
+
+    async def test_full_inbox_refuses_data(self):
+        manager = ClientManager(asyncio.Queue(), asyncio.Queue())
+        manager.add_client(SLOW, FakeReader(), FakeWriter(blocked=True))
+        await asyncio.sleep(0)
+
+        results = [manager.write_to_client(SLOW, seq, b'x') for seq in range(1, ClientManager.INBOX_SIZE + 2)]
+        self.assertTrue(all(results[:-1]))
+        self.assertFalse(results[-1])
+
+    async def test_repeated_packets_are_not_written(self):
+        manager = ClientManager(asyncio.Queue(), asyncio.Queue())
+        writer = FakeWriter()
+        manager.add_client(SLOW, FakeReader(), writer)
+        await asyncio.sleep(0)
+
+        for seq, data in ((2, b'second'), (1, b'first'), (1, b'first'), (2, b'second')):
+            self.assertTrue(manager.write_to_client(SLOW, seq, data))
+        await manager.remove_client(SLOW)
+        self.assertEqual(writer.written, [b'first', b'second'])
+        self.assertEqual(manager.clients, {})
+        self.assertEqual(manager.buffered_bytes, 0)
+
+    async def test_reset_client_is_terminated(self):
+        timed_out_connections = asyncio.Queue()
+        manager = ClientManager(timed_out_connections, asyncio.Queue())
+        manager.add_client(SLOW, FakeReader(), FakeWriter(reset=True))
+        await asyncio.sleep(0)
+        manager.write_to_client(SLOW, 1, b'x')
+        await asyncio.sleep(0.01)
+        self.assertEqual(timed_out_connections.get_nowait(), SLOW)
+        #the removal doesn't raise the error of the writer
+        await manager.remove_client(SLOW)
+        self.assertFalse(manager.client_exists(SLOW))
+
+
+#test the bytes buffered by the sessions and the idle timeout
+class TestClientBuffers(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reading_pauses_until_data_is_acked(self):
+        tcp_input_packets = asyncio.Queue()
+        manager = ClientManager(asyncio.Queue(), tcp_input_packets)
+        manager.SEND_BUFFER = 10 * 1400
+        reader = asyncio.StreamReader()
+        reader.feed_data(bytes(100 * 1400))
+        manager.add_client(SLOW, reader, FakeWriter())
+        await asyncio.sleep(0.01)
+        self.assertEqual(tcp_input_packets.qsize(), 10)
+        self.assertEqual(manager.buffered_bytes, 10 * 1400)
+
+        manager.data_sent(SLOW, 4 * 1400)
+        await asyncio.sleep(0.01)
+        self.assertEqual(tcp_input_packets.qsize(), 14)
+        self.assertEqual(manager.buffered_bytes, 10 * 1400)
+        await manager.remove_client(SLOW)
+        self.assertEqual(manager.buffered_bytes, 0)
+
+    async def test_largest_client_is_shed_over_budget(self):
+        timed_out_connections = asyncio.Queue()
+        manager = ClientManager(timed_out_connections, asyncio.Queue(), buffer_budget=10_000)
+        manager.add_client(SLOW, FakeReader(), FakeWriter(blocked=True))
+        manager.add_client(FAST, FakeReader(), FakeWriter(blocked=True))
+        for seq in range(1, 5):
+            manager.write_to_client(SLOW, seq, bytes(2000))
+        manager.write_to_client(FAST, 1, bytes(2000))
+        #a full budget refuses new sessions, the open ones are shed only past it
+        self.assertTrue(manager.over_budget())
+        self.assertTrue(timed_out_connections.empty())
+
+        self.assertTrue(manager.write_to_client(FAST, 2, bytes(1000)))
+        self.assertFalse(manager.write_to_client(SLOW, 5, bytes(2000)))
+        await asyncio.sleep(0.01)
+        self.assertEqual(timed_out_connections.get_nowait(), SLOW)
+        self.assertFalse(manager.client_exists(SLOW))
+        self.assertEqual(manager.buffered_bytes, 3000)
+        self.assertFalse(manager.over_budget())
+
+    async def test_idle_clients_are_terminated(self):
+        timed_out_connections = asyncio.Queue()
+        manager = ClientManager(timed_out_connections, asyncio.Queue(), idle_timeout=0.2)
+        manager.add_client(SLOW, FakeReader(), FakeWriter())
+        manager.add_client(FAST, FakeReader(), FakeWriter())
+        reaper = asyncio.create_task(manager.reap_idle_clients())
+        for seq in range(1, 6):
+            await asyncio.sleep(0.05)
+            manager.write_to_client(FAST, seq, b'x')
+        self.assertEqual(timed_out_connections.get_nowait(), SLOW)
+        self.assertTrue(timed_out_connections.empty())
+        self.assertFalse(manager.write_to_client(SLOW, 1, b'x'))
+        reaper.cancel()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+# python -m unittest test_congestion.py
+import asyncio
+import unittest
+from TCPOverICMP.congestion import NewReno, DelayBased
+from TCPOverICMP.simulator import Simulation, LinkModel
+
+
+#test the congestion controllers
+class TestCongestionControl(unittest.IsolatedAsyncioTestCase):
+
+    async def test_window_bounds_packets_in_flight(self):
+        controller = NewReno()
+        controller.set_window(2)
+        await controller.acquire()
+        await controller.acquire()
+        third = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(third.done())
+
+        controller.release()
+        await asyncio.wait_for(third, 1)
+        self.assertEqual(controller.in_flight, 2)
+
+    async def test_cancelled_waiter_gives_its_room_back(self):
+        controller = NewReno()
+        controller.set_window(2)
+        await controller.acquire()
+        await controller.acquire()
+        cancelled = asyncio.create_task(controller.acquire())
+        waiting = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        controller.release()
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(controller.in_flight, 2)
+
+    async def test_newreno_halves_once_per_window_of_losses(self):
+        controller = NewReno()
+        for _ in range(10):
+            controller.on_ack(0.1)
+        self.assertEqual(controller.window, 20)
+
+        sent_at = asyncio.get_event_loop().time()
+        await asyncio.sleep(0.01)
+        controller.on_loss(sent_at)
+        controller.on_loss(sent_at)
+        self.assertEqual(controller.window, 10)
+
+        controller.on_ack(0.1)
+        self.assertAlmostEqual(controller.window, 10.1)
+
+    async def test_delay_based_stops_growing_as_the_rtt_rises(self):
+        controller = DelayBased()
+        for _ in range(100):
+            controller.on_ack(0.1)
+        grown = controller.window
+        self.assertGreater(grown, DelayBased.INITIAL_WINDOW)
+
+        for _ in range(1000):
+            controller.on_ack(0.3)
+        self.assertFalse(controller.slow_start)
+        self.assertLess(controller.window, grown)
+
+    async def test_retransmit_timeout_follows_the_rtt(self):
+        controller = NewReno()
+        self.assertEqual(controller.retransmit_timeout(0, 1.0), 1.0)
+        for _ in range(20):
+            controller.on_ack(0.3)
+        self.assertLess(controller.retransmit_timeout(0, 1.0), 0.5)
+        self.assertEqual(controller.retransmit_timeout(3, 1.0), 1.0)
+
+    async def test_retransmit_timeout_covers_delayed_acks(self):
+        controller = NewReno()
+        for _ in range(20):
+            controller.on_ack(0.3)
+        self.assertGreater(controller.retransmit_timeout(0, 1.0, ack_delay=0.02), 0.32)
+
+
+#test a transfer over a congested link
+class TestCongestedLink(unittest.TestCase):
+
+    def test_transfer_completes_over_a_small_queue(self):
+        for congestion_control in (NewReno, DelayBased):
+            result = Simulation(0, LinkModel(queue_size=16 * 1024), congestion_control=congestion_control).run(
+                500_000, sessions=2
+            )
+            self.assertEqual(result.delivered, 1_000_000)
+            self.assertLess(result.retransmits, result.data_packets / 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+# python -m unittest test_connection_pool.py
+import asyncio
+import unittest
+from TCPOverICMP.connection_pool import ConnectionPool
+
+
+#test warm connection pool
+class TestConnectionPool(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.accepted = []
+        self.server = await asyncio.start_server(
+            lambda reader, writer: self.accepted.append(writer), host='127.0.0.1', port=0
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        for writer in self.accepted:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_acquire_claims_open_connection(self):
+        pool = ConnectionPool([('127.0.0.1', self.port)], size=2)
+        await pool.fill()
+
+        self.assertIsNotNone(pool.acquire('127.0.0.1', self.port))
+        self.assertEqual(len(pool.connections[('127.0.0.1', self.port)]), 1)
+        self.assertIsNone(pool.acquire('127.0.0.2', self.port))
+        pool.close()
+
+    async def test_closed_and_expired_connections_are_evicted(self):
+        pool = ConnectionPool([('127.0.0.1', self.port)], size=2, idle_ttl=60.0)
+        await pool.fill()
+        await asyncio.sleep(0.05)
+
+        self.accepted[0].close()
+        await asyncio.sleep(0.05)
+        pool.evict()
+        self.assertEqual(len(pool.connections[('127.0.0.1', self.port)]), 1)
+
+        pool.idle_ttl = 0
+        pool.evict()
+        self.assertIsNone(pool.acquire('127.0.0.1', self.port))
+
+
+if __name__ == "__main__":
+    unittest.main()
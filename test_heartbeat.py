@@ -0,0 +1,177 @@
+# python -m unittest test_heartbeat.py
+import asyncio
+import unittest
+from TCPOverICMP.heartbeat import PeerHealth
+from TCPOverICMP.simulator import Simulation, SimulatedTunnel, SinkWriter, VirtualClockEventLoop, LinkModel
+from TCPOverICMP.tunnel_packet import Action, Direction
+
+
+#test the liveness measurements of a peer
+class TestPeerHealth(unittest.TestCase):
+
+    def test_rtt_and_loss(self):
+        health = PeerHealth(0.0)
+        seq = health.probe_sent(0.0, 0xbeef)
+        self.assertEqual(health.probe_answered(seq, 0.1), (0.1, 0xbeef))
+        self.assertIsNone(health.probe_answered(seq, 0.2))
+        self.assertAlmostEqual(health.srtt, 0.1)
+
+        lost = health.probe_sent(1.0, 0xbeee)
+        self.assertEqual(health.expire_probes(0.5), [])
+        self.assertEqual(health.expire_probes(1.5), [0xbeee])
+        self.assertIsNone(health.probe_answered(lost, 1.6))
+        self.assertAlmostEqual(health.loss, PeerHealth.ALPHA)
+
+    def test_silence(self):
+        health = PeerHealth(0.0)
+        health.dead = True
+        health.heard(2.0)
+        self.assertFalse(health.dead)
+        self.assertEqual(health.silent_for(5.0), 3.0)
+
+
+#test dead peer detection between simulated endpoints
+class TestDeadPeer(unittest.TestCase):
+
+    def run_simulated(self, scenario):
+        loop = VirtualClockEventLoop()
+        try:
+            return loop.run_until_complete(scenario())
+        finally:
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+    def start(self, simulation):
+        client = SimulatedTunnel(
+            simulation, Simulation.CLIENT_ADDRESS, Direction.PROXY_SERVER, (Simulation.SERVER_ADDRESS,)
+        )
+        server = SimulatedTunnel(simulation, Simulation.SERVER_ADDRESS, Direction.PROXY_CLIENT)
+        simulation.sockets = {
+            Simulation.CLIENT_ADDRESS: client.icmp_socket,
+            Simulation.SERVER_ADDRESS: server.icmp_socket,
+        }
+        self.client_readers = [asyncio.StreamReader() for _ in range(3)]
+        for session_id in range(3):
+            client.client_manager.add_client(
+                (Simulation.SERVER_ADDRESS, session_id), self.client_readers[session_id], SinkWriter(lambda size: None)
+            )
+            server.client_manager.add_client(
+                (Simulation.CLIENT_ADDRESS, session_id), asyncio.StreamReader(), SinkWriter(lambda size: None)
+            )
+        return client, server, asyncio.create_task(client.run()), asyncio.create_task(server.run())
+
+    def test_idle_peers_measure_rtt(self):
+        async def scenario():
+            client, server, _, _ = self.start(Simulation(0, LinkModel(delay=0.05)))
+            await asyncio.sleep(10)
+            return client, server
+
+        client, server = self.run_simulated(scenario)
+        health = client.peers[Simulation.SERVER_ADDRESS]
+        self.assertAlmostEqual(health.srtt, 0.1, delta=0.01)
+        self.assertEqual(health.loss, 0.0)
+        self.assertFalse(health.dead)
+        self.assertEqual(server.peers[Simulation.CLIENT_ADDRESS].heartbeats_received, 10)
+        self.assertEqual(client.client_manager.peer_session_count(Simulation.SERVER_ADDRESS), 3)
+        self.assertEqual(server.client_manager.peer_session_count(Simulation.CLIENT_ADDRESS), 3)
+
+    def test_dead_server_fails_all_sessions(self):
+        async def scenario():
+            client, server, _, server_task = self.start(Simulation(0))
+            await asyncio.sleep(2)
+            server_task.cancel()
+            stopped_at = asyncio.get_event_loop().time()
+            #data in flight when the server is gone
+            for reader in self.client_readers:
+                reader.feed_data(bytes(20_000))
+            await asyncio.sleep(0.5)
+            self.assertTrue(client.packets_waiting_ack)
+            while client.client_manager.peer_session_count(Simulation.SERVER_ADDRESS):
+                await asyncio.sleep(0.1)
+            return client, asyncio.get_event_loop().time() - stopped_at
+
+        client, detected_after = self.run_simulated(scenario)
+        self.assertLessEqual(detected_after, client.dead_peer_timeout + client.heartbeat_interval + 0.1)
+        self.assertTrue(client.peer_is_dead(Simulation.SERVER_ADDRESS))
+        #the sessions were failed together, none timed out on its own
+        self.assertEqual(client.packets_waiting_ack, {})
+        self.assertEqual(client.client_manager.timed_out_sessions, set())
+        self.assertTrue(client.timed_out_tcp_connections.empty())
+
+    def test_dead_client_fails_all_sessions(self):
+        async def scenario():
+            client, server, client_task, _ = self.start(Simulation(0))
+            await asyncio.sleep(2)
+            client_task.cancel()
+            await asyncio.sleep(server.dead_peer_timeout + server.heartbeat_interval + 0.1)
+            return server
+
+        server = self.run_simulated(scenario)
+        self.assertEqual(server.client_manager.peer_session_count(Simulation.CLIENT_ADDRESS), 0)
+        self.assertNotIn(Simulation.CLIENT_ADDRESS, server.peers)
+
+    def test_slow_removal_does_not_hold_up_the_heartbeats(self):
+        async def scenario():
+            client, server, _, server_task = self.start(Simulation(0))
+            removals = []
+
+            async def slow_remove_peer_clients(peer):
+                removals.append(peer)
+                await asyncio.sleep(30)
+            client.client_manager.remove_peer_clients = slow_remove_peer_clients
+            heartbeats = []
+            send_heartbeat = client.send_heartbeat
+
+            def record_heartbeat(peer):
+                heartbeats.append(asyncio.get_event_loop().time())
+                send_heartbeat(peer)
+            client.send_heartbeat = record_heartbeat
+
+            await asyncio.sleep(2)
+            server_task.cancel()
+            while not client.peer_is_dead(Simulation.SERVER_ADDRESS):
+                await asyncio.sleep(0.1)
+            died_at = asyncio.get_event_loop().time()
+            #the peer comes back and dies again while its sessions are still being removed
+            client.peers[Simulation.SERVER_ADDRESS].heard(died_at)
+            await asyncio.sleep(10)
+            dying_peers = set(client.dying_peers)
+            return client, removals, dying_peers, [sent_at for sent_at in heartbeats if sent_at > died_at]
+
+        client, removals, dying_peers, heartbeats = self.run_simulated(scenario)
+        self.assertEqual(len(heartbeats), 10)
+        self.assertTrue(client.peer_is_dead(Simulation.SERVER_ADDRESS))
+        self.assertEqual(removals, [Simulation.SERVER_ADDRESS])
+        self.assertEqual(dying_peers, {Simulation.SERVER_ADDRESS})
+
+    def test_terminate_to_a_vanished_client_is_sent_once(self):
+        async def scenario():
+            client, server, client_task, _ = self.start(Simulation(0))
+            await asyncio.sleep(2)
+            client_task.cancel()
+            terminated = []
+            send_icmp_packet_wait_ack = server.send_icmp_packet_wait_ack
+
+            async def record_terminate(icmp_tunnel_packet, destination):
+                if icmp_tunnel_packet.action == Action.TERMINATE:
+                    terminated.append(icmp_tunnel_packet.session_id)
+                return await send_icmp_packet_wait_ack(icmp_tunnel_packet, destination)
+            server.send_icmp_packet_wait_ack = record_terminate
+            #the destination closed the session right as the client went away
+            server.client_manager.close_client((Simulation.CLIENT_ADDRESS, 1))
+            server.client_manager.close_client((Simulation.CLIENT_ADDRESS, 1))
+            await asyncio.sleep(60)
+            return server, terminated
+
+        server, terminated = self.run_simulated(scenario)
+        self.assertEqual(terminated, [1])
+        self.assertEqual(server.client_manager.timed_out_sessions, set())
+        self.assertTrue(server.timed_out_tcp_connections.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# python -m unittest test_icmp_packet.py
+import random
+import unittest
+from TCPOverICMP.tunnel_packet import ICMPTunnelPacket, Action, Direction
+from TCPOverICMP.icmp_packet import ICMPPacket, ICMPType
+
+
+#test building ICMP frames in place
+class TestICMPFrame(unittest.TestCase):
+
+    def tunnel_packet(self, payload: bytes, destination_host: str = ''):
+        return ICMPTunnelPacket(7, Action.DATA_TRANSFER, Direction.PROXY_SERVER, 42, destination_host, 80, payload)
+
+    def test_frame_matches_serialize(self):
+        for destination_host, payload in (('', b''), ('example.com', b'abc'), ('', bytes(range(256)) * 5 + b'x')):
+            packet = self.tunnel_packet(payload, destination_host)
+            frame = ICMPPacket.frame(ICMPType.EchoRequest, 0xbeef, 0xdead, packet)
+            serialized = ICMPPacket(ICMPType.EchoRequest, 0xbeef, 0xdead, packet.serialize()).serialize()
+            self.assertEqual(frame, serialized)
+
+            received = ICMPTunnelPacket.deserialize(ICMPPacket.deserialize(bytes(frame)).payload)
+            self.assertEqual(received.destination_host, destination_host)
+            self.assertEqual(received.payload, payload)
+
+    def test_set_identifier_updates_checksum(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            packet = self.tunnel_packet(bytes(rng.getrandbits(8) for _ in range(rng.randrange(64))))
+            frame = ICMPPacket.frame(ICMPType.EchoRequest, rng.getrandbits(16), 0xdead, packet)
+            identifier = rng.getrandbits(16)
+            ICMPPacket.set_identifier(frame, identifier)
+
+            expected = ICMPPacket(ICMPType.EchoRequest, identifier, 0xdead, packet.serialize()).serialize()
+            self.assertEqual(frame, expected)
+            self.assertEqual(ICMPPacket.deserialize(bytes(frame)).identifier, identifier)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# python -m unittest test_log_setup.py
+import atexit
+import logging
+import logging.handlers
+import unittest
+from TCPOverICMP import log_setup
+from TCPOverICMP.log_setup import PacketLog
+
+
+class CountingRepr:
+    def __init__(self):
+        self.formatted = 0
+
+    def __repr__(self):
+        self.formatted += 1
+        return 'packet'
+
+    __str__ = __repr__
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+#test the sampled packet log
+class TestPacketLog(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_log_setup.packets')
+        self.logger.propagate = False
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_disabled_packets_are_not_formatted(self):
+        self.logger.setLevel(logging.INFO)
+        packet = CountingRepr()
+        packet_log = PacketLog(self.logger.name)
+        for _ in range(10):
+            packet_log.debug('Received: %s', packet)
+        self.assertEqual(packet.formatted, 0)
+        self.assertEqual(self.handler.messages, [])
+
+    def test_sampling(self):
+        self.logger.setLevel(logging.DEBUG)
+        packet = CountingRepr()
+        packet_log = PacketLog(self.logger.name, sample_every=4)
+        for _ in range(10):
+            packet_log.debug('Received: %s', packet)
+        self.assertEqual(self.handler.messages, ['Received: packet'] * 2)
+
+        packet_log.sample_every = 0
+        packet_log.debug('Received: %s', packet)
+        self.assertEqual(len(self.handler.messages), 2)
+
+
+#test the logging configuration
+class TestConfigureLogging(unittest.TestCase):
+
+    def setUp(self):
+        root = logging.getLogger()
+        handlers, level = root.handlers[:], root.level
+        self.handler = RecordingHandler()
+        root.handlers = [self.handler]
+
+        def restore():
+            root.handlers = handlers
+            root.setLevel(level)
+            log_setup.packet_log.sample_every = 1
+        self.addCleanup(restore)
+
+    def test_level_and_sample(self):
+        self.assertIsNone(log_setup.configure_logging('WARNING', packet_sample=5))
+        self.assertEqual(logging.getLogger().level, logging.WARNING)
+        self.assertEqual(log_setup.packet_log.sample_every, 5)
+
+    def test_records_are_written_off_the_loop(self):
+        listener = log_setup.configure_logging('INFO', use_queue=True)
+        self.assertIsInstance(logging.getLogger().handlers[0], logging.handlers.QueueHandler)
+        logging.getLogger('test_log_setup').info('hello %s', 'world')
+        listener.stop()
+        atexit.unregister(listener.stop)
+        self.assertEqual(self.handler.messages, ['hello world'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# python -m unittest test_pacing.py
+import asyncio
+import unittest
+from TCPOverICMP.pacing import Pacer
+from TCPOverICMP.simulator import Simulation, LinkModel
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, frame, destination):
+        self.sent.append((asyncio.get_event_loop().time(), bytes(frame), destination))
+
+
+#test the token bucket pacer
+class TestPacer(unittest.IsolatedAsyncioTestCase):
+
+    def paced(self, *args, **kwargs):
+        pacer = Pacer(*args, **kwargs)
+        socket = RecordingSocket()
+        pacer.bind(socket)
+        return pacer, socket
+
+    async def test_unpaced_packets_are_sent_right_away(self):
+        pacer, socket = self.paced()
+        for _ in range(100):
+            pacer.sendto(b'x' * 1000, '10.0.0.1')
+        self.assertEqual(len(socket.sent), 100)
+        self.assertIsNone(pacer.timer)
+
+    async def test_packets_are_spaced_evenly(self):
+        pacer, socket = self.paced(packets_per_second=1000)
+        for i in range(20):
+            pacer.sendto(bytes([i]), '10.0.0.1')
+        #the burst goes out at once, the rest waits on a single timer
+        self.assertEqual(len(socket.sent), 5)
+        self.assertIsNotNone(pacer.timer)
+
+        await asyncio.sleep(0.05)
+        self.assertEqual([frame[0] for _, frame, _ in socket.sent], list(range(20)))
+        self.assertAlmostEqual(socket.sent[-1][0] - socket.sent[0][0], 0.015, delta=0.01)
+
+    async def test_bytes_budget(self):
+        pacer, socket = self.paced(bytes_per_second=100_000)
+        for _ in range(10):
+            pacer.sendto(b'x' * 1000, '10.0.0.1')
+        #the burst is a full sized packet
+        self.assertEqual(len(socket.sent), 1)
+
+        await asyncio.sleep(0.15)
+        self.assertEqual(len(socket.sent), 10)
+        self.assertGreaterEqual(socket.sent[-1][0] - socket.sent[0][0], 0.08)
+
+    async def test_full_queue_drops(self):
+        pacer, socket = self.paced(packets_per_second=1)
+        for _ in range(Pacer.MAX_QUEUE + 10):
+            pacer.sendto(b'x', '10.0.0.1')
+        self.assertEqual(len(pacer.queue), Pacer.MAX_QUEUE)
+        self.assertEqual(pacer.dropped, 9)
+
+    async def test_queued_frames_are_tracked(self):
+        pacer, socket = self.paced(packets_per_second=1000)
+        first, second = bytearray(b'first'), bytearray(b'second')
+        for frame in (b'x', b'x', b'x', b'x', b'x', first, second):
+            pacer.sendto(frame, '10.0.0.1')
+        self.assertTrue(pacer.is_queued(first))
+
+        await asyncio.sleep(0.05)
+        self.assertFalse(pacer.is_queued(first))
+        self.assertFalse(pacer.is_queued(second))
+
+    async def test_queued_frames_are_told_apart_from_their_copies(self):
+        pacer, socket = self.paced(packets_per_second=20)
+        frame = bytearray(b'frame')
+        pacer.sendto(b'x', '10.0.0.1')
+        pacer.sendto(frame, '10.0.0.1')
+        pacer.sendto(frame, '10.0.0.1')
+        self.assertFalse(pacer.is_queued(bytearray(b'frame')))
+        #queued twice, it waits until both were sent
+        await asyncio.sleep(0.07)
+        self.assertEqual(len(socket.sent), 2)
+        self.assertTrue(pacer.is_queued(frame))
+        await asyncio.sleep(0.1)
+        self.assertFalse(pacer.is_queued(frame))
+        self.assertEqual(pacer.queued, {})
+
+    async def test_flush_checks_the_budget_again(self):
+        pacer, socket = self.paced(packets_per_second=100)
+        pacer.sendto(b'first', '10.0.0.1')
+        pacer.sendto(b'second', '10.0.0.1')
+        #the rate dropped after the timer was set for the old rate
+        pacer.set_packets_rate(pacer.packets, 10)
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(socket.sent), 1)
+        self.assertIsNotNone(pacer.timer)
+
+        await asyncio.sleep(0.1)
+        self.assertEqual([frame for _, frame, _ in socket.sent], [b'first', b'second'])
+        self.assertGreaterEqual(socket.sent[1][0] - socket.sent[0][0], 0.09)
+
+    async def test_adaptive_budget_follows_the_peers(self):
+        pacer, socket = self.paced(adaptive=True)
+        self.assertIsNone(pacer.data_packets.rate)
+        pacer.set_peer_rate('10.0.0.1', 400)
+        pacer.set_peer_rate('10.0.0.2', 400)
+        pacer.set_peer_rate('10.0.0.1', 200)
+        self.assertAlmostEqual(pacer.data_packets.rate, Pacer.ADAPTIVE_GAIN * 600)
+
+        #the rate of a dead peer no longer adds to the budget
+        pacer.forget_peer('10.0.0.2')
+        self.assertAlmostEqual(pacer.data_packets.rate, Pacer.ADAPTIVE_GAIN * 200)
+        pacer.forget_peer('10.0.0.1')
+        self.assertIsNone(pacer.data_packets.rate)
+        self.assertEqual(pacer.peer_rates, {})
+
+    async def test_control_packets_skip_the_adaptive_budget(self):
+        pacer, socket = self.paced(adaptive=True)
+        pacer.set_peer_rate('10.0.0.1', 100)
+        for _ in range(10):
+            pacer.sendto(b'data', '10.0.0.1')
+        self.assertEqual(len(socket.sent), 1)
+        #acks go out right away, ahead of the data waiting for budget
+        for _ in range(10):
+            pacer.sendto(b'ack', '10.0.0.1', control=True)
+        self.assertEqual(len(socket.sent), 11)
+        self.assertEqual(len(pacer.queue), 9)
+
+
+#test a transfer paced below a small link queue
+class TestPacedLink(unittest.TestCase):
+
+    def test_pacing_avoids_queue_drops(self):
+        unpaced = Simulation(0, LinkModel(queue_size=8 * 1024)).run(500_000)
+        paced = Simulation(0, LinkModel(queue_size=8 * 1024), pacing={'bytes_per_second': 950_000}).run(500_000)
+        self.assertEqual(paced.delivered, 500_000)
+        self.assertGreater(unpaced.link_drops, 0)
+        self.assertLess(paced.link_drops, unpaced.link_drops)
+
+    def test_adaptive_pacing_does_not_hold_acks(self):
+        result = Simulation(0, LinkModel(delay=0.1), pacing={'adaptive': True}).run(500_000, time_limit=60, echo=True)
+        self.assertEqual(result.delivered, 500_000)
+        #acks used to wait for the budget of the data, timing the peer out
+        self.assertLess(result.retransmits, result.data_packets / 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
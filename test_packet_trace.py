@@ -0,0 +1,88 @@
+# python -m unittest test_packet_trace.py
+import os
+import socket
+import struct
+import tempfile
+import unittest
+from TCPOverICMP.icmp_packet import ICMPPacket, ICMPType
+from TCPOverICMP.packet_trace import PacketTrace, PCAP_HEADER, PCAP_RECORD, PCAP_MAGIC, LINKTYPE_RAW
+
+
+LOCAL = '10.0.0.1'
+PEER = '10.0.0.2'
+
+
+def received(frame: bytes):
+    #a frame as the raw socket returns it, behind the IPv4 header
+    return struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(frame), 0, 0, 64, socket.IPPROTO_ICMP, 0,
+                       socket.inet_aton(PEER), socket.inet_aton(LOCAL)) + frame
+
+
+def frame(seq: int, size: int = 100):
+    return ICMPPacket(ICMPType.EchoRequest, 0xbeef, seq, bytes([seq % 256]) * size).serialize()
+
+
+#test the ring of the recent frames
+class TestPacketTrace(unittest.TestCase):
+
+    def test_ring_keeps_the_recent_frames(self):
+        trace = PacketTrace(capacity=4, snaplen=32)
+        trace.record_received(received(frame(0)))
+        for seq in range(1, 6):
+            trace.record_sent(frame(seq), PEER)
+
+        frames = trace.frames()
+        self.assertEqual([data[8] for _, _, _, _, data in frames], [2, 3, 4, 5])
+        _, source, destination, length, data = frames[-1]
+        #the local ip was learned from the received frame
+        self.assertEqual((source, destination), (LOCAL, PEER))
+        self.assertEqual(length, 108)
+        self.assertEqual(data, bytes(frame(5))[:32])
+        self.assertEqual(sorted(frames), frames)
+
+    def test_received_frames_drop_the_ip_header(self):
+        trace = PacketTrace(capacity=4, snaplen=256)
+        trace.record_received(received(frame(1, size=10)))
+        [(_, source, destination, length, data)] = trace.frames()
+        self.assertEqual((source, destination), (PEER, LOCAL))
+        self.assertEqual((length, data), (18, bytes(frame(1, size=10))))
+
+    def test_disabled_trace_records_nothing(self):
+        trace = PacketTrace(capacity=0)
+        trace.record_sent(frame(1), PEER)
+        trace.record_received(received(frame(1)))
+        self.assertEqual(trace.frames(), [])
+
+    def test_pcap_dump(self):
+        trace = PacketTrace(capacity=8, snaplen=64)
+        trace.record_received(received(frame(1, size=10)))
+        trace.record_sent(frame(2, size=1000), PEER)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.pcap')
+            self.assertEqual(trace.dump(path), 2)
+            with open(path, 'rb') as pcap:
+                dumped = pcap.read()
+
+        magic, major, minor, _, _, snaplen, linktype = PCAP_HEADER.unpack_from(dumped)
+        self.assertEqual((magic, major, minor, snaplen, linktype), (PCAP_MAGIC, 2, 4, 84, LINKTYPE_RAW))
+        offset = PCAP_HEADER.size
+        records = []
+        while offset < len(dumped):
+            _, _, captured, original = PCAP_RECORD.unpack_from(dumped, offset)
+            offset += PCAP_RECORD.size
+            records.append((original, dumped[offset:offset + captured]))
+            offset += captured
+        self.assertEqual(offset, len(dumped))
+
+        (first_length, first), (second_length, second) = records
+        self.assertEqual(first_length, 20 + 18)
+        self.assertEqual(first, received(frame(1, size=10))[:10] + first[10:12] + received(frame(1, size=10))[12:])
+        self.assertEqual(ICMPPacket.compute_checksum(first[:20]), 0)
+        self.assertEqual(second_length, 20 + 1008)
+        self.assertEqual(len(second), 84)
+        self.assertEqual(second[12:20], socket.inet_aton(LOCAL) + socket.inet_aton(PEER))
+        self.assertEqual(second[20:], bytes(frame(2, size=1000))[:64])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# python -m unittest test_path_selector.py
+import random
+import unittest
+from TCPOverICMP.path_selector import PathSelector
+
+
+#test weighted path choice
+class TestPathSelector(unittest.TestCase):
+
+    def test_faster_path_is_preferred(self):
+        selector = PathSelector(['10.0.0.1'], [1, 2], random.Random(0))
+        for _ in range(20):
+            selector.on_ack('10.0.0.1', 1, 0.01)
+            selector.on_ack('10.0.0.1', 2, 0.1)
+
+        choices = [selector.choose_identifier('10.0.0.1') for _ in range(1000)]
+        self.assertGreater(choices.count(1), 800)
+
+    def test_lossy_endpoint_is_avoided_but_probed(self):
+        selector = PathSelector(['10.0.0.1', '10.0.0.2'], [1], random.Random(0))
+        for _ in range(50):
+            selector.on_ack('10.0.0.1', 1, 0.05)
+            selector.on_timeout('10.0.0.2', 1)
+
+        choices = [selector.choose_endpoint() for _ in range(1000)]
+        self.assertGreater(choices.count('10.0.0.1'), 900)
+        self.assertGreater(choices.count('10.0.0.2'), 0)
+
+    def test_excluded_endpoints_are_not_chosen(self):
+        selector = PathSelector(['10.0.0.1', '10.0.0.2'], [1], random.Random(0))
+        choices = {selector.choose_endpoint(excluded=['10.0.0.2']) for _ in range(100)}
+        self.assertEqual(choices, {'10.0.0.1'})
+        #with every endpoint excluded, all are chosen from
+        choices = {selector.choose_endpoint(excluded=['10.0.0.1', '10.0.0.2']) for _ in range(100)}
+        self.assertEqual(choices, {'10.0.0.1', '10.0.0.2'})
+
+
+if __name__ == "__main__":
+    unittest.main()
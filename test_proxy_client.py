@@ -0,0 +1,96 @@
+# python -m unittest test_proxy_client.py
+import asyncio
+import unittest
+from TCPOverICMP.proxy_client import ProxyClient
+from TCPOverICMP.proxy_server import ProxyServer
+from TCPOverICMP.simulator import Simulation, SimulatedICMPSocket, SinkWriter, VirtualClockEventLoop
+from TCPOverICMP.tcp_server import NewConnection
+from TCPOverICMP.tunnel_packet import Action
+
+
+class SimulatedProxyClient(ProxyClient):
+    """
+    proxy client sending its ICMP packets over a simulated link
+    """
+    def __init__(self, simulation: Simulation):
+        self.simulation = simulation
+        super(SimulatedProxyClient, self).__init__(Simulation.SERVER_ADDRESS, {})
+
+    def create_icmp_socket(self, packet_queue: asyncio.Queue):
+        return SimulatedICMPSocket(packet_queue, self.simulation, Simulation.CLIENT_ADDRESS)
+
+
+class SimulatedProxyServer(ProxyServer):
+    """
+    proxy server sending its ICMP packets over a simulated link, its connections take CONNECT_TIME to open
+    """
+    CONNECT_TIME = 0.5
+
+    def __init__(self, simulation: Simulation):
+        self.simulation = simulation
+        super(SimulatedProxyServer, self).__init__()
+
+    def create_icmp_socket(self, packet_queue: asyncio.Queue):
+        return SimulatedICMPSocket(packet_queue, self.simulation, Simulation.SERVER_ADDRESS)
+
+    async def open_tcp_connection(self, destination_host, port, mss=1400):
+        await asyncio.sleep(self.CONNECT_TIME)
+        return asyncio.StreamReader(), SinkWriter(lambda size: None)
+
+
+#test the sessions of the proxy client against a simulated proxy server
+class TestProxyClient(unittest.TestCase):
+
+    def run_simulated(self, scenario):
+        loop = VirtualClockEventLoop()
+        try:
+            return loop.run_until_complete(scenario())
+        finally:
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+    def test_session_closed_before_its_start_is_acked(self):
+        async def scenario():
+            simulation = Simulation(0)
+            client, server = SimulatedProxyClient(simulation), SimulatedProxyServer(simulation)
+            simulation.sockets = {
+                Simulation.CLIENT_ADDRESS: client.icmp_socket,
+                Simulation.SERVER_ADDRESS: server.icmp_socket,
+            }
+            #the tunnels run without the local TCP server of the proxy client
+            client.main_coroutines.pop(-2).close()
+            tasks = [asyncio.create_task(client.run()), asyncio.create_task(server.run())]
+
+            acked = []
+            send_icmp_packet_wait_ack = client.send_icmp_packet_wait_ack
+
+            async def record_ack(icmp_tunnel_packet, destination):
+                result = await send_icmp_packet_wait_ack(icmp_tunnel_packet, destination)
+                acked.append((icmp_tunnel_packet.action, result))
+                return result
+            client.send_icmp_packet_wait_ack = record_ack
+
+            #the application sends a request and closes right away, while the proxy server is still connecting
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'request')
+            reader.feed_eof()
+            await client.open_session(NewConnection(5, reader, SinkWriter(lambda size: None), 'backend', 80))
+            await asyncio.sleep(10)
+            for task in tasks:
+                self.assertFalse(task.done())
+            return client, server, acked
+
+        client, server, acked = self.run_simulated(scenario)
+        self.assertEqual(sorted(acked, key=lambda ack: ack[0].value), [(Action.START, True), (Action.TERMINATE, True)])
+        self.assertEqual(client.packets_waiting_ack, {})
+        self.assertFalse(client.client_manager.client_exists((Simulation.SERVER_ADDRESS, 5)))
+        self.assertFalse(server.client_manager.client_exists((Simulation.CLIENT_ADDRESS, 5)))
+        self.assertEqual(server.pending_sessions, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+# python -m unittest test_proxy_server.py
+import asyncio
+import functools
+import unittest
+from TCPOverICMP.icmp_packet import ICMPPacket
+from TCPOverICMP.proxy_server import ProxyServer
+from TCPOverICMP.tunnel_packet import ICMPTunnelPacket, Action, Direction
+
+
+PEER = '10.0.0.1'
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, frame, destination):
+        self.sent.append(ICMPTunnelPacket.deserialize(ICMPPacket.deserialize(bytes(frame)).payload))
+
+    async def wait_for_incoming_packet(self):
+        await asyncio.Event().wait()
+
+
+class FakeWriter:
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+class RecordingProxyServer(ProxyServer):
+    """
+    proxy server sending on a recording socket, its connections open once connected is set
+    """
+    def create_icmp_socket(self, packet_queue: asyncio.Queue):
+        return RecordingSocket()
+
+    async def open_tcp_connection(self, destination_host, port, mss=1400):
+        writer = FakeWriter()
+        self.writers.append(writer)
+        await self.connected.wait()
+        return asyncio.StreamReader(), writer
+
+
+#test the sessions of the proxy server
+class TestProxyServer(unittest.IsolatedAsyncioTestCase):
+
+    def start_server(self):
+        server = RecordingProxyServer()
+        server.connected, server.writers = asyncio.Event(), []
+        #the packets are handled by calling the operations, the tunnel is not run
+        for coroutine in server.main_coroutines:
+            coroutine.close()
+        return server
+
+    def packet(self, action, seq=0, payload=b'', destination_host='backend', port=80):
+        return ICMPTunnelPacket(
+            session_id=7, seq=seq, action=action, direction=Direction.PROXY_SERVER,
+            destination_host=destination_host, port=port, payload=payload,
+        )
+
+    async def test_session_terminated_while_connecting_is_closed(self):
+        server = self.start_server()
+        await server.start_session(self.packet(Action.START, payload=b'request'), PEER)
+        await server.handle_data(self.packet(Action.DATA_TRANSFER, seq=1, payload=b'more'), PEER)
+        await server.terminate_session(self.packet(Action.TERMINATE, seq=ProxyServer.TERMINATE_SEQ), PEER)
+        server.connected.set()
+        await asyncio.sleep(0.01)
+
+        [writer] = server.writers
+        self.assertTrue(writer.closed)
+        self.assertEqual(writer.written, [])
+        self.assertFalse(server.client_manager.client_exists((PEER, 7)))
+        self.assertEqual(server.pending_sessions, {})
+        self.assertEqual(server.cancelled_sessions, set())
+        #the TERMINATE is acked, then the START so the peer doesn't repeat it
+        self.assertEqual(
+            [(packet.action, packet.seq) for packet in server.icmp_socket.sent],
+            [(Action.ACK, ProxyServer.TERMINATE_SEQ), (Action.ACK, 0)]
+        )
+
+    async def test_early_data_is_written_behind_the_start(self):
+        server = self.start_server()
+        await server.start_session(self.packet(Action.START, payload=b'request'), PEER)
+        for seq in range(1, ProxyServer.MAX_EARLY_PACKETS + 1):
+            await server.handle_data(self.packet(Action.DATA_TRANSFER, seq=seq, payload=b'x'), PEER)
+        server.connected.set()
+        await asyncio.sleep(0.01)
+
+        self.assertTrue(server.client_manager.client_exists((PEER, 7)))
+        self.assertEqual(server.writers[0].written, [b'request'] + [b'x'] * ProxyServer.MAX_EARLY_PACKETS)
+        await server.client_manager.remove_client((PEER, 7))
+
+    async def test_start_to_another_destination_replaces_the_session(self):
+        server = self.start_server()
+        server.connected.set()
+        await server.start_session(self.packet(Action.START, payload=b'old'), PEER)
+        await asyncio.sleep(0.01)
+        #a repeated START only gets its ack again
+        await server.start_session(self.packet(Action.START, payload=b'old'), PEER)
+        #the peer restarted and reuses the session id for a connection to another destination
+        await server.start_session(self.packet(Action.START, payload=b'new', destination_host='other', port=443), PEER)
+        await asyncio.sleep(0.01)
+
+        old_writer, new_writer = server.writers
+        self.assertTrue(old_writer.closed)
+        self.assertEqual(new_writer.written, [b'new'])
+        self.assertEqual(server.client_manager.client_destination((PEER, 7)), ('other', 443))
+        self.assertEqual([packet.action for packet in server.icmp_socket.sent], [Action.ACK] * 3)
+        await server.client_manager.remove_client((PEER, 7))
+
+    async def test_start_to_another_destination_replaces_the_session_being_opened(self):
+        server = self.start_server()
+        await server.start_session(self.packet(Action.START, payload=b'old'), PEER)
+        await server.handle_data(self.packet(Action.DATA_TRANSFER, seq=1, payload=b'old data'), PEER)
+        await server.start_session(self.packet(Action.START, payload=b'new', destination_host='other', port=443), PEER)
+        await server.handle_data(self.packet(Action.DATA_TRANSFER, seq=1, payload=b'new data'), PEER)
+        server.connected.set()
+        await asyncio.sleep(0.01)
+
+        old_writer, new_writer = server.writers
+        self.assertTrue(old_writer.closed)
+        self.assertEqual(old_writer.written, [])
+        self.assertEqual(new_writer.written, [b'new', b'new data'])
+        self.assertEqual(server.client_manager.client_destination((PEER, 7)), ('other', 443))
+        self.assertEqual((server.pending_sessions, server.pending_destinations), ({}, {}))
+        self.assertEqual(server.peer_session_count(PEER), 1)
+        #only the START of the new session is acked
+        self.assertEqual(
+            [packet.action for packet in server.icmp_socket.sent if packet.action == Action.ACK and packet.seq == 0],
+            [Action.ACK]
+        )
+        await server.client_manager.remove_client((PEER, 7))
+
+    async def test_invalid_destination_is_rejected(self):
+        server = self.start_server()
+        #the connection is opened through the resolver
+        server.open_tcp_connection = functools.partial(ProxyServer.open_tcp_connection, server)
+        await server.start_session(self.packet(Action.START, destination_host='a..b'), PEER)
+        await asyncio.sleep(0.01)
+
+        self.assertEqual([packet.action for packet in server.icmp_socket.sent], [Action.REJECT])
+        self.assertEqual(server.pending_sessions, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
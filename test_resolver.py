@@ -0,0 +1,91 @@
+# python -m unittest test_resolver.py
+import asyncio
+import socket
+import unittest
+from TCPOverICMP.resolver import ResolverCache
+
+
+class StandInResolver:
+    def __init__(self, addresses):
+        self.addresses = addresses
+        self.lookups = []
+
+    async def __call__(self, host):
+        self.lookups.append(host)
+        await asyncio.sleep(0.01)
+        host.encode('idna')
+        if host not in self.addresses:
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return self.addresses[host]
+
+
+#test destination hostname resolver cache
+class TestResolverCache(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrent_lookups_are_shared(self):
+        resolver = StandInResolver({'backend': ['10.0.0.1']})
+        cache = ResolverCache(resolver)
+
+        addresses = await asyncio.gather(*(cache.resolve('backend') for _ in range(100)))
+        self.assertEqual(set(addresses), {('10.0.0.1',)})
+        self.assertEqual(await cache.resolve('backend'), ('10.0.0.1',))
+        self.assertEqual(resolver.lookups, ['backend'])
+
+    async def test_failed_lookups_are_cached(self):
+        resolver = StandInResolver({})
+        cache = ResolverCache(resolver)
+
+        errors = []
+        for _ in range(3):
+            with self.assertRaises(OSError) as raised:
+                await cache.resolve('missing')
+            errors.append(raised.exception)
+        self.assertEqual(resolver.lookups, ['missing'])
+        #a cached failure is raised as a new exception every time
+        self.assertEqual(len({id(error) for error in errors}), 3)
+        self.assertEqual(errors[2].errno, socket.EAI_NONAME)
+
+    async def test_invalid_hostnames_fail_like_unknown_ones(self):
+        resolver = StandInResolver({'empty': []})
+        cache = ResolverCache(resolver)
+
+        for host in ('a..b', 'empty'):
+            for _ in range(2):
+                with self.assertRaises(OSError):
+                    await cache.resolve(host)
+        with self.assertRaises(OSError):
+            await cache.open_connection('empty', 80)
+        #the failures are cached
+        self.assertEqual(resolver.lookups, ['a..b', 'empty'])
+
+    async def test_expired_entries_are_resolved_again(self):
+        resolver = StandInResolver({'backend': ['10.0.0.1']})
+        cache = ResolverCache(resolver, ttl=0)
+
+        await cache.resolve('backend')
+        await cache.resolve('backend')
+        self.assertEqual(resolver.lookups, ['backend', 'backend'])
+
+    async def test_addresses_are_not_resolved(self):
+        resolver = StandInResolver({})
+        cache = ResolverCache(resolver)
+
+        self.assertEqual(await cache.resolve('127.0.0.1'), ('127.0.0.1',))
+        self.assertEqual(resolver.lookups, [])
+
+    async def test_every_address_is_tried(self):
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        #nothing listens on the first address
+        cache = ResolverCache(StandInResolver({'backend': ['127.0.0.2', '127.0.0.1']}))
+        try:
+            reader, writer = await cache.open_connection('backend', port)
+            self.assertEqual(writer.get_extra_info('peername')[0], '127.0.0.1')
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+# python -m unittest test_simulator.py
+import unittest
+from unittest import mock
+from TCPOverICMP.client_manager import ClientManager
+from TCPOverICMP.simulator import Simulation, LinkModel
+
+
+#test the simulated tunnel over a modeled link
+class TestSimulator(unittest.TestCase):
+
+    def test_lossless_link_delivers_everything(self):
+        result = Simulation(0, LinkModel(queue_size=10 * 1024 * 1024)).run(100_000, sessions=2)
+        self.assertEqual(result.delivered, 200_000)
+        self.assertEqual(result.retransmits, 0)
+        self.assertLess(result.duration, 1.0)
+
+    def test_same_seed_is_reproducible(self):
+        def run(seed):
+            result = Simulation(seed, LinkModel(loss=0.05, reorder=0.1, duplicate=0.05)).run(50_000)
+            return result.duration, result.delivered, result.latencies, result.retransmits, result.link_drops
+
+        self.assertEqual(run(7), run(7))
+
+    def test_lost_packets_are_resent(self):
+        result = Simulation(1, LinkModel(loss=0.1, queue_size=10 * 1024 * 1024)).run(50_000)
+        self.assertEqual(result.delivered, 50_000)
+        self.assertGreater(result.retransmits, 0)
+        self.assertGreaterEqual(result.duration, 1.0)
+
+    def test_acks_ride_on_echoed_data(self):
+        result = Simulation(0, LinkModel(queue_size=10 * 1024 * 1024)).run(50_000, echo=True)
+        self.assertEqual(result.delivered, 50_000)
+        self.assertEqual(result.retransmits, 0)
+        #every data packet used to get an ack packet of its own
+        self.assertLess(result.ack_packets, result.data_packets / 4)
+
+    def test_echo_larger_than_the_window(self):
+        result = Simulation(0, LinkModel(delay=0.1)).run(1_000_000, time_limit=60, echo=True)
+        self.assertEqual(result.delivered, 1_000_000)
+        #acks held by data waiting for a full window used to time out the peer, collapsing both directions
+        self.assertGreater(result.throughput, 100_000)
+        self.assertLess(result.retransmits, result.data_packets / 3)
+
+    def test_send_buffer_does_not_throttle_echo(self):
+        bounded = Simulation(0, LinkModel()).run(1_000_000, time_limit=60, echo=True)
+        with mock.patch.object(ClientManager, 'SEND_BUFFER', 1 << 30):
+            unbounded = Simulation(0, LinkModel()).run(1_000_000, time_limit=60, echo=True)
+        self.assertEqual(bounded.delivered, 1_000_000)
+        #reading paused on the send buffer until the acks held behind the window arrived, 24x slower
+        self.assertGreater(bounded.throughput, 0.75 * unbounded.throughput)
+
+
+if __name__ == '__main__':
+    unittest.main()
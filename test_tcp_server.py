@@ -0,0 +1,61 @@
+# python -m unittest test_tcp_server.py
+import asyncio
+import socket
+import struct
+import unittest
+from TCPOverICMP import socks5
+from TCPOverICMP.tcp_server import TCPServer
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+#test forwarded and SOCKS5 listeners
+class TestTCPServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.forward_port, self.socks_port = free_port(), free_port()
+        self.incoming = asyncio.Queue()
+        server = TCPServer('127.0.0.1', {self.forward_port: ('10.0.0.1', 80)}, self.incoming, self.socks_port)
+        self.server_task = asyncio.create_task(server.server_loop())
+        await asyncio.sleep(0.05)
+
+    async def asyncTearDown(self):
+        self.server_task.cancel()
+
+    async def test_forwarded_port_has_fixed_destination(self):
+        _, writer = await asyncio.open_connection('127.0.0.1', self.forward_port)
+        connection = await asyncio.wait_for(self.incoming.get(), 1)
+        self.assertEqual((connection.destination_host, connection.destination_port), ('10.0.0.1', 80))
+        self.assertFalse(connection.socks)
+        writer.close()
+
+    async def test_socks_connection_chooses_destination(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.socks_port)
+        writer.write(bytes((socks5.VERSION, 1, socks5.NO_AUTHENTICATION)))
+        self.assertEqual(await reader.readexactly(2), bytes((socks5.VERSION, socks5.NO_AUTHENTICATION)))
+        host = b'backend.example'
+        writer.write(bytes((socks5.VERSION, socks5.CONNECT, 0, socks5.DOMAIN_NAME, len(host))) + host + struct.pack('>H', 443))
+
+        connection = await asyncio.wait_for(self.incoming.get(), 1)
+        self.assertEqual((connection.destination_host, connection.destination_port), ('backend.example', 443))
+        self.assertTrue(connection.socks)
+        writer.close()
+
+    async def test_unsupported_socks_command_is_refused(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.socks_port)
+        writer.write(bytes((socks5.VERSION, 1, socks5.NO_AUTHENTICATION)))
+        await reader.readexactly(2)
+        writer.write(bytes((socks5.VERSION, 0x02, 0, socks5.IPV4, 10, 0, 0, 1)) + struct.pack('>H', 80))
+
+        reply = await reader.readexactly(socks5.REPLY_STRUCT.size)
+        self.assertEqual(reply[1], socks5.COMMAND_NOT_SUPPORTED)
+        self.assertTrue(self.incoming.empty())
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
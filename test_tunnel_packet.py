@@ -0,0 +1,34 @@
+# python -m unittest test_tunnel_packet.py
+import unittest
+from TCPOverICMP.tunnel_packet import ICMPTunnelPacket, Action, Direction
+
+
+#test acks carried by tunnel packets
+class TestTunnelPacketAcks(unittest.TestCase):
+
+    def test_data_carries_acks(self):
+        packet = ICMPTunnelPacket(3, Action.DATA_TRANSFER, Direction.PROXY_CLIENT, 10, payload=b'data', acks=(4, 5, 7))
+        serialized = packet.serialize()
+        self.assertEqual(len(serialized), packet.serialized_size())
+
+        received = ICMPTunnelPacket.deserialize(serialized)
+        self.assertEqual(received.acked_seqs(), (4, 5, 7))
+        self.assertEqual(received.payload, b'data')
+        self.assertEqual(received.port, 0)
+
+    def test_ack_acknowledges_its_sequence(self):
+        packet = ICMPTunnelPacket(3, Action.ACK, Direction.PROXY_CLIENT, 4, acks=(5, 6))
+        self.assertEqual(ICMPTunnelPacket.deserialize(packet.serialize()).acked_seqs(), (4, 5, 6))
+
+        single = ICMPTunnelPacket(3, Action.ACK, Direction.PROXY_CLIENT, 4)
+        self.assertEqual(ICMPTunnelPacket.deserialize(single.serialize()).acked_seqs(), (4,))
+
+    def test_start_keeps_its_port(self):
+        packet = ICMPTunnelPacket(3, Action.START, Direction.PROXY_SERVER, 0, 'example.com', 443, b'hello')
+        received = ICMPTunnelPacket.deserialize(packet.serialize())
+        self.assertEqual((received.destination_host, received.port, received.payload), ('example.com', 443, b'hello'))
+        self.assertEqual(received.acked_seqs(), ())
+
+
+if __name__ == '__main__':
+    unittest.main()